@@ -0,0 +1,325 @@
+import asyncio
+import math
+import struct
+import time
+from pymodbus.client import AsyncModbusTcpClient
+from pymodbus.exceptions import ConnectionException, ModbusIOException
+from PyPLCConnection import (
+    DISTANCE_DATA_ADDRESS, DISTANCE_SENSOR_ANGLE, OUTPUT_COILS, PPS_Y_ADDRESS, PPS_Z_ADDRESS,
+    PULSE_RATE_MAX_AGE, RECONNECT_ATTEMPTS, RECONNECT_BACKOFF, RECONNECT_BACKOFF_MAX, TAG_EXPORT,
+    _contiguous_runs, _pulse_rate_axes, pulses_per_mm, travel_distance_mm, travel_plan,
+)
+from plc_tags import COIL, TagDatabase
+
+
+class AsyncPyPLCConnection:
+    """
+    asyncio counterpart of PyPLCConnection on pymodbus's AsyncModbusTcpClient.
+
+    Addresses are the same 1-based CLICK/BRX addresses. Every request is a coroutine, so gantry
+    commands and robot commands (e.g. AsyncFANUCDriver) can run concurrently on one event loop:
+
+        async with AsyncPyPLCConnection(PLC_IP) as plc:
+            gantry = asyncio.create_task(plc.travel(Z_UP_MOTION, 4, "mm", "z"))
+            await robot.write_cartesian_position(pose)
+            await gantry
+
+    Cancelling a travel() task drops the motion coil before the cancellation propagates.
+    """
+
+    def __init__(self, ip_address, port=502, tags=None):
+        # The Modbus connection is opened on first use (or by connect()).
+        self.ip_address = ip_address
+        self.port = port
+        self._tags = tags           # TagDatabase, loaded from TAG_EXPORT on first use
+        self.client = None
+        self.connects = 0
+        self.frames = 0     # Modbus requests sent
+        self.writes = 0     # write requests sent
+        self._connect_lock = None   # created on the running loop, see connect_to_plc()
+        self._pulse_rates = {}      # axis -> (cached pulse rate, time.monotonic() it was read), see pulse_rate()
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.close_connection()
+
+    async def connect(self):
+        """
+        Open the Modbus TCP connection to the PLC.
+
+        :return: True if the PLC is connected
+        """
+        try:
+            await self.connect_to_plc()
+            return True
+        except ConnectionException:
+            return False
+
+    async def connect_to_plc(self):
+        """
+        Return the persistent Modbus client, connecting it first if needed.
+        Retries with exponential backoff and raises ConnectionException if the PLC stays unreachable.
+        """
+        if self.client is not None and self.client.connected:
+            return self.client
+        if self._connect_lock is None:
+            self._connect_lock = asyncio.Lock()
+
+        async with self._connect_lock:
+            # another task may have connected while this one waited for the lock
+            if self.client is not None and self.client.connected:
+                return self.client
+
+            delay = RECONNECT_BACKOFF
+            for attempt in range(1, RECONNECT_ATTEMPTS + 1):
+                try:
+                    if self.client is None:
+                        # reconnects are handled here, not by pymodbus in the background
+                        self.client = AsyncModbusTcpClient(self.ip_address, port=self.port, reconnect_delay=0)
+                    if await self.client.connect():
+                        self.connects += 1
+                        # the rates may have changed while disconnected, e.g. on the HMI
+                        self._pulse_rates.clear()
+                        print(f"Connected to PLC at Address: {self.ip_address}:{self.port}")
+                        return self.client
+                    print(f"Failed to connect to PLC at Address: {self.ip_address}:{self.port} "
+                          f"(attempt {attempt}/{RECONNECT_ATTEMPTS})")
+                except Exception as e:
+                    print(f"Error while connecting to PLC: {e}")
+                if attempt < RECONNECT_ATTEMPTS:
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, RECONNECT_BACKOFF_MAX)
+
+            raise ConnectionException(f"PLC at {self.ip_address}:{self.port} is unreachable")
+
+    async def _execute(self, request, *args, **kwargs):
+        """
+        Run one pymodbus client request on the persistent connection.
+        If the socket turns out to be dead the request is retried once on a fresh connection.
+        pymodbus serializes concurrent requests on the socket.
+
+        :param request: name of the AsyncModbusTcpClient method, e.g. "write_coil"
+        """
+        for attempt in (1, 2):
+            client = await self.connect_to_plc()
+            try:
+                self.frames += 1
+                if request.startswith("write"):
+                    self.writes += 1
+                    for axis in _pulse_rate_axes(request, args, kwargs):
+                        self._pulse_rates.pop(axis, None)
+                return await getattr(client, request)(*args, **kwargs)
+            except (ConnectionException, ModbusIOException, OSError) as e:
+                client.close()
+                if attempt == 2:
+                    raise
+                print(f"[PLC] {request} failed ({e}), reconnecting")
+
+    async def health_check(self):
+        """
+        Check that the PLC answers by reading one coil.
+
+        :return: True if the PLC responded
+        """
+        try:
+            result = await self._execute("read_coils", 0, count=1)
+            return not result.isError()
+        except Exception as e:
+            print(f"[PLC] Health check failed: {e}")
+            return False
+
+    def close_connection(self):
+        """
+        Close the persistent connection, the next request reconnects.
+        """
+        if self.client is None:
+            return
+        print("Closing Connection")
+        self.client.close()
+
+    # === Coils and registers ===
+
+    async def write_modbus_coils(self, coil_address, value):
+        print(f"Writing {value} to address {coil_address}")
+        # Take care of the offset between pymodbus and the click plc
+        return await self._execute("write_coil", coil_address - 1, value)
+
+    async def read_modbus_coils(self, coil_address, number_of_coils=1):
+        result = await self._execute("read_coils", coil_address - 1, count=number_of_coils)
+        if result.isError():
+            raise ModbusIOException(f"read_coils {coil_address} failed: {result}")
+        return result.bits[0]
+
+    async def read_single_register(self, register_address):
+        result = await self._execute("read_holding_registers", register_address - 1)
+        if result.isError():
+            raise ModbusIOException(f"read_holding_registers {register_address} failed: {result}")
+        return result.registers[0]
+
+    async def write_single_register(self, register_address, value):
+        print("writing " + str(value) + " to register " + str(register_address))
+        return await self._execute("write_register", register_address - 1, value)
+
+    async def read_float_register(self, register_address):
+        try:
+            result = await self._execute("read_holding_registers", register_address - 1, count=2)
+            if result.isError() or len(result.registers) < 2:
+                raise ValueError(f"Invalid response from PLC: {result}")
+
+            # BRX = big-endian word order
+            raw = struct.pack(">HH", result.registers[0], result.registers[1])
+            return struct.unpack(">f", raw)[0]
+
+        except Exception as e:
+            print(f"[PLC] Error reading float at register {register_address}: {e}")
+            return None
+
+    async def write_float_register(self, register_address, value):
+        try:
+            high_word, low_word = struct.unpack('>HH', struct.pack('>f', value))
+            result = await self._execute("write_registers", register_address - 1, [high_word, low_word])
+            if result.isError():
+                raise ValueError("PLC did not acknowledge write")
+            return True
+
+        except Exception as e:
+            print(f"[PLC] Error writing float {value} to register {register_address}: {e}")
+            return False
+
+    async def read_coil_set(self, addresses):
+        """
+        Read several coils with one request over their spanning range.
+
+        :return: dict {coil_address: bool}
+        """
+        addresses = sorted(addresses)
+        first = addresses[0]
+        result = await self._execute("read_coils", first - 1, count=addresses[-1] - first + 1)
+        if result.isError():
+            raise ModbusIOException(f"read_coils {first}..{addresses[-1]} failed: {result}")
+        return {a: bool(result.bits[a - first]) for a in addresses}
+
+    async def read_register_set(self, addresses):
+        """
+        Read several holding registers with one request over their spanning range.
+
+        :return: dict {register_address: int}
+        """
+        addresses = sorted(addresses)
+        first = addresses[0]
+        result = await self._execute("read_holding_registers", first - 1, count=addresses[-1] - first + 1)
+        if result.isError():
+            raise ModbusIOException(f"read_holding_registers {first}..{addresses[-1]} failed: {result}")
+        return {a: result.registers[a - first] for a in addresses}
+
+    # === Tags ===
+
+    @property
+    def tags(self):
+        """
+        TagDatabase of the PLC program, see PyPLCConnection.tags.
+        """
+        if self._tags is None:
+            self._tags = TagDatabase.from_export(TAG_EXPORT)
+        return self._tags
+
+    async def read_tags(self, names):
+        """
+        Read PLC values by tag name, the blocks of the read plan are requested concurrently.
+
+        :return: dict {name: value}
+        """
+        tags = self.tags
+        plan = tags.read_plan(names)
+        results = await asyncio.gather(*(
+            self._execute("read_coils" if block.table == COIL else "read_holding_registers",
+                          block.start - 1, count=block.count) for block in plan))
+        values = {}
+        for block, result in zip(plan, results):
+            if result.isError():
+                raise ModbusIOException(f"Reading {block.table} {block.start}..{block.start + block.count - 1} "
+                                        f"failed: {result}")
+            values.update(tags.decode(block, result.bits if block.table == COIL else result.registers))
+        return {name: values[tags[name]] for name in names}
+
+    async def write_tags(self, values):
+        """
+        Write PLC values by tag name, one request per contiguous run of coils or registers.
+        """
+        coils, registers = self.tags.encode(values)
+        for run in _contiguous_runs(coils):
+            await self._execute("write_coils", run[0] - 1, [coils[a] for a in run])
+        for run in _contiguous_runs(registers):
+            await self._execute("write_registers", run[0] - 1, [registers[a] for a in run])
+
+    async def reset_coils(self):
+        """
+        Reset all defined Modbus coil outputs (turn them OFF), one request per output.
+        """
+        print("Resetting all coils to False...")
+        await asyncio.gather(*(self.write_modbus_coils(coil, False) for coil in OUTPUT_COILS))
+        print("All coils reset complete.")
+
+    async def read_current_distance(self):
+        angle_distance = await self.read_single_register(DISTANCE_DATA_ADDRESS)
+        return math.ceil(angle_distance * math.cos(math.radians(DISTANCE_SENSOR_ANGLE)))
+
+    # === Gantry travel ===
+
+    async def set_pulse_rates(self, pps_y=None, pps_z=None):
+        """
+        Set the Y and/or Z axis pulse rates (pulses per second).
+        """
+        if pps_y is not None:
+            await self.write_single_register(PPS_Y_ADDRESS, pps_y)
+            self._pulse_rates["y"] = (pps_y, time.monotonic())
+        if pps_z is not None:
+            await self.write_single_register(PPS_Z_ADDRESS, pps_z)
+            self._pulse_rates["z"] = (pps_z, time.monotonic())
+
+    async def pulse_rate(self, axis, refresh=False):
+        """
+        Pulse rate (pulses per second) of an axis, cached for PULSE_RATE_MAX_AGE seconds like
+        PyPLCConnection.pulse_rate(). Writes to a pulse rate register and a new connection clear the cache.
+        """
+        axis = axis.lower()
+        now = time.monotonic()
+        if refresh or axis not in self._pulse_rates or now - self._pulse_rates[axis][1] > PULSE_RATE_MAX_AGE:
+            address = {"y": PPS_Y_ADDRESS, "z": PPS_Z_ADDRESS}[axis]
+            self._pulse_rates[axis] = (await self.read_single_register(address), now)
+        return self._pulse_rates[axis][0]
+
+    async def travel_speed(self, axis):
+        """
+        Axis speed in mm/s from pulse_rate().
+        """
+        return await self.pulse_rate(axis) / pulses_per_mm(axis)
+
+    async def travel(self, coil_address, distance, unit, axis):
+        """
+        Move the gantry along an axis by holding its motion coil for the computed travel time.
+        The coroutine can be cancelled at any time; the coil is dropped before the
+        CancelledError propagates.
+
+        :param coil_address: motion coil, e.g. Z_UP_MOTION or Y_LEFT_MOTION
+        :param distance: distance to travel
+        :param unit: 'mm', 'in'/'inches' or 'ft'/'feet'
+        :param axis: 'y' or 'z'
+        :return: travel time in seconds, 0 on invalid input
+        """
+        distance = travel_distance_mm(distance, unit, axis)
+        if distance is None:
+            return 0
+        _, travel_time = travel_plan(distance, axis, await self.travel_speed(axis))
+
+        try:
+            # inside the try, so a cancel while the write is in flight still drops the coil
+            await self.write_modbus_coils(coil_address, True)
+            await asyncio.sleep(travel_time)
+        finally:
+            # shielded, a second cancel must not leave the axis running
+            await asyncio.shield(self.write_modbus_coils(coil_address, False))
+        return travel_time
@@ -1,9 +1,14 @@
 import time
 from pymodbus.client import ModbusTcpClient 
+from pymodbus.exceptions import ConnectionException, ModbusIOException
 import sys
 import math
 import threading
 import struct
+import concurrent.futures
+import os
+from plc_poller import PLCPoller
+from plc_tags import COIL, TagDatabase
 
 LEAD_Y_SCREW = 2.54 #mm
 LEAD_Y_SCREW_ADDRESS = 21
@@ -38,35 +43,314 @@ Z_GEAR_RATIO_ADDRESS = 22
 tolerance = 2 #mm
 TOLERANCE_ADDRESS = 23
 CUMM_Z_DISPLAY_ADDRESS = 27
+RECONNECT_ATTEMPTS = 5          # connection attempts before an operation fails
+RECONNECT_BACKOFF = 0.1         # seconds before the first retry, doubled per attempt
+RECONNECT_BACKOFF_MAX = 2.0
+DISTANCE_SENSOR_ANGLE = 21.65   # degrees between the distance sensor beam and vertical
+PULSE_RATE_MAX_AGE = 1.0        # seconds a cached pulse rate is used before it is read again
+# Default block read by start_poller(): distance, pulse rates, Z display / outputs and safety coils
+POLL_REGISTERS = (DISTANCE_DATA_ADDRESS, PPS_Y_ADDRESS, PPS_Z_ADDRESS, CUMM_Z_DISPLAY_ADDRESS)
+POLL_COILS = (Z_UP_MOTION, Z_DOWN_MOTION, Y_RIGHT_MOTION, Y_LEFT_MOTION, GREEN,
+              8, 9, 14, MD_EXTRUDER_ADDRESS, DISABLE_PIN, Z_CORRECTION_ENABLE)
+# Gantry outputs switched off by reset_coils()
+OUTPUT_COILS = (GREEN, Z_DOWN_MOTION, Z_UP_MOTION, Y_RIGHT_MOTION, Y_LEFT_MOTION,
+                MD_EXTRUDER_ADDRESS, Z_CORRECTION_ENABLE)
+# C-more export of the PLC program, source of the tag names used by read_tags()/write_tags()
+TAG_EXPORT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "PLC", "GantryAutomation_V2_EXPORT_CMORE.csv")
 
 
 
 
 
 print("---------------------------------------------")
+
+
+def pulses_per_mm(axis):
+    """
+    Step pulses per mm of travel from the DIP switch setting, gear ratio and screw lead of an axis.
+    """
+    axis = axis.lower()
+    if axis == "z":
+        pulses_per_rev, lead_mm, gear_ratio = DIP_SWITCH_SETTING_Z, LEAD_Z_SCREW, Z_GEAR_RATIO
+    elif axis == "y":
+        pulses_per_rev, lead_mm, gear_ratio = DIP_SWITCH_SETTING_Y, LEAD_Y_SCREW, 1
+    else:
+        raise ValueError(f"Unsupported axis '{axis}'")
+
+    # If gear_ratio = 20 means motor turns 20 revs per 1 screw rev → divide
+    return pulses_per_rev * gear_ratio / lead_mm
+
+
+def travel_distance_mm(distance, unit, axis):
+    """
+    Validate a travel request and convert the distance to mm.
+
+    :return: distance in mm, or None after printing the error
+    """
+    if axis.lower() not in ("y", "z"):
+        print(f"Error: Unsupported axis '{axis}'")
+        return None
+
+    # === Validate inputs ===
+    if distance <= 0:
+        print("Error: Distance must be positive.")
+        return None
+
+    # === Convert distance to mm ===
+    unit = unit.lower()
+    if unit in ("inches", "in"):
+        distance *= 25.4
+    elif unit in ("feet", "ft"):
+        distance *= 304.8
+    elif unit != "mm":
+        print(f"Error: Unsupported unit '{unit}'")
+        return None
+    return distance
+
+
+def travel_plan(distance_mm, axis, speed_mm_per_sec):
+    """
+    :return: (distance in mm, travel time in s)
+    """
+    travel_time = distance_mm / speed_mm_per_sec
+    print(
+        f"Axis: {axis.upper()}, Distance: {distance_mm:.2f} mm, "
+        f"Speed: {speed_mm_per_sec:.3f} mm/s, "
+        f"Travel time: {travel_time:.3f} s"
+    )
+    return distance_mm, travel_time
+
+
+def _contiguous_runs(addresses):
+    """
+    Split sorted addresses into runs of consecutive addresses, e.g. [1, 2, 3, 6] -> [[1, 2, 3], [6]].
+    """
+    runs = []
+    for address in sorted(addresses):
+        if runs and address == runs[-1][-1] + 1:
+            runs[-1].append(address)
+        else:
+            runs.append([address])
+    return runs
+
+
+def _pulse_rate_axes(request, args, kwargs):
+    """
+    Axes whose pulse rate register a Modbus write request covers, e.g. ["y"] for
+    write_register(PPS_Y_ADDRESS - 1, 20000).
+    """
+    if request not in ("write_register", "write_registers"):
+        return []
+    address = (args[0] if args else kwargs["address"]) + 1
+    if request == "write_registers":
+        count = len(args[1] if len(args) > 1 else kwargs["values"])
+    else:
+        count = 1
+    return [axis for register, axis in ((PPS_Y_ADDRESS, "y"), (PPS_Z_ADDRESS, "z"))
+            if address <= register < address + count]
+
+
+class PLCTransaction:
+    """
+    Collects coil and register writes and sends them together when the block exits.
+
+        with plc.transaction() as tx:
+            tx.coil(Z_CORRECTION_ENABLE, True)
+            tx.register(TOLERANCE_ADDRESS, 2)
+            tx.register(LAYER_HEIGHT_ADDRESS, 4)
+    """
+
+    def __init__(self, plc):
+        self.plc = plc
+        self.coils = {}
+        self.registers = {}
+
+    def __enter__(self):
+        self.plc.lock.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            if exc_type is None:
+                self.commit()
+        finally:
+            self.plc.lock.release()
+
+    def coil(self, coil_address, value):
+        self.coils[coil_address] = bool(value)
+        return self
+
+    def register(self, register_address, value):
+        self.registers[register_address] = int(value)
+        return self
+
+    def commit(self):
+        """
+        Write the collected coils and registers, one Modbus frame per contiguous run of addresses.
+        """
+        if self.coils:
+            self.plc.write_coil_set(self.coils)
+        if self.registers:
+            self.plc.write_register_set(self.registers)
+        self.coils = {}
+        self.registers = {}
+
+
+class TravelFuture(concurrent.futures.Future):
+    """
+    Future returned by PyPLCConnection.travel_async(). stop() drops the motion coil early.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._stop_event = threading.Event()
+        self.travel_time = 0    # planned seconds
+        self.elapsed = None     # seconds the coil was on, set when the move finished
+
+    def stop(self):
+        self._stop_event.set()
+
+
 class PyPLCConnection:
     
 
-    def __init__(self, ip_address, port=502):
+    def __init__(self, ip_address, port=502, tags=None):
+        # The Modbus connection is opened on first use (or by connect()), so creating
+        # the object never touches the network.
         self.ip_address = ip_address
         self.port = port
-        self.client = self.connect_to_plc()
-        self.lock = threading.Lock()
+        self._tags = tags   # TagDatabase, loaded from TAG_EXPORT on first use
+        self.client = None
+        # serializes every request on the one persistent socket
+        self.lock = threading.RLock()
+        self.connects = 0
+        self.frames = 0     # Modbus requests sent
+        self.writes = 0     # write requests sent, a poller snapshot older than the last write is stale
+        self.poller = None  # optional background state poller, see start_poller()
+        self._pulse_rates = {}  # axis -> (cached pulse rate, time.monotonic() it was read), see pulse_rate()
+
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close_connection()
 
+    def connect(self):
+        """
+        Open the Modbus TCP connection to the PLC.
 
-    def connect_to_plc(self):
+        :return: True if the PLC is connected
+        """
         try:
-            # Create a Modbus TCP client
-            self.client = ModbusTcpClient(self.ip_address, port=self.port)
-            if self.client.connect():
-                print(f"Connected to PLC at Address: {self.ip_address}:{self.port}")
+            self.connect_to_plc()
+            return True
+        except ConnectionException:
+            return False
+
+    def connect_to_plc(self):
+        """
+        Return the persistent Modbus client, connecting it first if needed.
+        Retries with exponential backoff and raises ConnectionException if the PLC stays unreachable.
+        """
+        with self.lock:
+            if self.client is not None and self.client.connected:
                 return self.client
-            else:
-                print(f"Failed to connect to PLC at Address: {self.ip_address}:{self.port}")
-                self.client = None  # Ensure the client is None on failure
+
+            delay = RECONNECT_BACKOFF
+            for attempt in range(1, RECONNECT_ATTEMPTS + 1):
+                try:
+                    if self.client is None:
+                        self.client = ModbusTcpClient(self.ip_address, port=self.port)
+                    if self.client.connect():
+                        self.connects += 1
+                        # the rates may have changed while disconnected, e.g. on the HMI
+                        self._pulse_rates.clear()
+                        print(f"Connected to PLC at Address: {self.ip_address}:{self.port}")
+                        return self.client
+                    print(f"Failed to connect to PLC at Address: {self.ip_address}:{self.port} "
+                          f"(attempt {attempt}/{RECONNECT_ATTEMPTS})")
+                except Exception as e:
+                    print(f"Error while connecting to PLC: {e}")
+                if attempt < RECONNECT_ATTEMPTS:
+                    time.sleep(delay)
+                    delay = min(delay * 2, RECONNECT_BACKOFF_MAX)
+
+            raise ConnectionException(f"PLC at {self.ip_address}:{self.port} is unreachable")
+
+    def _execute(self, request, *args, **kwargs):
+        """
+        Run one pymodbus client request on the persistent connection.
+        If the socket turns out to be dead the request is retried once on a fresh connection.
+
+        :param request: name of the ModbusTcpClient method, e.g. "write_coil"
+        """
+        with self.lock:
+            for attempt in (1, 2):
+                client = self.connect_to_plc()
+                try:
+                    self.frames += 1
+                    if request.startswith("write"):
+                        self.writes += 1
+                        for axis in _pulse_rate_axes(request, args, kwargs):
+                            self._pulse_rates.pop(axis, None)
+                    return getattr(client, request)(*args, **kwargs)
+                except (ConnectionException, ModbusIOException, OSError) as e:
+                    client.close()
+                    if attempt == 2:
+                        raise
+                    print(f"[PLC] {request} failed ({e}), reconnecting")
+
+    # === Background poller ===
+
+    def start_poller(self, rate_hz=20, registers=POLL_REGISTERS, coils=POLL_COILS):
+        """
+        Start a thread that reads the given registers and coils rate_hz times per second.
+        While it runs, read_current_distance(), read_single_register() and read_modbus_coils()
+        answer from the latest snapshot when it covers the address and is fresh.
+
+        :return: the PLCPoller
+        """
+        self.stop_poller()
+        self.poller = PLCPoller(self, registers=registers, coils=coils, rate_hz=rate_hz)
+        self.poller.start()
+        # wait for the first sample so readers never see an empty poller
+        self.poller.wait_for_update(timeout=max(1.0, 10 * self.poller.period))
+        return self.poller
+
+    def stop_poller(self):
+        """
+        Stop the background poller, reads go back to the network.
+        """
+        if self.poller is not None:
+            self.poller.stop()
+            self.poller = None
+
+    def polled_snapshot(self):
+        """
+        Latest PLCSnapshot of the background poller, None if no poller runs, the snapshot is
+        stale or a write was sent after it was taken.
+        """
+        poller = self.poller
+        if poller is None:
+            return None
+        snapshot = poller.latest()
+        if snapshot is None or snapshot.writes != self.writes or snapshot.age() > 4 * poller.period + 0.1:
+            return None
+        return snapshot
+
+    def health_check(self):
+        """
+        Check that the PLC answers by reading one coil.
+
+        :return: True if the PLC responded
+        """
+        try:
+            result = self._execute("read_coils", 0, count=1)
+            return not result.isError()
         except Exception as e:
-            print(f"Error while connecting to PLC: {e}")
-            self.client = None
+            print(f"[PLC] Health check failed: {e}")
+            return False
 
 
     # def write_modbus_coils(self, coil_address, value):
@@ -90,28 +374,17 @@ class PyPLCConnection:
 
     def write_modbus_coils(self, coil_address, value):
         try:
-            self.connect_to_plc()
             print(f"Writing {value} to address {coil_address}")
 
+            # Take care of the offset between pymodbus and the click plc
             coil_address -= 1
 
-            # Perform write (pymodbus must finish before closing socket)
-            result = self.client.write_coil(coil_address, value)
-
-            # Wait for pymodbus to fully complete transaction
-            time.sleep(0.01)
-
-            return result
+            return self._execute("write_coil", coil_address, value)
 
         except Exception as e:
             print("Error writing coil:", e)
             raise
 
-        finally:
-            # Ensure pymodbus isn't still using the socket
-            time.sleep(0.01)
-            self.close_connection()
-
 
 
 
@@ -123,29 +396,31 @@ class PyPLCConnection:
 
 
     def read_modbus_coils(self, coil_address, number_of_coils=1):
-        self.connect_to_plc()
+        snapshot = self.polled_snapshot()
+        if snapshot is not None and number_of_coils == 1 and coil_address in snapshot.coils:
+            return snapshot.coils[coil_address]
         # Predefining a empty list to store our result
         result_list = []
         # Take care of the offset between pymodbus and the click plc
         coil_address = coil_address - 1
 
         # Read the modbus address values form the click PLC
-        result = self.client.read_coils(coil_address)
+        result = self._execute("read_coils", coil_address, count=number_of_coils)
 
         # storing our values form the plc in a list of length
         # 0 to the number of coils we want to read
         result_list = result.bits[0:number_of_coils]
-        self.close_connection()
         print(result_list)
         # print("Filtered result of only necessary values", result_list)
         print("register " + str(coil_address+1) + " is " + str(result_list[0]))
         return result_list[0]
 
     def read_single_register(self, register_address):
-        self.connect_to_plc()
-        result = self.client.read_holding_registers(register_address-1).registers
+        snapshot = self.polled_snapshot()
+        if snapshot is not None and register_address in snapshot.registers:
+            return snapshot.registers[register_address]
+        result = self._execute("read_holding_registers", register_address-1).registers
         print("register " + str(register_address) + " is " + str(result[0]))
-        self.close_connection()
         return result[0]
     
     import struct
@@ -154,10 +429,9 @@ class PyPLCConnection:
 
     def read_float_register(self, register_address):
         try:
-            self.connect_to_plc()
-
             # Modbus is 0-based → subtract 1
-            result = self.client.read_holding_registers(
+            result = self._execute(
+                "read_holding_registers",
                 address=register_address-1,
                 count=2
             )
@@ -182,12 +456,10 @@ class PyPLCConnection:
 
     def write_float_register(self, register_address, value):
         try:
-            self.connect_to_plc()
-
             raw = struct.pack('>f', value)
             high_word, low_word = struct.unpack('>HH', raw)
 
-            result = self.client.write_registers(register_address - 1, [high_word, low_word])
+            result = self._execute("write_registers", register_address - 1, [high_word, low_word])
 
             if not result:
                 raise ValueError("PLC did not acknowledge write")
@@ -198,16 +470,133 @@ class PyPLCConnection:
             print(f"[PLC] Error writing float {value} to register {register_address}: {e}")
             return False
 
-        finally:
-            self.close_connection()
-
     def write_single_register(self, register_address, value):
         print("writing " + str(value) + " to register " + str(register_address))
-        self.client.write_register(register_address-1, value)
+        return self._execute("write_register", register_address-1, value)
+
+    # === Bulk transactions ===
+    # Addresses are the 1-based CLICK/BRX addresses used everywhere in this class.
+
+    def _write_set(self, values, write_request):
+        """
+        Write {address: value} with one frame per contiguous run of addresses. Addresses in
+        between are never written: the PLC owns inputs and status coils there, and writing
+        back a value read one round trip earlier would overwrite what the ladder set since.
+        """
+        if not values:
+            return None
+        result = None
+        with self.lock:
+            for run in _contiguous_runs(values):
+                result = self._execute(write_request, run[0] - 1, [values[a] for a in run])
+        return result
+
+    def write_coil_set(self, values):
+        """
+        Write several coils together.
+
+        :param values: dict {coil_address: bool}
+        """
+        print(f"Writing coils {values}")
+        return self._write_set({a: bool(v) for a, v in values.items()}, "write_coils")
+
+    def write_register_set(self, values):
+        """
+        Write several holding registers together.
+
+        :param values: dict {register_address: int}
+        """
+        print(f"Writing registers {values}")
+        return self._write_set({a: int(v) for a, v in values.items()}, "write_registers")
+
+    def read_coil_set(self, addresses):
+        """
+        Read several coils with one request over their spanning range.
+
+        :return: dict {coil_address: bool}
+        """
+        addresses = sorted(addresses)
+        first = addresses[0]
+        result = self._execute("read_coils", first - 1, count=addresses[-1] - first + 1)
+        if result.isError():
+            raise ModbusIOException(f"read_coils {first}..{addresses[-1]} failed: {result}")
+        return {a: bool(result.bits[a - first]) for a in addresses}
+
+    def read_register_set(self, addresses):
+        """
+        Read several holding registers with one request over their spanning range.
+
+        :return: dict {register_address: int}
+        """
+        addresses = sorted(addresses)
+        first = addresses[0]
+        result = self._execute("read_holding_registers", first - 1, count=addresses[-1] - first + 1)
+        if result.isError():
+            raise ModbusIOException(f"read_holding_registers {first}..{addresses[-1]} failed: {result}")
+        return {a: result.registers[a - first] for a in addresses}
+
+    # === Tags ===
+
+    @property
+    def tags(self):
+        """
+        TagDatabase of the PLC program, loaded from TAG_EXPORT unless one was passed in.
+        """
+        if self._tags is None:
+            self._tags = TagDatabase.from_export(TAG_EXPORT)
+        return self._tags
+
+    def read_tags(self, names):
+        """
+        Read PLC values by tag name, with one Modbus request per block of the cached read plan.
+
+            plc.read_tags(["z_measured", "layer_height", "tolerance", "z_enable"])
+
+        :return: dict {name: value}
+        """
+        tags = self.tags
+        values = {}
+        with self.lock:
+            for block in tags.read_plan(names):
+                if block.table == COIL:
+                    result = self._execute("read_coils", block.start - 1, count=block.count)
+                else:
+                    result = self._execute("read_holding_registers", block.start - 1, count=block.count)
+                if result.isError():
+                    raise ModbusIOException(f"Reading {block.table} {block.start}..{block.start + block.count - 1} "
+                                            f"failed: {result}")
+                values.update(tags.decode(block, result.bits if block.table == COIL else result.registers))
+        return {name: values[tags[name]] for name in names}
+
+    def write_tags(self, values):
+        """
+        Write PLC values by tag name, one frame per contiguous run of coils or registers.
+
+            plc.write_tags({"layer_height": 4, "tolerance": 1, "z_enable": True})
+        """
+        coils, registers = self.tags.encode(values)
+        with self.transaction() as tx:
+            for address, value in coils.items():
+                tx.coil(address, value)
+            for address, word in registers.items():
+                tx.register(address, word)
+
+    def transaction(self):
+        """
+        Group coil and register writes into one state change, see PLCTransaction.
+        """
+        return PLCTransaction(self)
 
     def close_connection(self):
-        print("Closing Connection")
-        self.client.close()
+        """
+        Close the persistent connection, the next request reconnects.
+        """
+        self.stop_poller()
+        with self.lock:
+            if self.client is None:
+                return
+            print("Closing Connection")
+            self.client.close()
 
     def distance(self, distance, unit = "mm"):
         if unit.lower() == "in":
@@ -219,7 +608,7 @@ class PyPLCConnection:
 
     def read_current_distance(self):
     # Convert degrees to radians before calculating cosine
-        angle_degrees = 21.65
+        angle_degrees = DISTANCE_SENSOR_ANGLE
         angle_radians_from_degrees = math.radians(angle_degrees)
         angle_distance = self.read_single_register(DISTANCE_DATA_ADDRESS)
         vertical_distance = angle_distance*math.cos(angle_radians_from_degrees)
@@ -263,19 +652,8 @@ class PyPLCConnection:
         """
         Reset all defined Modbus coil outputs (turn them OFF).
         """
-        coil_addresses = [
-            GREEN,
-            Z_DOWN_MOTION,
-            Z_UP_MOTION,
-            Y_RIGHT_MOTION,
-            Y_LEFT_MOTION,
-            MD_EXTRUDER_ADDRESS,
-            Z_CORRECTION_ENABLE,
-        ]
-
         print("Resetting all coils to False...")
-        for coil in coil_addresses:
-            self.write_modbus_coils(coil, False)
+        self.write_coil_set({coil: False for coil in OUTPUT_COILS})
 
         print("All coils reset complete.")
 
@@ -286,7 +664,6 @@ class PyPLCConnection:
 
         :param status: "on" or "off" (case-insensitive)
         """
-        self.connect_to_plc()
         status_lower = status.strip().lower()
 
         if status_lower == "on" or status == 1:
@@ -299,7 +676,6 @@ class PyPLCConnection:
 
         self.write_modbus_coils(MD_EXTRUDER_ADDRESS, value)
         print(f"Turning MD pellet extruder {status.strip().upper()}")
-        self.close_connection()
 
 
     def disable_motor(self, value):
@@ -315,12 +691,40 @@ class PyPLCConnection:
             print(f"Motors are disabled value = {value}")
 
     def configure_z_correction(self, status=None, tolerance=None, layer_height=None):
-        if tolerance is not None:
-            self.write_single_register(TOLERANCE_ADDRESS, tolerance)
+        with self.transaction() as tx:
+            if tolerance is not None:
+                tx.register(TOLERANCE_ADDRESS, tolerance)
+
+            if layer_height is not None:
+                tx.register(LAYER_HEIGHT_ADDRESS, layer_height)
+
+    def set_pulse_rates(self, pps_y=None, pps_z=None):
+        """
+        Set the Y and/or Z axis pulse rates (pulses per second) in one request.
+        """
+        values = {}
+        if pps_y is not None:
+            values[PPS_Y_ADDRESS] = pps_y
+        if pps_z is not None:
+            values[PPS_Z_ADDRESS] = pps_z
+        result = self.write_register_set(values)
+        # the write cleared the cached rates, the values just written are known
+        now = time.monotonic()
+        self._pulse_rates.update((axis, (values[address], now)) for axis, address in
+                                 (("y", PPS_Y_ADDRESS), ("z", PPS_Z_ADDRESS)) if address in values)
+        return result
+
+    def read_pulse_rates(self):
+        """
+        Read the Y and Z axis pulse rates in one request.
 
-        if layer_height is not None:
-            self.write_single_register(LAYER_HEIGHT_ADDRESS, layer_height)
-        time.sleep(1)
+        :return: (pps_y, pps_z)
+        """
+        values = self.read_register_set((PPS_Y_ADDRESS, PPS_Z_ADDRESS))
+        now = time.monotonic()
+        self._pulse_rates["y"] = (values[PPS_Y_ADDRESS], now)
+        self._pulse_rates["z"] = (values[PPS_Z_ADDRESS], now)
+        return values[PPS_Y_ADDRESS], values[PPS_Z_ADDRESS]
 
     def z_correction(self, status: str | int) -> None:
         """
@@ -345,91 +749,121 @@ class PyPLCConnection:
 
         self.write_modbus_coils(Z_CORRECTION_ENABLE, value)
 
-    def travel(self, coil_address, distance, unit, axis):
-        """
-        Move stepper motor a given distance at axis-specific pulse rate,
-        with countdown timer during motion.
+    # === Gantry travel ===
 
-        :param coil_address: Modbus coil address for motor
-        :param distance: Distance to travel
-        :param unit: 'mm', 'inches', or 'feet'
-        :param axis: Axis being moved ('x', 'y', or 'z')
-        :return: Travel time in seconds
+    def pulse_rate(self, axis, refresh=False):
+        """
+        Pulse rate (pulses per second) of an axis. While the poller runs the rate comes from
+        its latest snapshot. Otherwise the register is read and cached for PULSE_RATE_MAX_AGE
+        seconds, so a rate changed on the HMI or by another client is picked up by the next
+        travel. set_pulse_rates() updates the cache, any other write to a pulse rate register
+        and a new connection clear it.
+
+        :param axis: 'y' or 'z'
+        :param refresh: read the register again
         """
-
-        # === Axis-specific settings ===
-        time.sleep(2)
         axis = axis.lower()
+        address = {"y": PPS_Y_ADDRESS, "z": PPS_Z_ADDRESS}[axis]
+        now = time.monotonic()
+        snapshot = None if refresh else self.polled_snapshot()
+        if snapshot is not None and address in snapshot.registers:
+            self._pulse_rates[axis] = (snapshot.registers[address], now)
+        elif refresh or axis not in self._pulse_rates or now - self._pulse_rates[axis][1] > PULSE_RATE_MAX_AGE:
+            self._pulse_rates[axis] = (self.read_single_register(address), now)
+        return self._pulse_rates[axis][0]
+
+    def travel_speed(self, axis):
+        """
+        Axis speed in mm/s from pulse_rate(), see pulses_per_mm().
+        """
+        return self.pulse_rate(axis) / pulses_per_mm(axis)
 
+    def _travel_time(self, distance, unit, axis):
+        # returns (distance in mm, travel time in s), or None after printing the error
+        distance = travel_distance_mm(distance, unit, axis)
+        if distance is None:
+            return None
+        return travel_plan(distance, axis, self.travel_speed(axis))
 
-        if axis == "z":
-            pulse_rate = self.read_single_register(PPS_Z_ADDRESS)   # pulses per second
-            # pulse_rate = 60000
-            pulses_per_rev = DIP_SWITCH_SETTING_Z
-            lead_mm = LEAD_Z_SCREW
-            gear_ratio = 20  # example: 20:1 reduction
-        elif axis == "y":
-            pulse_rate = self.read_single_register(PPS_Y_ADDRESS)
-            # pulse_rate = 40000
-            pulses_per_rev = DIP_SWITCH_SETTING_Y
-            lead_mm = LEAD_Y_SCREW
-            gear_ratio = 1
-        else:
-            print(f"Error: Unsupported axis '{axis}'")
-            return 0
-
-        # === Validate inputs ===
-        if distance <= 0:
-            print("Error: Distance must be positive.")
-            return 0
-
-        # === Convert distance to mm ===
-        unit = unit.lower()
-        if unit in ("inches", "in"):
-            distance *= 25.4
-        elif unit in ("feet", "ft"):
-            distance *= 304.8
-        elif unit != "mm":
-            print(f"Error: Unsupported unit '{unit}'")
-            return 0
-
-        # === Calculate motion parameters ===
-        # If gear_ratio = 20 means motor turns 20 revs per 1 screw rev → divide
-        pulses_per_screw_rev = pulses_per_rev * gear_ratio
-        pulses_per_mm = pulses_per_screw_rev / lead_mm
-        speed_mm_per_sec = pulse_rate / pulses_per_mm
-        travel_time = distance / speed_mm_per_sec
-
-        print(
-            f"Axis: {axis.upper()}, Distance: {distance:.2f} mm, "
-            f"Speed: {speed_mm_per_sec:.3f} mm/s, "
-            f"Travel time: {travel_time:.2f} s"
-        )
-
-        # === Run motor (coil on) ===
-        self.connect_to_plc()
+    def _start_travel(self, coil_address):
+        # switch the motion coil on, returns the monotonic time the PLC acknowledged it
         self.write_modbus_coils(coil_address, True)
+        return time.monotonic()
 
-        # Countdown loop
-        remaining = int(round(travel_time))
-        while remaining > 0:
-            sys.stdout.write(f"\rTime remaining: {remaining} s")
+    def _finish_travel(self, coil_address, start, travel_time, stop_event, countdown=True):
+        """
+        Hold the motion coil on until start + travel_time on the monotonic clock, or until
+        stop_event is set, then drop it. The coil is always dropped, also on errors.
+
+        :return: seconds the coil was on
+        """
+        deadline = start + travel_time
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                if countdown:
+                    sys.stdout.write(f"\rTime remaining: {remaining:.1f} s ")
+                    sys.stdout.flush()
+                # wake up on the deadline itself, at least once a second for the countdown
+                if stop_event.wait(min(remaining, 1.0)):
+                    break
+        finally:
+            self.write_modbus_coils(coil_address, False)
+        elapsed = time.monotonic() - start
+        if countdown:
+            sys.stdout.write("\rTime remaining: 0 s\n")
             sys.stdout.flush()
-            time.sleep(1)
-            remaining -= 1
+        return elapsed
 
-        sys.stdout.write("\rTime remaining: 0 s\n")
-        sys.stdout.flush()
+    def travel(self, coil_address, distance, unit, axis):
+        """
+        Move stepper motor a given distance at axis-specific pulse rate.
+        The coil is switched off at the exact travel time on a monotonic clock.
 
-        # === Stop motor (coil off) ===
-        self.write_modbus_coils(coil_address, False)
-        self.close_connection()
+        :param coil_address: Modbus coil address for motor
+        :param distance: Distance to travel
+        :param unit: 'mm', 'inches', or 'feet'
+        :param axis: Axis being moved ('y' or 'z')
+        :return: Travel time in seconds
+        """
+        motion = self._travel_time(distance, unit, axis)
+        if motion is None:
+            return 0
+        _, travel_time = motion
+        start = self._start_travel(coil_address)
+        self._finish_travel(coil_address, start, travel_time, threading.Event())
         return travel_time
-    
-
 
+    def travel_async(self, coil_address, distance, unit, axis):
+        """
+        Start a move like travel() without blocking.
 
+        The coil is switched on before this returns, the future resolves when it has been dropped.
 
+        :return: TravelFuture resolving to the seconds the coil was on, call stop() on it to end the move early
+        """
+        future = TravelFuture()
+        motion = self._travel_time(distance, unit, axis)
+        if motion is None:
+            future.set_result(0)
+            return future
+        _, travel_time = motion
+        future.travel_time = travel_time
+        future.set_running_or_notify_cancel()
+        start = self._start_travel(coil_address)
+
+        def run():
+            try:
+                future.elapsed = self._finish_travel(coil_address, start, travel_time,
+                                                     future._stop_event, countdown=False)
+                future.set_result(future.elapsed)
+            except Exception as e:
+                future.set_exception(e)
+
+        threading.Thread(target=run, name=f"Travel-{axis}", daemon=True).start()
+        return future
 
 
 if __name__ == "__main__":
@@ -0,0 +1,312 @@
+"""
+Bed height map for feed-forward Z compensation.
+
+The Z correction of the print scripts is reactive: the distance sensor is compared to the
+layer height while printing and the gantry Z axis follows. A HeightMap measures the bed
+once instead, so every pose can be lowered or raised before it is sent:
+
+    cache = BedMapCache()
+    bed = cache.get_or_scan("woody-md-pellet", "plate-1",
+                            lambda: scan_bed(woody, plc, xs=range(-60, 101, 40), ys=range(-400, 401, 50), z=-10))
+    program = compile_toolpath(path, bed_map=bed, bed_reference=bed.height(-60, -400))
+
+scan_bed() sweeps the sensor over a grid of robot X/Y positions in a serpentine and stores
+the bed surface Z (pose Z - measured gap) at each node. HeightMap.from_csv() builds the
+same map from the x, y, z, current_height traces of alignment.csv or z_correction.csv,
+using the first layer of one print, where the sensor still sees the bed.
+height(x, y) interpolates bilinearly between the grid nodes and holds the edge value
+outside the grid.
+
+Bed coordinates are robot user frame coordinates with the gantry Y axis at 0, a pose
+printed with the gantry at gantry_y lies over bed Y = robot Y + gantry_y.
+"""
+import argparse
+import bisect
+import csv
+import json
+import math
+import os
+import re
+import time
+from typing import NamedTuple
+
+from toolpath import DEFAULT_ORIENTATION
+
+CACHE_DIR = "bed_maps"
+SCAN_SETTLE = 0.3       # seconds the sensor settles at a scan point
+RUN_GAP = 60.0          # seconds between two log rows that start a new print
+
+
+class BedSample(NamedTuple):
+    """
+    Bed surface Z measured at one point.
+    """
+    x: float
+    y: float
+    height: float
+
+
+def _axis(values, step):
+    # grid nodes from the smallest to the largest value, step mm apart
+    low, high = min(values), max(values)
+    count = max(1, math.ceil((high - low) / step - 1e-9) + 1) if step else 1
+    return tuple(low + i * step for i in range(count))
+
+
+def _nearest(axis, value):
+    index = bisect.bisect_left(axis, value)
+    if index == len(axis) or index and value - axis[index - 1] <= axis[index] - value:
+        index -= 1
+    return index
+
+
+def _locate(axis, value):
+    # (index of the lower node, weight of the upper node), clamped to the axis ends
+    if len(axis) == 1 or value <= axis[0]:
+        return 0, 0.0
+    if value >= axis[-1]:
+        return len(axis) - 2, 1.0
+    index = bisect.bisect_right(axis, value) - 1
+    return index, (value - axis[index]) / (axis[index + 1] - axis[index])
+
+
+class HeightMap:
+    """
+    Bed surface Z on a rectilinear grid of X and Y nodes.
+    """
+
+    def __init__(self, xs, ys, heights):
+        """
+        :param xs: ascending X of the grid nodes in mm
+        :param ys: ascending Y of the grid nodes in mm
+        :param heights: heights[i][j] is the surface Z at (xs[i], ys[j])
+        """
+        self.xs = tuple(float(x) for x in xs)
+        self.ys = tuple(float(y) for y in ys)
+        self.heights = [[float(h) for h in row] for row in heights]
+        if len(self.heights) != len(self.xs) or any(len(row) != len(self.ys) for row in self.heights):
+            raise ValueError(f"Height grid must be {len(self.xs)} x {len(self.ys)}")
+
+    def height(self, x, y):
+        """
+        Bilinearly interpolated surface Z at (x, y), the edge value outside the grid.
+        """
+        i, u = _locate(self.xs, x)
+        j, v = _locate(self.ys, y)
+        row = self.heights[i]
+        h = row[j] if v == 0.0 else row[j] * (1 - v) + row[j + 1] * v
+        if u == 0.0:
+            return h
+        row = self.heights[i + 1]
+        h1 = row[j] if v == 0.0 else row[j] * (1 - v) + row[j + 1] * v
+        return h * (1 - u) + h1 * u
+
+    __call__ = height
+
+    def values(self):
+        return [h for row in self.heights for h in row]
+
+    def mean(self):
+        values = self.values()
+        return sum(values) / len(values)
+
+    def summary(self):
+        values = self.values()
+        return {"nodes": f"{len(self.xs)} x {len(self.ys)}", "min": min(values), "max": max(values),
+                "range": max(values) - min(values), "mean": self.mean()}
+
+    @classmethod
+    def from_samples(cls, samples, xs=None, ys=None, step=50.0):
+        """
+        Grid scattered samples. Each node takes the mean of the samples nearest to it, nodes
+        without samples take the mean of their filled neighbours.
+
+        :param samples: iterable of BedSample or (x, y, height)
+        :param xs: X of the grid nodes, default every step mm over the samples
+        :param ys: Y of the grid nodes, default every step mm over the samples
+        """
+        samples = [BedSample(*sample) for sample in samples]
+        if not samples:
+            raise ValueError("No bed samples")
+        xs = sorted(xs) if xs is not None else _axis([s.x for s in samples], step)
+        ys = sorted(ys) if ys is not None else _axis([s.y for s in samples], step)
+        sums = [[0.0] * len(ys) for _ in xs]
+        counts = [[0] * len(ys) for _ in xs]
+        for sample in samples:
+            i, j = _nearest(xs, sample.x), _nearest(ys, sample.y)
+            sums[i][j] += sample.height
+            counts[i][j] += 1
+        heights = [[sums[i][j] / counts[i][j] if counts[i][j] else None for j in range(len(ys))]
+                   for i in range(len(xs))]
+
+        # grow the measured area into the empty nodes, one ring of neighbours per pass
+        empty = [(i, j) for i in range(len(xs)) for j in range(len(ys)) if heights[i][j] is None]
+        while empty:
+            filled = {}
+            for i, j in empty:
+                neighbours = [heights[a][b] for a, b in ((i - 1, j), (i + 1, j), (i, j - 1), (i, j + 1))
+                              if 0 <= a < len(xs) and 0 <= b < len(ys) and heights[a][b] is not None]
+                if neighbours:
+                    filled[i, j] = sum(neighbours) / len(neighbours)
+            for (i, j), value in filled.items():
+                heights[i][j] = value
+            empty = [node for node in empty if node not in filled]
+        return cls(xs, ys, heights)
+
+    @classmethod
+    def from_csv(cls, path, step=50.0, gantry_y=0.0, run=-1):
+        """
+        Build a map from a log with x, y, z and current_height columns, e.g. alignment.csv
+        or z_correction.csv. The surface is z - current_height at each row of the first layer.
+
+        The logs hold several prints, each with several layers, and above the first layer the
+        sensor measures the layer below instead of the bed. The rows are split into prints
+        where the timestamp jumps by more than RUN_GAP seconds, and only the rows of the
+        selected print within half a layer_height of its lowest Z are used. Logs without a
+        timestamp column are one print, without a layer_height column one layer.
+
+        :param gantry_y: gantry Y position while the log was recorded
+        :param run: index of the print in the log, default the last one, None: all prints
+        """
+        with open(path, newline="") as f:
+            rows = [row for row in csv.DictReader(f)
+                    if all(row.get(column) for column in ("x", "y", "z", "current_height"))]
+        runs = []
+        last = None
+        for row in rows:
+            timestamp = float(row["timestamp"]) if row.get("timestamp") else None
+            if not runs or timestamp is not None and last is not None and timestamp - last > RUN_GAP:
+                runs.append([])
+            runs[-1].append(row)
+            last = timestamp if timestamp is not None else last
+        if not runs:
+            raise ValueError(f"No x, y, z, current_height rows in {path}")
+
+        samples = []
+        for logged in runs if run is None else [runs[run]]:
+            bottom = min(float(row["z"]) for row in logged)
+            samples += [BedSample(float(row["x"]), float(row["y"]) + gantry_y,
+                                  float(row["z"]) - float(row["current_height"]))
+                        for row in logged if not row.get("layer_height")
+                        or float(row["z"]) - bottom < float(row["layer_height"]) / 2]
+        return cls.from_samples(samples, step=step)
+
+    # === Files ===
+
+    def to_dict(self):
+        return {"xs": list(self.xs), "ys": list(self.ys), "heights": self.heights}
+
+    def save(self, path, **metadata):
+        """
+        Write the map as JSON, with optional metadata such as the setup and the fixture.
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(dict(self.to_dict(), created=time.time(), **metadata), f, indent=1)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            data = json.load(f)
+        return cls(data["xs"], data["ys"], data["heights"])
+
+
+def scan_bed(robot, plc, xs, ys, z, speed=100, settle=SCAN_SETTLE, sensor=None,
+             orientation=DEFAULT_ORIENTATION, gantry_y=0.0):
+    """
+    Sweep the distance sensor over a grid and map the bed surface. The robot visits the
+    nodes in a serpentine, X row by X row, and returns to the first node at the end.
+
+    :param robot: robot_controller.robot
+    :param plc: PyPLCConnection, its read_current_distance() is the default sensor
+    :param xs: robot X of the scan rows in mm
+    :param ys: robot Y of the scan points in mm
+    :param z: robot Z the sensor is carried at, the gap must stay within the sensor range
+    :param speed: robot speed between the points in mm/s
+    :param settle: seconds to wait at each point before reading the sensor
+    :param sensor: callable returning the nozzle to bed distance in mm
+    :param gantry_y: gantry Y position during the scan
+    :return: HeightMap on the xs, ys grid
+    """
+    sensor = sensor or plc.read_current_distance
+    xs, ys = sorted(xs), sorted(ys)
+    robot.set_speed(speed)
+    samples = []
+    for row, x in enumerate(xs):
+        for y in ys if row % 2 == 0 else reversed(ys):
+            robot.write_cartesian_position([x, y, z, *orientation])
+            time.sleep(settle)
+            gap = sensor()
+            pose_z = robot.read_current_cartesian_pose()[2]
+            samples.append(BedSample(x, y + gantry_y, pose_z - gap))
+            print(f"[BedScan] X: {x:.1f} Y: {y:.1f} gap: {gap:.2f} mm surface: {pose_z - gap:.2f} mm")
+    robot.write_cartesian_position([xs[0], ys[0], z, *orientation])
+    return HeightMap.from_samples(samples, xs, [y + gantry_y for y in ys])
+
+
+def _key(value):
+    return re.sub(r"[^A-Za-z0-9_.-]+", "_", str(value)).strip("_") or "default"
+
+
+class BedMapCache:
+    """
+    Height maps on disk, one JSON file per setup and fixture.
+    """
+
+    def __init__(self, directory=CACHE_DIR):
+        self.directory = directory
+
+    def path(self, setup, fixture):
+        """
+        :param setup: robot, tool and gantry configuration the map was measured with
+        :param fixture: bed plate or fixture the map belongs to
+        """
+        return os.path.join(self.directory, f"{_key(setup)}__{_key(fixture)}.json")
+
+    def get(self, setup, fixture, max_age=None):
+        """
+        :param max_age: seconds after which a cached map is considered stale, None: never
+        :return: the cached HeightMap, None if there is none or it is stale
+        """
+        path = self.path(setup, fixture)
+        if not os.path.isfile(path):
+            return None
+        if max_age is not None and time.time() - os.path.getmtime(path) > max_age:
+            return None
+        return HeightMap.load(path)
+
+    def put(self, setup, fixture, height_map):
+        height_map.save(self.path(setup, fixture), setup=str(setup), fixture=str(fixture))
+        return height_map
+
+    def get_or_scan(self, setup, fixture, scan, max_age=None):
+        """
+        The cached map, or a new one from scan() which is then cached.
+
+        :param scan: callable returning a HeightMap, e.g. a lambda around scan_bed()
+        """
+        height_map = self.get(setup, fixture, max_age)
+        if height_map is None:
+            height_map = self.put(setup, fixture, scan())
+        return height_map
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build a bed height map from a logged CSV")
+    parser.add_argument("csv", help="log with x, y, z and current_height columns, e.g. alignment.csv")
+    parser.add_argument("--step", type=float, default=50.0, help="grid spacing in mm")
+    parser.add_argument("--run", type=int, default=-1, help="index of the print in the log, default the last")
+    parser.add_argument("--setup", default=None, help="cache the map under this setup")
+    parser.add_argument("--fixture", default="default", help="fixture of the cached map")
+    args = parser.parse_args()
+
+    bed = HeightMap.from_csv(args.csv, args.step, run=args.run)
+    print(bed.summary())
+    for x, row in zip(bed.xs, bed.heights):
+        print(f"X {x:8.1f}: " + " ".join(f"{h:7.2f}" for h in row))
+    if args.setup:
+        cache = BedMapCache()
+        cache.put(args.setup, args.fixture, bed)
+        print(f"Saved to {cache.path(args.setup, args.fixture)}")
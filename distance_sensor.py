@@ -0,0 +1,193 @@
+"""
+Filtered nozzle to bed distance with sub-millimetre resolution.
+
+PyPLCConnection.read_current_distance() turns the distance register into the vertical gap
+and rounds it up to whole mm, so a control loop only sees 1 mm steps. DistanceSensor reads
+the raw value instead, either the 16-bit register in scaled counts or a 32-bit float
+register, converts it with a calibrated SensorModel and filters the last few samples on
+the host: a median over a short ring buffer rejects single-sample spikes and an EMA on the
+median smooths what is left.
+
+    sensor = DistanceSensor(plc, SensorModel(scale=0.01))     # register 6 in 0.01 mm counts
+    reading = sensor.read()
+    print(reading.distance, reading.timestamp)
+
+A DistanceSensor is a callable returning the filtered distance, so it replaces
+plc.read_current_distance wherever a sensor callable is taken:
+
+    controller = ZController(sensor, GantryZActuator(plc), PID(kp=0.6), target=4.0, period=0.2)
+    calibrate_nozzle_height(woody, sensor, pose, 4.0, tolerance=0.1, increment=0)
+
+While the PLC poller runs, each new snapshot is one sample and reads between snapshots
+return the last reading without touching the network.
+"""
+import collections
+import math
+import statistics
+import time
+from typing import NamedTuple
+
+from PyPLCConnection import DISTANCE_DATA_ADDRESS, DISTANCE_SENSOR_ANGLE
+
+# raw value sources
+REGISTER = "register"   # 16-bit holding register, read_single_register()
+FLOAT = "float"         # 32-bit float over two registers, read_float_register()
+
+FILTER_WINDOW = 5       # samples in the median window
+FILTER_ALPHA = 0.5      # EMA weight of the newest median
+MAX_SAMPLE_AGE = 1.0    # seconds after which a sample leaves the window
+
+
+class SensorModel(NamedTuple):
+    """
+    Raw sensor value to vertical distance: (raw * scale + offset) * cos(angle).
+    """
+    scale: float = 1.0      # mm along the beam per raw unit
+    offset: float = 0.0     # mm along the beam added to every reading
+    angle: float = DISTANCE_SENSOR_ANGLE    # degrees between the beam and vertical
+
+    def vertical(self, raw):
+        return (raw * self.scale + self.offset) * math.cos(math.radians(self.angle))
+
+    @classmethod
+    def fit(cls, raws, gaps, angle=DISTANCE_SENSOR_ANGLE):
+        """
+        Least-squares scale and offset from raw readings taken at known vertical gaps,
+        e.g. with feeler gauges under the nozzle.
+
+        :param raws: raw sensor values
+        :param gaps: vertical gaps in mm at which they were read
+        """
+        beams = [gap / math.cos(math.radians(angle)) for gap in gaps]
+        if len(raws) != len(beams) or len(raws) < 2:
+            raise ValueError("At least two raw readings with their gaps are needed")
+        mean_raw, mean_beam = statistics.fmean(raws), statistics.fmean(beams)
+        spread = sum((raw - mean_raw) ** 2 for raw in raws)
+        if not spread:
+            raise ValueError("The raw readings must not all be equal")
+        scale = sum((raw - mean_raw) * (beam - mean_beam) for raw, beam in zip(raws, beams)) / spread
+        return cls(scale, mean_beam - scale * mean_raw, angle)
+
+
+class MedianEMAFilter:
+    """
+    Median over a ring buffer of recent samples, followed by an exponential moving average.
+    """
+
+    def __init__(self, window=FILTER_WINDOW, alpha=FILTER_ALPHA, max_age=MAX_SAMPLE_AGE):
+        """
+        :param window: samples the median is taken over, 1 disables it
+        :param alpha: EMA weight of the newest median in (0, 1], 1 disables the EMA
+        :param max_age: seconds after which a sample is dropped, None: samples never expire
+        """
+        if window < 1:
+            raise ValueError(f"Filter window must be at least 1, got {window}")
+        if not 0 < alpha <= 1:
+            raise ValueError(f"Filter alpha must be in (0, 1], got {alpha}")
+        self.alpha = alpha
+        self.max_age = max_age
+        self.samples = collections.deque(maxlen=window)     # (timestamp, value)
+        self.value = None
+
+    def add(self, value, timestamp):
+        """
+        :return: the filtered value including this sample
+        """
+        if self.max_age is not None:
+            while self.samples and timestamp - self.samples[0][0] > self.max_age:
+                self.samples.popleft()
+            if not self.samples:
+                self.value = None   # after a gap the EMA starts over
+        self.samples.append((timestamp, value))
+        median = statistics.median(sample for _, sample in self.samples)
+        self.value = median if self.value is None else self.value + self.alpha * (median - self.value)
+        return self.value
+
+    def reset(self):
+        self.samples.clear()
+        self.value = None
+
+
+class DistanceReading(NamedTuple):
+    """
+    One filtered distance sample.
+    """
+    distance: float     # filtered vertical distance in mm
+    vertical: float     # unfiltered vertical distance of this sample in mm
+    raw: float          # raw sensor value
+    timestamp: float    # time.monotonic() when the value was read
+    samples: int        # samples in the filter window
+
+
+class DistanceSensor:
+    """
+    Distance sensor pipeline: raw read, SensorModel, MedianEMAFilter.
+    """
+
+    def __init__(self, plc, model=SensorModel(), address=DISTANCE_DATA_ADDRESS, source=REGISTER,
+                 window=FILTER_WINDOW, alpha=FILTER_ALPHA, max_age=MAX_SAMPLE_AGE):
+        """
+        :param plc: PyPLCConnection
+        :param model: SensorModel of the raw value, the default reads the register as whole mm
+        :param address: register holding the raw value
+        :param source: REGISTER for a 16-bit register, FLOAT for a float over two registers
+        """
+        if source not in (REGISTER, FLOAT):
+            raise ValueError(f"Unknown sensor source '{source}'")
+        self.plc = plc
+        self.model = model
+        self.address = address
+        self.source = source
+        self.filter = MedianEMAFilter(window, alpha, max_age)
+        self.reads = 0          # raw values read over the network or taken from a snapshot
+        self._last = None
+        self._sample_time = None    # timestamp of the last sample, older snapshots are skipped
+
+    def _raw(self):
+        # (raw value, timestamp), None if the poller has nothing newer than the last sample,
+        # e.g. the snapshot a network read already superseded after a write
+        if self.source == REGISTER:
+            snapshot = self.plc.polled_snapshot()
+            if snapshot is not None and self.address in snapshot.registers:
+                if self._sample_time is not None and snapshot.timestamp <= self._sample_time:
+                    return None
+                return snapshot.registers[self.address], snapshot.timestamp
+            return self.plc.read_single_register(self.address), time.monotonic()
+        return self.plc.read_float_register(self.address), time.monotonic()
+
+    def read(self):
+        """
+        Take a sample and return the filtered reading.
+
+        :return: DistanceReading, None if the read failed before any sample was taken
+        """
+        sample = self._raw()
+        if sample is None or sample[0] is None:
+            return self._last
+        raw, timestamp = sample
+        self._sample_time = timestamp
+        vertical = self.model.vertical(raw)
+        self.reads += 1
+        distance = self.filter.add(vertical, timestamp)
+        self._last = DistanceReading(distance, vertical, raw, timestamp, len(self.filter.samples))
+        return self._last
+
+    def latest(self):
+        """
+        Last reading without sampling, None before the first read.
+        """
+        return self._last
+
+    def __call__(self):
+        reading = self.read()
+        if reading is None:
+            raise ValueError("No distance reading available")
+        return reading.distance
+
+    def reset(self):
+        """
+        Forget the filter state, e.g. after the nozzle jumped to a new height.
+        """
+        self.filter.reset()
+        self._last = None
+        self._sample_time = None
@@ -0,0 +1,55 @@
+import sys
+sys.path.append('../src')
+
+import asyncio
+import statistics
+import time
+
+import FANUCethernetipDriver as EIP
+from async_driver import AsyncFANUCDriver
+from fanuc_emulator import FANUCEmulator
+from robot_controller import robot
+
+# Benchmarks driver throughput and move latency against the loopback FANUC emulator.
+# Adjust LATENCY / JITTER to match the network between the PC and the controller.
+LATENCY = 0.002     # seconds per reply
+JITTER = 0.0005
+N = 200
+
+
+def timed(label, fn, n=N):
+    samples = []
+    for _ in range(n):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    print(f"{label:<40} mean {statistics.mean(samples) * 1000:7.2f} ms   "
+          f"p95 {sorted(samples)[int(n * 0.95) - 1] * 1000:7.2f} ms   {n / sum(samples):8.1f} ops/s")
+
+
+async def async_bench(address):
+    async with AsyncFANUCDriver(address) as drv:
+        start = time.perf_counter()
+        await asyncio.gather(*(drv.read_register(5) for _ in range(N)))
+        elapsed = time.perf_counter() - start
+        print(f"{'async pipelined R[5] reads':<40} {N / elapsed:8.1f} ops/s")
+
+
+with FANUCEmulator(latency=LATENCY, jitter=JITTER, seed=0) as emu:
+    address = emu.address
+    print("Emulator at", address, "latency", LATENCY * 1000, "ms jitter", JITTER * 1000, "ms\n")
+
+    timed("readR_Register (pooled session)", lambda: EIP.readR_Register(address, 5))
+    timed("read_registers x10 (one packet)", lambda: EIP.read_registers(address, range(1, 11)))
+    timed("returnCartesianCurrentPose", lambda: EIP.returnCartesianCurrentPose(address))
+    asyncio.run(async_bench(address))
+
+    # end-to-end move: 50 mm at 250 mm/s should take 200 ms of emulated motion
+    emu.set_cartesian([100, 0, 0, 0, 90, 0])
+    woody = robot(address)
+    woody.set_speed(250)
+    timed("50 mm blocking move", lambda: woody.write_cartesian_position(
+        [150 if woody.read_current_cartesian_pose()[0] < 125 else 100, 0, 0]), n=10)
+    woody.close()
+
+    print("\nrequests served:", emu.requests, " sessions:", emu.sessions, " moves:", emu.moves)
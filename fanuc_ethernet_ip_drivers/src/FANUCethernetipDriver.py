@@ -16,15 +16,21 @@ DEBUG = False
 #import sys
 #sys.path.append('./pycomm3/pycomm3')
 from enum import Enum
+from typing import NamedTuple
 from pycomm3 import CIPDriver
 from pycomm3 import Services
 from pycomm3 import DataTypes, DataType
 from pycomm3.logger import configure_default_logger, LOG_VERBOSE
+from pycomm3.exceptions import CommError
+from pycomm3.packets.util import request_path
+from contextlib import contextmanager
 import pycomm3
 import struct
 import random
 import time
 import math
+import threading
+import atexit
 
 # Helper functions
 
@@ -34,175 +40,397 @@ def returnBit(bitNumber,list):
       return bit
 
 
+#################
+# Session Pool
+#################
+
+# Every function below used to open its own CIPDriver, which costs a TCP connect
+# plus an EtherNet/IP RegisterSession for each register access. Sessions are now
+# checked out of a pool keyed by robot IP and returned after use, so steady state
+# register I/O is a single request/response round trip.
+
+SESSION_KEEPALIVE = 10.0   # seconds a session may sit idle before it is probed
+SESSION_MAX_IDLE = 4       # idle sessions kept open per robot
+# errors raised while decoding a reply that arrived in full, the session is still in sync
+POST_REPLY_ERRORS = (ValueError, TypeError, IndexError, KeyError, struct.error)
+
+
+class CIPSessionPool:
+    '''!
+        Thread-safe pool of open CIPDriver sessions keyed by drive path (robot IP).
+
+        A session is checked out by exactly one thread at a time. Idle sessions are
+        probed by a background keep-alive thread so the controller does not drop them,
+        and a session that fails with a CommError is closed and transparently replaced.
+    '''
+
+    def __init__(self, keepalive: float=SESSION_KEEPALIVE, max_idle: int=SESSION_MAX_IDLE):
+        self.keepalive = keepalive
+        self.max_idle = max_idle
+        self._lock = threading.Lock()
+        self._idle = {}          # drive_path -> [(CIPDriver, last used monotonic time)]
+        self._generation = {}    # drive_path -> number of sessions discarded after errors
+        self._keepalive_thread = None
+        self._stop = threading.Event()
+
+    def connect(self, drive_path: str) -> CIPDriver:
+        '''!
+        Opens a brand new session with the robot.
+
+        @param[in] drive_path Robot IP address as a string.
+        @return An open CIPDriver.
+        '''
+        drive = CIPDriver(drive_path)
+        drive.open()
+        if (DEBUG == True):
+          print("Opened CIP session with", drive_path)
+        return drive
+
+    def acquire(self, drive_path: str) -> CIPDriver:
+        '''!
+        Checks an idle session out of the pool, opening a new one if none is idle.
+
+        @param[in] drive_path Robot IP address as a string.
+        @return An open CIPDriver owned by the caller until release() or discard().
+        '''
+        with self._lock:
+            idle = self._idle.get(drive_path)
+            entry = idle.pop() if idle else None
+        if entry is None:
+            return self.connect(drive_path)
+        return entry[0]
+
+    def release(self, drive_path: str, drive: CIPDriver):
+        '''!
+        Returns a healthy session to the pool.
+        '''
+        with self._lock:
+            idle = self._idle.setdefault(drive_path, [])
+            if len(idle) < self.max_idle:
+                idle.append((drive, time.monotonic()))
+                self._start_keepalive()
+                return
+        self._close(drive)
+
+    def discard(self, drive_path: str, drive: CIPDriver):
+        '''!
+        Closes a session that failed and bumps the reconnect generation of its robot.
+        '''
+        with self._lock:
+            self._generation[drive_path] = self._generation.get(drive_path, 0) + 1
+        self._close(drive)
+
+    def generation(self, drive_path: str) -> int:
+        '''!
+        Number of sessions to drive_path that were discarded after a communication error.
+        Callers caching controller state can compare generations to detect a reconnect.
+        '''
+        with self._lock:
+            return self._generation.get(drive_path, 0)
+
+    @contextmanager
+    def session(self, drive_path: str):
+        '''!
+        Context manager yielding a pooled session for drive_path.
+
+        The yielded object exposes generic_message() like a CIPDriver. If the underlying
+        session fails with a CommError it is replaced and the message is sent once more.
+        A session goes back to the pool only if the block ends normally or with one of
+        POST_REPLY_ERRORS after its last reply arrived. Any other exception, or one that
+        interrupts generic_message() (e.g. KeyboardInterrupt), may leave an unread reply on
+        the socket, so the session is closed.
+        '''
+        pooled = _PooledSession(self, drive_path)
+        try:
+            yield pooled
+        except BaseException as e:
+            if pooled.drive is not None:
+                if pooled.pending or not isinstance(e, POST_REPLY_ERRORS):
+                    self.discard(drive_path, pooled.drive)
+                else:
+                    self.release(drive_path, pooled.drive)
+            raise
+        else:
+            if pooled.drive is not None:
+                self.release(drive_path, pooled.drive)
+
+    def close(self, drive_path: str=None):
+        '''!
+        Closes idle sessions for one robot, or for every robot when drive_path is None.
+        '''
+        with self._lock:
+            if drive_path is None:
+                entries = [entry for idle in self._idle.values() for entry in idle]
+                self._idle.clear()
+            else:
+                entries = self._idle.pop(drive_path, [])
+        for drive, _ in entries:
+            self._close(drive)
+
+    def shutdown(self):
+        '''!
+        Stops the keep-alive thread and closes every idle session.
+        '''
+        self._stop.set()
+        self.close()
+
+    def _close(self, drive: CIPDriver):
+        try:
+            drive.close()
+        except Exception as e:
+            if (DEBUG == True):
+              print("Error closing CIP session:", e)
+
+    def _start_keepalive(self):
+        # called with self._lock held
+        if self._keepalive_thread is None or not self._keepalive_thread.is_alive():
+            self._stop.clear()
+            self._keepalive_thread = threading.Thread(target=self._keepalive_loop,
+                                                      name='CIPSessionPool-keepalive',
+                                                      daemon=True)
+            self._keepalive_thread.start()
+
+    def _keepalive_loop(self):
+        while not self._stop.wait(self.keepalive / 2):
+            now = time.monotonic()
+            stale = []
+            with self._lock:
+                for drive_path, idle in self._idle.items():
+                    keep = []
+                    for drive, last_used in idle:
+                        if now - last_used >= self.keepalive:
+                            stale.append((drive_path, drive))
+                        else:
+                            keep.append((drive, last_used))
+                    idle[:] = keep
+
+            for drive_path, drive in stale:
+                # read the identity vendor id as a cheap round trip to keep the session alive
+                try:
+                    tag = drive.generic_message(
+                        service=Services.get_attribute_single,
+                        class_code=0x01,
+                        instance=0x01,
+                        attribute=0x01,
+                        data_type=None,
+                        connected=False,
+                        unconnected_send=False,
+                        route_path=False,
+                        name='fanucKeepAlive'
+                    )
+                except CommError:
+                    self.discard(drive_path, drive)
+                    continue
+                if tag.error and (DEBUG == True):
+                  print("Keep-alive returned error:", tag.error)
+                self.release(drive_path, drive)
+
+
+class _PooledSession:
+    # Proxy handed out by CIPSessionPool.session(); reconnects once on CommError.
+
+    def __init__(self, pool: CIPSessionPool, drive_path: str):
+        self._pool = pool
+        self._drive_path = drive_path
+        self.drive = pool.acquire(drive_path)
+        self.pending = False    # a request was sent and its reply not read yet
+
+    def generic_message(self, **kwargs):
+        self.pending = True
+        try:
+            reply = self.drive.generic_message(**kwargs)
+        except CommError:
+            if (DEBUG == True):
+              print("CIP session to", self._drive_path, "failed, reconnecting")
+            self._pool.discard(self._drive_path, self.drive)
+            self.drive = None
+            self.drive = self._pool.connect(self._drive_path)
+            reply = self.drive.generic_message(**kwargs)
+        self.pending = False
+        return reply
+
+
+## Module wide session pool used by all driver functions
+session_pool = CIPSessionPool()
+atexit.register(session_pool.shutdown)
+
+
+def _session(drive_path):
+    return session_pool.session(drive_path)
+
+
+def close_sessions(drive_path=None):
+    '''!
+    Closes pooled sessions to drive_path, or to every robot when drive_path is None.
+    '''
+    session_pool.close(drive_path)
+
+
 
 #################
-# Cartiseian Functions
+# Position Decoders
 #################
 
-# Read Current Position Registers Cart 
-# returns list [UTOOL, UFRAME, X, Y, Z, W, P, R, Turn1, Turn2, Bitflip, EXT_0, EXT_1, EXT_2, bytearray]
-# bytearray contains full return value
+# FANUC position payloads have a fixed little endian layout. They are unpacked with
+# precompiled struct layouts in a single call straight from the reply buffer.
 
-def returnCartesianCurrentPostion(drive_path):
+## CURPOS / PR[] cartesian payload: UTOOL, UFRAME, X, Y, Z, W, P, R, Turn1, Turn2, Turn3, Bitflip, EXT_0, EXT_1, EXT_2
+CARTESIAN_LAYOUT = struct.Struct('<HH6f4B3f')   # 44 bytes
+## CURJPOS / PR[] joint payload: UTOOL, UFRAME, J1 .. J9
+JOINT_LAYOUT = struct.Struct('<HH9f')           # 40 bytes
 
-# read all Position Registers Cartesian Outputs class 0x7D, I-0x1, A-0x01
-  with CIPDriver(drive_path) as drive:
-        myPRTag = drive.generic_message(
+
+class CartesianPose(NamedTuple):
+    '''!
+        Decoded cartesian position. Index 2..7 are X, Y, Z, W, P, R as in the list API.
+    '''
+    utool: int
+    uframe: int
+    x: float
+    y: float
+    z: float
+    w: float
+    p: float
+    r: float
+    turn1: int
+    turn2: int
+    turn3: int
+    bitflip: int
+    ext0: float
+    ext1: float
+    ext2: float
+
+
+class JointPose(NamedTuple):
+    '''!
+        Decoded joint position. Index 2..10 are J1 .. J9 as in the list API.
+        Unused extended axes (NaN on the controller) decode as 0.0.
+    '''
+    utool: int
+    uframe: int
+    j1: float
+    j2: float
+    j3: float
+    j4: float
+    j5: float
+    j6: float
+    j7: float
+    j8: float
+    j9: float
+
+
+def decodeCartesianPosition(payload) -> CartesianPose:
+  # payload is the raw reply value (bytes, bytearray or memoryview)
+  return CartesianPose._make(CARTESIAN_LAYOUT.unpack_from(memoryview(payload)))
+
+def decodeJointPosition(payload) -> JointPose:
+  values = JOINT_LAYOUT.unpack_from(memoryview(payload))
+  if values[8] != values[8] or values[9] != values[9] or values[10] != values[10]:
+    # J7..J9 are NaN when the robot has no extended axes
+    values = values[:8] + tuple(0.0 if v != v else v for v in values[8:])
+  return JointPose._make(values)
+
+_CARTESIAN_DTYPE = None
+_JOINT_DTYPE = None
+
+def decode_cartesian_array(payloads):
+  '''!
+  Decodes many cartesian payloads into one NumPy structured array, e.g. for logging threads.
+
+  @param[in] payloads Iterable of raw 44 byte payloads (the last element of the list API).
+  @return Structured array with fields utool, uframe, x, y, z, w, p, r, turn1..turn3, bitflip, ext0..ext2.
+  '''
+  global _CARTESIAN_DTYPE
+  import numpy as np
+  if _CARTESIAN_DTYPE is None:
+    _CARTESIAN_DTYPE = np.dtype([(name, '<u2' if name in ('utool', 'uframe') else
+                                        'u1' if name.startswith('turn') or name == 'bitflip' else '<f4')
+                                 for name in CartesianPose._fields])
+  size = CARTESIAN_LAYOUT.size
+  return np.frombuffer(b''.join(memoryview(payload)[:size] for payload in payloads), dtype=_CARTESIAN_DTYPE)
+
+def decode_joint_array(payloads):
+  '''!
+  Decodes many joint payloads into one NumPy structured array with fields utool, uframe, j1..j9.
+  Unused extended axes keep the NaN sent by the controller.
+  '''
+  global _JOINT_DTYPE
+  import numpy as np
+  if _JOINT_DTYPE is None:
+    _JOINT_DTYPE = np.dtype([(name, '<u2' if name in ('utool', 'uframe') else '<f4')
+                             for name in JointPose._fields])
+  size = JOINT_LAYOUT.size
+  return np.frombuffer(b''.join(memoryview(payload)[:size] for payload in payloads), dtype=_JOINT_DTYPE)
+
+def _readPositionPayload(drive_path, class_code, attribute, route_path, name):
+  # returns the raw position payload of one get_attribute_single request
+  with _session(drive_path) as drive:
+        myTag = drive.generic_message(
             service=Services.get_attribute_single,
-            class_code=0x7D,
+            class_code=class_code,
             instance=0x01,
-            attribute=0x01,
+            attribute=attribute,
             data_type=None,
             connected=False,
             unconnected_send=False,
-            route_path=True,
-            name='fanucCURPOSread'
+            route_path=route_path,
+            name=name
         )
-        if (DEBUG == True):
-          print("CURPOS Current Cartesian Coordinates 0x7D, IA< 0x01")
-          print(myPRTag)
-          print("myPRTag.type=", myPRTag.type)
-        myList = list(myPRTag.value)
-        if (DEBUG == True):
-          print("myList=", myList)
+  if (DEBUG == True):
+    print(name, "class", hex(class_code), "attribute", attribute)
+    print(myTag)
+    print('myTag.error=', myTag.error)
+  if not myTag.value:
+    raise ValueError(f"{name} returned no data: {myTag.error}")
+  return myTag.value
+
+
+#################
+# Cartiseian Functions
+#################
 
-  UTOOL = myList[1]*8+myList[0]
-  UFRAME = myList[3]*8+myList[2]
-  X=struct.unpack('f', bytes(myList[4:8]))
-  Y=struct.unpack('f', bytes(myList[8:12]))
-  Z=struct.unpack('f', bytes(myList[12:16]))
-  W=struct.unpack('f', bytes(myList[16:20]))
-  P=struct.unpack('f', bytes(myList[20:24]))
-  R=struct.unpack('f', bytes(myList[24:28]))
-  turn1=struct.unpack('B', bytes(myList[28:29]))
-  turn2=struct.unpack('B', bytes(myList[29:30]))
-  turn3=struct.unpack('B', bytes(myList[30:31]))
-  bitflip=struct.unpack('B', bytes(myList[31:32]))
-  E0=struct.unpack('f', bytes(myList[32:36]))
-  E1=struct.unpack('f', bytes(myList[36:40]))
-  E2=struct.unpack('f', bytes(myList[40:44]))
+# Read Current Position Registers Cart as a CartesianPose
+def returnCartesianCurrentPose(drive_path) -> CartesianPose:
 
+# read all Position Registers Cartesian Outputs class 0x7D, I-0x1, A-0x01
+  payload = _readPositionPayload(drive_path, 0x7D, 0x01, True, 'fanucCURPOSread')
+  pose = decodeCartesianPosition(payload)
   if (DEBUG == True):
-    print("UTOOL=", UTOOL)
-    print("UFRAME=", UFRAME)
-    print("X=", X)
-    print("Y=", Y)
-    print("Z=", Z)
-    print("W=", W)
-    print("P=", P)
-    print("R=", R)
-    print("turn1=", turn1)
-    print("turn2=", turn2)
-    print("turn3=", turn3)
-    print("bitflip=0x", hex(bitflip[0]))
-    print("EXT[0]=", E0)
-    print("EXT[1]=", E1)
-    print("EXT[2]=", E2)
-  
-  returnList = []  
-  returnList.append(UTOOL)
-  returnList.append(UFRAME)
-  returnList.append(X[0])
-  returnList.append(Y[0])
-  returnList.append(Z[0])
-  returnList.append(W[0])
-  returnList.append(P[0])
-  returnList.append(R[0])
-  returnList.append(turn1[0])
-  returnList.append(turn2[0])
-  returnList.append(turn3[0])
-  returnList.append(bitflip[0])
-  returnList.append(E0[0])
-  returnList.append(E1[0])
-  returnList.append(E2[0])
-  returnList.append(myList) 
+    print("CURPOS Current Cartesian Coordinates 0x7D, IA< 0x01")
+    print(pose)
+  return pose
 
+# Read Current Position Registers Cart
+# returns list [UTOOL, UFRAME, X, Y, Z, W, P, R, Turn1, Turn2, Turn3, Bitflip, EXT_0, EXT_1, EXT_2, bytes]
+# bytes contains full return value
+
+def returnCartesianCurrentPostion(drive_path):
+
+  payload = _readPositionPayload(drive_path, 0x7D, 0x01, True, 'fanucCURPOSread')
+  returnList = list(CARTESIAN_LAYOUT.unpack_from(memoryview(payload)))
+  returnList.append(payload)
+  if (DEBUG == True):
+    print("CURPOS=", returnList)
   return returnList
 
 # Read Position Registers Cartesian  (PR[])
 # argument PRNumber is the PR register being written to inside the robot - copied to Postition Register by TP Program
 # to the position register
-# returns list [UTOOL, UFRAME, X, Y, Z, W, P, R, Turn1, Turn2, Bitflip, EXT_0, EXT_1, EXT_2]
+# returns list [UTOOL, UFRAME, X, Y, Z, W, P, R, Turn1, Turn2, Turn3, Bitflip, EXT_0, EXT_1, EXT_2, bytes]
 
 def readCartesianPositionRegister(drive_path, PRNumber):
 
-
-   with CIPDriver(drive_path) as drive:
-        myTag = drive.generic_message(
-            service=Services.get_attribute_single,
-            class_code=0x7B,
-            instance=0x01,
-            attribute=PRNumber,
-            data_type=None,
-            connected=False,
-            unconnected_send=False,
-            route_path=False,
-            name='fanucPRSread'
-        )
-        if (DEBUG == True):
-          print("Read PR registers Cartesian Coordinates 0x7B ")
-          print(myTag)
-          print('myTag.error=', myTag.error)
-          print("myTag.type=", myTag.type)
-
-        myList = list(myTag.value)
-        UTOOL = myList[1]*8+myList[0]
-        UFRAME = myList[3]*8+myList[2]
-        X=struct.unpack('f', bytes(myList[4:8]))
-        Y=struct.unpack('f', bytes(myList[8:12]))
-        Z=struct.unpack('f', bytes(myList[12:16]))
-        W=struct.unpack('f', bytes(myList[16:20]))
-        P=struct.unpack('f', bytes(myList[20:24]))
-        R=struct.unpack('f', bytes(myList[24:28]))
-        turn1=struct.unpack('B', bytes(myList[28:29]))
-        turn2=struct.unpack('B', bytes(myList[29:30]))
-        turn3=struct.unpack('B', bytes(myList[30:31]))
-        bitflip=struct.unpack('B', bytes(myList[31:32]))
-        E0=struct.unpack('f', bytes(myList[32:36]))
-        E1=struct.unpack('f', bytes(myList[36:40]))
-        E2=struct.unpack('f', bytes(myList[40:44]))
-        if (DEBUG == True):
-          print("myList=", myList)
-
-          print("UTOOL=", UTOOL)
-          print("UFRAME=", UFRAME)
-          print("X=", X)
-          print("Y=", Y)
-          print("Z=", Z)
-          print("W=", W)
-          print("P=", P)
-          print("R=", R)
-          print("turn1=", turn1)
-          print("turn2=", turn2)
-          print("turn3=", turn3)
-          print("bitflip=0x", hex(bitflip[0]))
-          print("EXT[0]=", E0)
-          print("EXT[1]=", E1)
-          print("EXT[2]=", E2)
-      
-        returnList = []  
-        returnList.append(UTOOL)
-        returnList.append(UFRAME)
-        returnList.append(X)
-        returnList.append(Y)
-        returnList.append(Z)
-        returnList.append(W)
-        returnList.append(P)
-        returnList.append(R)
-        returnList.append(turn1)
-        returnList.append(turn2)
-        returnList.append(turn3)
-        returnList.append(bitflip)
-        returnList.append(E0)
-        returnList.append(E1)
-        returnList.append(E2)
-        returnList.append(myList) 
-      
-        return returnList
+  payload = _readPositionPayload(drive_path, 0x7B, PRNumber, False, 'fanucPRSread')
+  returnList = list(CARTESIAN_LAYOUT.unpack_from(memoryview(payload)))
+  returnList.append(payload)
+  if (DEBUG == True):
+    print("Read PR registers Cartesian Coordinates 0x7B ")
+    print("PR[%d]=" % PRNumber, returnList)
+  return returnList
 
 # Write Position Registers Cartesian  (PR[])
 # argument PRNumber is the PR register being written to inside the robot - copied to Postition Register by TP Program
-# argument SyncDInput is the DI[x] register being written to inside the robot to tell the robot to start the transfer 
+# argument SyncDInput is the DI[x] register being written to inside the robot to tell the robot to start the transfer
 # to the position register
 # other argument as list [UTOOL, UFRAME, X, Y, Z, W, P, R, Turn1, Turn2, Bitflip, EXT_0, EXT_1, EXT_2]
 
@@ -210,31 +438,13 @@ def readCartesianPositionRegister(drive_path, PRNumber):
 def writeCartesianPositionRegister(drive_path, PRNumber, myList):
 
    #must set UT/UF to 0
+   myBytes = CARTESIAN_LAYOUT.pack(0, 0, *myList[2:15])
 
-
-   #Build myByteArray
-   myByteArray = bytearray(struct.pack('H', 0x0000)) #UTOOL
-   myByteArray.extend(struct.pack('H', 0))      #UFRAME
-   myByteArray.extend(struct.pack('f', myList[2]))      #X
-   myByteArray.extend(struct.pack('f', myList[3]))      #Y
-   myByteArray.extend(struct.pack('f', myList[4]))      #Z
-   myByteArray.extend(struct.pack('f', myList[5]))      #W
-   myByteArray.extend(struct.pack('f', myList[6]))      #P
-   myByteArray.extend(struct.pack('f', myList[7]))      #R
-   myByteArray.extend(struct.pack('B', myList[8]))      #Turn1
-   myByteArray.extend(struct.pack('B', myList[9]))      #Turn2
-   myByteArray.extend(struct.pack('B', myList[10]))     #Turn3
-   myByteArray.extend(struct.pack('B', myList[11]))     #Bitflip
-   myByteArray.extend(struct.pack('f', myList[12]))     #EXT_0
-   myByteArray.extend(struct.pack('f', myList[13]))     #EXT_1
-   myByteArray.extend(struct.pack('f', myList[14]))     #EXT_2
-   
    if (DEBUG == True):
-     print("len(bytes(myByteArray=)", len(bytes(myByteArray)))
-
-     print(myByteArray)
+     print("len(myBytes)", len(myBytes))
+     print(myBytes)
 
-   with CIPDriver(drive_path) as drive:
+   with _session(drive_path) as drive:
         myTag = drive.generic_message(
             service=Services.set_attribute_single,
             class_code=0x7B,
@@ -242,7 +452,7 @@ def writeCartesianPositionRegister(drive_path, PRNumber, myList):
             attribute=PRNumber,
             data_type=None,
             connected=False,
-            request_data=bytes(myByteArray[0:44]),
+            request_data=myBytes,
             unconnected_send=False,
             route_path=False,
             name='fanucPRSwrite'
@@ -260,157 +470,46 @@ def writeCartesianPositionRegister(drive_path, PRNumber, myList):
 # Joint Space Functions
 #################
 
-def returnJointCurrentPosition(drive_path):
+# Read Current Joint Position as a JointPose
+def returnJointCurrentPose(drive_path) -> JointPose:
 
-# read all CURJPOS Joint Outputs class 0x7D, I-0x1, A-0x01
-  with CIPDriver(drive_path) as drive:
-        myPRTag = drive.generic_message(
-            service=Services.get_attribute_single,
-            class_code=0x7E,
-            instance=0x01,
-            attribute=0x01,
-            data_type=None,
-            connected=False,
-            unconnected_send=False,
-            route_path=True,
-            name='fanucCURJPOSread'
-        )
-        if (DEBUG == True):
-          print("CURJPOS Current Joint Coordinates 0x7E, IA< 0x01")
-          print(myPRTag)
-          print("myPRTag.type=", myPRTag.type)
-        myList = list(myPRTag.value)
-        if (DEBUG == True):
-          print("myList=", myList)
+# read all CURJPOS Joint Outputs class 0x7E, I-0x1, A-0x01
+  payload = _readPositionPayload(drive_path, 0x7E, 0x01, True, 'fanucCURJPOSread')
+  pose = decodeJointPosition(payload)
+  if (DEBUG == True):
+    print("CURJPOS Current Joint Coordinates 0x7E, IA< 0x01")
+    print(pose)
+  return pose
 
-  UTOOL = myList[1]*8+myList[0]
-  UFRAME = myList[3]*8+myList[2]
-  J1=struct.unpack('f', bytes(myList[4:8]))
-  J2=struct.unpack('f', bytes(myList[8:12]))
-  J3=struct.unpack('f', bytes(myList[12:16]))
-  J4=struct.unpack('f', bytes(myList[16:20]))
-  J5=struct.unpack('f', bytes(myList[20:24]))
-  J6=struct.unpack('f', bytes(myList[24:28]))
-  J7=struct.unpack('f', bytes(myList[28:32]))
-  J8=struct.unpack('f', bytes(myList[32:36]))
-  J9=struct.unpack('f', bytes(myList[36:40]))
-  if (math.isnan(J7[0]) == True):
-     J7=(0.0,)
-  J8=struct.unpack('f', bytes(myList[32:36]))
-  if (math.isnan(J8[0]) == True):
-     J8=(0.0,)
-  J9=struct.unpack('f', bytes(myList[36:40]))
-  if (math.isnan(J9[0]) == True):
-     J9=(0.0,)
+# Read Current Joint Position
+# returns list [UTOOL, UFRAME, J1, J2, J3, J4, J5, J6, J7, J8, J9, bytes]
 
-  if (DEBUG == True):
-    print("UTOOL=", UTOOL)
-    print("UFRAME=", UFRAME)
-    print("J1=", J1)
-    print("J2=", J2)
-    print("J3=", J3)
-    print("J4=", J4)
-    print("J5=", J5)
-    print("J6=", J6)
-    print("J7=", J7)
-    print("J8=", J8)
-    print("J9=", J9)
-  
-  returnList = []  
-  returnList.append(UTOOL)
-  returnList.append(UFRAME)
-  returnList.append(J1[0])
-  returnList.append(J2[0])
-  returnList.append(J3[0])
-  returnList.append(J4[0])
-  returnList.append(J5[0])
-  returnList.append(J6[0])
-  returnList.append(J7[0])
-  returnList.append(J8[0])
-  returnList.append(J9[0])
-  returnList.append(myList) 
+def returnJointCurrentPosition(drive_path):
 
+  payload = _readPositionPayload(drive_path, 0x7E, 0x01, True, 'fanucCURJPOSread')
+  returnList = list(decodeJointPosition(payload))
+  returnList.append(payload)
+  if (DEBUG == True):
+    print("CURJPOS=", returnList)
   return returnList
 
 
 def readJointPositionRegister(drive_path, PRNumber):
 
-
-  with CIPDriver(drive_path) as drive:
-        myTag = drive.generic_message(
-            service=Services.get_attribute_single,
-            class_code=0x7C,
-            instance=0x01,
-            attribute=0x01,
-            data_type=None,
-            connected=False,
-            unconnected_send=False,
-            route_path=False,
-            name='fanucPRSread'
-        )
-
-
-        if (DEBUG == True):
-          print("PR Contents Joint Coordinates 0x7C, IA< 0x01")
-          print(myTag)
-          print("myTag.type=", myTag.type)
-        myList = list(myTag.value)
-        if (DEBUG == True):
-          print("myList=", myList)
-
-  UTOOL = myList[1]*8+myList[0]
-  UFRAME = myList[3]*8+myList[2]
-  J1=struct.unpack('f', bytes(myList[4:8]))
-  J2=struct.unpack('f', bytes(myList[8:12]))
-  J3=struct.unpack('f', bytes(myList[12:16]))
-  J4=struct.unpack('f', bytes(myList[16:20]))
-  J5=struct.unpack('f', bytes(myList[20:24]))
-  J6=struct.unpack('f', bytes(myList[24:28]))
-  J7=struct.unpack('f', bytes(myList[28:32]))
-  if (math.isnan(J7[0]) == True):
-     J7=(0.0,)
-  J8=struct.unpack('f', bytes(myList[32:36]))
-  if (math.isnan(J8[0]) == True):
-     J8=(0.0,)
-  J9=struct.unpack('f', bytes(myList[36:40]))
-  if (math.isnan(J9[0]) == True):
-     J9=(0.0,)
-
+  payload = _readPositionPayload(drive_path, 0x7C, 0x01, False, 'fanucPRSread')
+  returnList = list(decodeJointPosition(payload))
+  returnList.append(payload)
   if (DEBUG == True):
-    print("UTOOL=", UTOOL)
-    print("UFRAME=", UFRAME)
-    print("J1=", J1)
-    print("J2=", J2)
-    print("J3=", J3)
-    print("J4=", J4)
-    print("J5=", J5)
-    print("J6=", J6)
-    print("J7=", J7)
-    print("J8=", J8)
-    print("J9=", J9)
-  
-  returnList = []  
-  returnList.append(UTOOL)
-  returnList.append(UFRAME)
-  returnList.append(J1[0])
-  returnList.append(J2[0])
-  returnList.append(J3[0])
-  returnList.append(J4[0])
-  returnList.append(J5[0])
-  returnList.append(J6[0])
-  returnList.append(J7[0])
-  returnList.append(J8[0])
-  returnList.append(J9[0])
-  returnList.append(myList) 
-
+    print("PR Contents Joint Coordinates 0x7C, IA< 0x01")
+    print("list=", returnList)
   return returnList
 
 
 # Write Position Registers Joint  (PR[])
 # argument PRNumber is the PR register being written to inside the robot - copied to Postition Register by TP Program
-# argument SyncDInput is the DI[x] register being written to inside the robot to tell the robot to start the transfer 
+# argument SyncDInput is the DI[x] register being written to inside the robot to tell the robot to start the transfer
 # to the position register
-# other argument as list [UTOOL, UFRAME, J1, J2, J3, J4, J5, J6, J7, J8, J9] 
+# other argument as list [UTOOL, UFRAME, J1, J2, J3, J4, J5, J6, J7, J8, J9]
 
 
 
@@ -418,27 +517,13 @@ def readJointPositionRegister(drive_path, PRNumber):
 def writeJointPositionRegister(drive_path, PRNumber, myList):
 
    #must set UT/UF to 0
+   myBytes = JOINT_LAYOUT.pack(0, 0, *myList[2:11])
 
-
-   #Build myByteArray
-   myByteArray = bytearray(struct.pack('H', 0x0000)) #UTOOL
-   myByteArray.extend(struct.pack('H', 0x0000))      #UFRAME
-   myByteArray.extend(struct.pack('f', myList[2]))      #J1
-   myByteArray.extend(struct.pack('f', myList[3]))      #J2
-   myByteArray.extend(struct.pack('f', myList[4]))      #J3
-   myByteArray.extend(struct.pack('f', myList[5]))      #J4
-   myByteArray.extend(struct.pack('f', myList[6]))      #J5
-   myByteArray.extend(struct.pack('f', myList[7]))      #J6
-   myByteArray.extend(struct.pack('f', myList[8]))      #J7
-   myByteArray.extend(struct.pack('f', myList[9]))      #J8
-   myByteArray.extend(struct.pack('f', myList[10]))     #J9
-   
    if (DEBUG == True):
-     print("len(bytes(myByteArray=)", len(bytes(myByteArray)))
-
-     print(myByteArray)
+     print("len(myBytes)", len(myBytes))
+     print(myBytes)
 
-   with CIPDriver(drive_path) as drive:
+   with _session(drive_path) as drive:
         myTag = drive.generic_message(
             service=Services.set_attribute_single,
             class_code=0x7C,
@@ -446,7 +531,7 @@ def writeJointPositionRegister(drive_path, PRNumber, myList):
             attribute=PRNumber,
             data_type=None,
             connected=False,
-            request_data=bytes(myByteArray[0:40]),
+            request_data=myBytes,
             unconnected_send=False,
             route_path=False,
             name='fanucPRSwrite'
@@ -461,16 +546,13 @@ def writeJointPositionRegister(drive_path, PRNumber, myList):
    return myTag.error
 
 
-
-
-
 # write to 16 bit R[] Register 
 # RegNumb is R[] Register Number, Value is up to 16 bits
 # returns error code
 def writeR_Register(drive_path, RegNum, Value):
 
    myBytes = Value.to_bytes(4,'little')
-   with CIPDriver(drive_path) as drive:
+   with _session(drive_path) as drive:
         myTag = drive.generic_message(
             service=0x10,
             class_code=0x6B,
@@ -491,7 +573,7 @@ def writeR_Register(drive_path, RegNum, Value):
 # returns Value
 def readR_Register(drive_path, RegNum):
 	
-   with CIPDriver(drive_path) as drive:
+   with _session(drive_path) as drive:
         myTag = drive.generic_message(
             service=0xe,
             class_code=0x6B,
@@ -512,9 +594,126 @@ def readR_Register(drive_path, RegNum):
           print("myList=", myList)
    return myList[0]
 
+
+#################
+# Batched R[] Register Functions
+#################
+
+# Many R[] accesses are packed into one CIP Multiple Service Packet (service 0x0A,
+# Message Router class 0x02) so a compound command costs one round trip instead of N.
+# The embedded services execute in order on the controller.
+
+MULTI_SERVICE_CHUNK = 32   # embedded services per packet, keeps requests well under 504 bytes
+
+def _encode_multiple_service(requests):
+  # requests is a list of encoded embedded requests (service + path + data)
+  count = len(requests)
+  offsets = []
+  offset = 2 + 2*count
+  for request in requests:
+    offsets.append(offset)
+    offset += len(request)
+  return struct.pack('<%dH' % (count + 1), count, *offsets) + b''.join(requests)
+
+def _decode_multiple_service(data):
+  # returns a list of (general status, reply data) for each embedded service
+  count = struct.unpack_from('<H', data, 0)[0]
+  offsets = struct.unpack_from('<%dH' % count, data, 2)
+  replies = []
+  for i, start in enumerate(offsets):
+    end = offsets[i+1] if i+1 < count else len(data)
+    status = data[start+2]
+    ext_size = data[start+3]
+    replies.append((status, bytes(data[start+4+2*ext_size:end])))
+  return replies
+
+def _send_multiple_service(drive_path, requests, name):
+  # sends embedded requests in chunks over one pooled session, returns [(status, data), ...]
+  replies = []
+  with _session(drive_path) as drive:
+    for i in range(0, len(requests), MULTI_SERVICE_CHUNK):
+      chunk = requests[i:i+MULTI_SERVICE_CHUNK]
+      myTag = drive.generic_message(
+          service=Services.multiple_service_request,
+          class_code=0x02,
+          instance=0x01,
+          request_data=_encode_multiple_service(chunk),
+          data_type=None,
+          connected=False,
+          unconnected_send=False,
+          route_path=False,
+          name=name
+      )
+      if (DEBUG == True):
+        print("Multiple Service Packet", name, myTag)
+      if not myTag.value:
+        # the whole packet failed, report every service in the chunk as failed
+        replies.extend((None, b'') for _ in chunk)
+        continue
+      replies.extend(_decode_multiple_service(myTag.value))
+  return replies
+
+# read many 32 bit R[] Registers in one round trip
+# RegNums is a list of R[] Register Numbers
+# returns dict {RegNum: Value}, Value is None if that register could not be read
+def read_registers(drive_path, RegNums):
+
+   RegNums = list(RegNums)
+   requests = [b'\x0e' + request_path(0x6B, 0x01, RegNum) for RegNum in RegNums]
+   replies = _send_multiple_service(drive_path, requests, 'fanucMultiRread')
+
+   values = {}
+   for RegNum, (status, data) in zip(RegNums, replies):
+     if status == 0 and len(data) >= 4:
+       values[RegNum] = struct.unpack_from('<i', data)[0]
+     else:
+       values[RegNum] = None
+     if (DEBUG == True):
+       print("R[%d]=" % RegNum, values[RegNum])
+   return values
+
+# write many 32 bit R[] Registers in one round trip
+# Values is a dict {RegNum: Value} or a list of (RegNum, Value) pairs, written in order
+# returns None on success, otherwise an error string naming the failed registers
+def write_registers(drive_path, Values):
+
+   if hasattr(Values, 'items'):
+     Values = Values.items()
+   Values = list(Values)
+   requests = [b'\x10' + request_path(0x6B, 0x01, RegNum) + struct.pack('<i', Value)
+               for RegNum, Value in Values]
+   replies = _send_multiple_service(drive_path, requests, 'fanucMultiRwrite')
+
+   failed = [RegNum for (RegNum, _), (status, _) in zip(Values, replies) if status != 0]
+   if failed:
+     return "write failed for R" + str(failed)
+   return None
+
+# read the motion handshake in one round trip
+# StartReg is the R[] Register the TP program clears when a move is finished
+# InPositionDO is an optional DO[] the TP program sets while the robot is in position
+# returns (R[StartReg], DO[InPositionDO] or None), R[StartReg] is None if it could not be read
+def read_motion_status(drive_path, StartReg, InPositionDO=None):
+
+   requests = [b'\x0e' + request_path(0x6B, 0x01, StartReg)]
+   if InPositionDO:
+     requests.append(b'\x0e' + request_path(0x04, 0x321, 0x03))
+   replies = _send_multiple_service(drive_path, requests, 'fanucMotionStatus')
+
+   status, data = replies[0]
+   start = struct.unpack_from('<i', data)[0] if status == 0 and len(data) >= 4 else None
+   in_position = None
+   if InPositionDO:
+     status, data = replies[1]
+     if status == 0 and len(data) > (InPositionDO-1)//8:
+       in_position = (data[(InPositionDO-1)//8] >> ((InPositionDO-1) % 8)) & 1
+   if (DEBUG == True):
+     print("R[%d]=" % StartReg, start, "DO[%s]=" % InPositionDO, in_position)
+   return start, in_position
+
 def readDigitalInputs(drive_path):
 
-    with CIPDriver(drive_path) as drive:
+    with _session(drive_path) as drive:
         myTag = drive.generic_message(
             service=Services.get_attribute_single,
             class_code=0x04,
@@ -536,7 +735,7 @@ def readDigitalInputs(drive_path):
 
 def readDigitalOutputs(drive_path):
   # read all Digital Outputs 0x321
-  with CIPDriver(drive_path) as drive:
+  with _session(drive_path) as drive:
         myTag = drive.generic_message(
             service=Services.get_attribute_single,
             class_code=0x04,
@@ -646,7 +845,7 @@ def writeDigitalInput(drive_path, OutputNumber, Value):
   
   bytesMessage = bytes(outputs)
   print("Message:",bytesMessage)
-  with CIPDriver(drive_path) as drive:
+  with _session(drive_path) as drive:
         myTag = drive.generic_message(
             service=Services.set_attribute_single,
             class_code=0x04,
@@ -791,7 +990,7 @@ class FANUCAlarm:
         '''
         # get a single attribute from list above
 
-        with CIPDriver(drive_path) as driver:
+        with _session(drive_path) as driver:
 
             cip_tag = driver.generic_message(
                                 service=Services.get_attribute_single,
@@ -837,7 +1036,7 @@ class FANUCAlarm:
 
         @return A dict object containing all attributes of the desired alarm object, keyed by the attribute enum name property. Returns none if CIP tag contains an error.
         '''
-        with CIPDriver(drive_path) as driver:
+        with _session(drive_path) as driver:
 
             cip_tag = driver.generic_message(
                                 service=Services.get_attributes_all,
@@ -896,7 +1095,7 @@ def returnMostRecentAlarm(drive_path):
     # DEPRACTED! DEPRACTED I SAY!!!
     # ie, this is just an example of a crude way to retrieve alarms
 
-    with CIPDriver(drive_path) as driver:
+    with _session(drive_path) as driver:
         cip_tag = driver.generic_message(
                     service=Services.get_attributes_all,
                     class_code=0xA1,
@@ -959,7 +1158,7 @@ def returnMostRecentAlarm(drive_path):
 def returnAlarmHistory(drive_path):
     # DEPRACTED! DEPRACTED I SAY!!!
     
-    with CIPDriver(drive_path) as driver:
+    with _session(drive_path) as driver:
         cip_tag = driver.generic_message(
                     service=Services.get_attributes_all,
                     class_code=0xA1,
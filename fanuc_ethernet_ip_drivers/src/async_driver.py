@@ -0,0 +1,384 @@
+"""! @brief Asyncio EtherNet/IP driver for FANUC controllers."""
+
+##
+# @file async_driver.py
+#
+# @brief asyncio implementation of the FANUCethernetipDriver register, position register,
+# digital I/O and alarm operations.
+#
+# @section description_async_driver Description
+# pycomm3 is blocking, so this module speaks the EtherNet/IP encapsulation directly over
+# an asyncio stream. One TCP session is kept per AsyncFANUCDriver. Every request carries
+# a unique sender context and replies are matched back to their awaiting coroutine, so
+# independent requests issued with asyncio.gather() are pipelined on the one socket
+# instead of waiting for each other.
+#
+# Payload layouts and Multiple Service Packet helpers are shared with the blocking driver.
+#
+
+# Imports
+import asyncio
+import itertools
+import struct
+import typing
+
+from pycomm3 import DataTypes, Services
+from pycomm3.packets.util import request_path
+
+import FANUCethernetipDriver
+from FANUCethernetipDriver import (
+    CARTESIAN_LAYOUT, JOINT_LAYOUT, CartesianPose, JointPose, FANUCAlarm,
+    decodeCartesianPosition, decodeJointPosition,
+    _encode_multiple_service, _decode_multiple_service, MULTI_SERVICE_CHUNK,
+)
+
+EIP_PORT = 44818
+
+# EtherNet/IP encapsulation commands
+REGISTER_SESSION = 0x65
+UNREGISTER_SESSION = 0x66
+SEND_RR_DATA = 0x6F
+
+ENCAP_HEADER = struct.Struct('<HHII8sI')   # command, length, session, status, context, options
+CPF_UNCONNECTED = struct.Struct('<IHHHHHH')  # interface, timeout, item count, null addr type/len, data type/len
+
+
+## Raised when the controller rejects a request or the connection fails
+class AsyncCIPError(Exception):
+    pass
+
+
+## Reply to one CIP request
+class CIPReply(typing.NamedTuple):
+    service: int
+    status: int
+    ext_status: bytes
+    value: bytes
+
+    @property
+    def error(self) -> typing.Optional[str]:
+        return None if self.status == 0 else f"CIP general status 0x{self.status:02x}"
+
+
+## Asyncio FANUC Driver Class
+# @param robot_IP
+class AsyncFANUCDriver:
+    def __init__(self, robot_IP: str, port: int=EIP_PORT, timeout: float=5.0):
+        """! Creates a driver, the connection is opened on first use or by open().
+        @param robot_IP     IP address of robot, "ip:port" overrides port (same form as the sync driver)
+        @param port         EtherNet/IP TCP port
+        @param timeout      seconds to wait for each reply
+        """
+        if ':' in robot_IP:
+            robot_IP, port = robot_IP.rsplit(':', 1)
+            port = int(port)
+        self.robot_IP = robot_IP
+        self.port = port
+        self.timeout = timeout
+
+        self._reader = None
+        self._writer = None
+        self._session = 0
+        self._pending = {}          # sender context -> Future
+        self._contexts = itertools.count(1)
+        self._receiver = None
+        self._open_lock = None
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    @property
+    def connected(self) -> bool:
+        return self._writer is not None and self._session != 0
+
+    async def open(self):
+        """! Opens the TCP connection and registers an EtherNet/IP session.
+        """
+        if self._open_lock is None:
+            self._open_lock = asyncio.Lock()
+        async with self._open_lock:
+            if self.connected:
+                return
+            self._reader, self._writer = await asyncio.wait_for(
+                asyncio.open_connection(self.robot_IP, self.port), self.timeout)
+            self._receiver = asyncio.ensure_future(self._receive_loop())
+            reply = await self._transact(REGISTER_SESSION, struct.pack('<HH', 1, 0))
+            self._session = reply[0]
+            if FANUCethernetipDriver.DEBUG:
+                print(f"[AsyncFANUCDriver] Session {self._session} registered with {self.robot_IP}")
+
+    async def close(self):
+        """! Unregisters the session and closes the connection.
+        """
+        writer = self._writer
+        if writer is None:
+            return
+        try:
+            if self._session:
+                header = ENCAP_HEADER.pack(UNREGISTER_SESSION, 0, self._session, 0, bytes(8), 0)
+                writer.write(header)
+                await writer.drain()
+        except (ConnectionError, OSError):
+            pass
+        self._teardown(AsyncCIPError("connection closed"))
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except (ConnectionError, OSError):
+            pass
+
+    def _teardown(self, exc: Exception):
+        self._writer = None
+        self._reader = None
+        self._session = 0
+        if self._receiver is not None and self._receiver is not asyncio.current_task():
+            self._receiver.cancel()
+        self._receiver = None
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(exc)
+        self._pending.clear()
+
+    async def _receive_loop(self):
+        reader = self._reader
+        try:
+            while True:
+                header = await reader.readexactly(ENCAP_HEADER.size)
+                command, length, session, status, context, options = ENCAP_HEADER.unpack(header)
+                data = await reader.readexactly(length) if length else b''
+                future = self._pending.pop(context, None)
+                if future is None or future.done():
+                    continue
+                if status != 0:
+                    future.set_exception(AsyncCIPError(f"encapsulation status 0x{status:08x}"))
+                else:
+                    future.set_result((session, data))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._teardown(AsyncCIPError(f"connection to {self.robot_IP} lost: {e}"))
+
+    async def _transact(self, command: int, data: bytes):
+        # sends one encapsulation packet and waits for the reply with the same sender context
+        context = struct.pack('<Q', next(self._contexts))
+        future = asyncio.get_running_loop().create_future()
+        self._pending[context] = future
+        self._writer.write(ENCAP_HEADER.pack(command, len(data), self._session, 0, context, 0) + data)
+        try:
+            await self._writer.drain()
+            return await asyncio.wait_for(future, self.timeout)
+        except (ConnectionError, OSError) as e:
+            self._teardown(AsyncCIPError(f"connection to {self.robot_IP} lost: {e}"))
+            raise AsyncCIPError(str(e)) from e
+        finally:
+            self._pending.pop(context, None)
+
+    async def generic_message(self, service: int, class_code: int, instance: int,
+                              attribute: typing.Optional[int]=None, request_data: bytes=b'') -> CIPReply:
+        """! Sends one unconnected explicit message (SendRRData) and returns its reply.
+        Reconnects once if the connection was lost.
+        """
+        message = bytes([service]) + request_path(class_code, instance, attribute or b'') + request_data
+        cpf = CPF_UNCONNECTED.pack(0, 10, 2, 0x0000, 0, 0x00B2, len(message)) + message
+        for attempt in range(2):
+            if not self.connected:
+                await self.open()
+            try:
+                _, data = await self._transact(SEND_RR_DATA, cpf)
+                break
+            except AsyncCIPError:
+                if attempt == 1 or self.connected:
+                    raise
+        # walk the common packet format items after interface handle and timeout
+        item_count = struct.unpack_from('<H', data, 6)[0]
+        offset = 8
+        body = b''
+        for _ in range(item_count):
+            item_type, item_len = struct.unpack_from('<HH', data, offset)
+            if item_type == 0x00B2:
+                body = data[offset + 4:offset + 4 + item_len]
+            offset += 4 + item_len
+        if len(body) < 4:
+            raise AsyncCIPError("reply without unconnected data item")
+        ext_size = body[3]
+        return CIPReply(body[0] & 0x7F, body[2], body[4:4 + 2 * ext_size], body[4 + 2 * ext_size:])
+
+    # Batched services
+
+    async def multiple_service(self, requests: list) -> list:
+        """! Sends encoded embedded requests in Multiple Service Packets.
+        @return     [(general status, reply data), ...] in request order
+        """
+        replies = []
+        for i in range(0, len(requests), MULTI_SERVICE_CHUNK):
+            chunk = requests[i:i + MULTI_SERVICE_CHUNK]
+            reply = await self.generic_message(Services.multiple_service_request[0], 0x02, 0x01,
+                                               request_data=_encode_multiple_service(chunk))
+            if not reply.value:
+                replies.extend((None, b'') for _ in chunk)
+                continue
+            replies.extend(_decode_multiple_service(reply.value))
+        return replies
+
+    # R[] Registers
+
+    async def read_register(self, reg_num: int) -> int:
+        """! Reads one R[] register.
+        """
+        reply = await self.generic_message(0x0E, 0x6B, 0x01, reg_num)
+        if reply.status != 0:
+            raise AsyncCIPError(f"read R[{reg_num}] failed: {reply.error}")
+        return struct.unpack_from('<i', reply.value)[0]
+
+    async def write_register(self, reg_num: int, value: int) -> typing.Optional[str]:
+        """! Writes one R[] register, returns None or an error string like writeR_Register.
+        """
+        reply = await self.generic_message(0x10, 0x6B, 0x01, reg_num, struct.pack('<i', value))
+        return reply.error
+
+    async def read_registers(self, reg_nums) -> dict:
+        """! Reads many R[] registers in one round trip, see FANUCethernetipDriver.read_registers.
+        """
+        reg_nums = list(reg_nums)
+        replies = await self.multiple_service([b'\x0e' + request_path(0x6B, 0x01, reg) for reg in reg_nums])
+        return {reg: struct.unpack_from('<i', data)[0] if status == 0 and len(data) >= 4 else None
+                for reg, (status, data) in zip(reg_nums, replies)}
+
+    async def write_registers(self, values) -> typing.Optional[str]:
+        """! Writes many R[] registers in order in one round trip, see FANUCethernetipDriver.write_registers.
+        """
+        if hasattr(values, 'items'):
+            values = values.items()
+        values = list(values)
+        replies = await self.multiple_service(
+            [b'\x10' + request_path(0x6B, 0x01, reg) + struct.pack('<i', value) for reg, value in values])
+        failed = [reg for (reg, _), (status, _) in zip(values, replies) if status != 0]
+        return "write failed for R" + str(failed) if failed else None
+
+
+    async def read_motion_status(self, start_register: int, in_position_do: int=None) -> tuple:
+        """! Reads R[start_register] and optionally DO[in_position_do] in one round trip,
+        see FANUCethernetipDriver.read_motion_status.
+        """
+        requests = [b'\x0e' + request_path(0x6B, 0x01, start_register)]
+        if in_position_do:
+            requests.append(b'\x0e' + request_path(0x04, 0x321, 0x03))
+        replies = await self.multiple_service(requests)
+        status, data = replies[0]
+        start = struct.unpack_from('<i', data)[0] if status == 0 and len(data) >= 4 else None
+        in_position = None
+        if in_position_do:
+            status, data = replies[1]
+            byte = (in_position_do - 1) // 8
+            if status == 0 and len(data) > byte:
+                in_position = (data[byte] >> ((in_position_do - 1) % 8)) & 1
+        return start, in_position
+
+    # Position Registers
+
+    async def _read_position(self, class_code: int, attribute: int) -> bytes:
+        reply = await self.generic_message(0x0E, class_code, 0x01, attribute)
+        if reply.status != 0 or not reply.value:
+            raise AsyncCIPError(f"position read class 0x{class_code:02x} failed: {reply.error}")
+        return reply.value
+
+    async def read_cartesian_current_pose(self) -> CartesianPose:
+        """! Reads CURPOS (class 0x7D).
+        """
+        return decodeCartesianPosition(await self._read_position(0x7D, 0x01))
+
+    async def read_joint_current_pose(self) -> JointPose:
+        """! Reads CURJPOS (class 0x7E).
+        """
+        return decodeJointPosition(await self._read_position(0x7E, 0x01))
+
+    async def read_cartesian_position_register(self, pr_number: int) -> CartesianPose:
+        """! Reads cartesian PR[pr_number] (class 0x7B).
+        """
+        return decodeCartesianPosition(await self._read_position(0x7B, pr_number))
+
+    async def read_joint_position_register(self, pr_number: int) -> JointPose:
+        """! Reads joint PR[pr_number] (class 0x7C).
+        """
+        return decodeJointPosition(await self._read_position(0x7C, pr_number))
+
+    async def write_cartesian_position_register(self, pr_number: int, pose) -> typing.Optional[str]:
+        """! Writes cartesian PR[pr_number], pose uses the list layout of writeCartesianPositionRegister.
+        """
+        reply = await self.generic_message(0x10, 0x7B, 0x01, pr_number,
+                                           CARTESIAN_LAYOUT.pack(0, 0, *pose[2:15]))
+        return reply.error
+
+    async def write_joint_position_register(self, pr_number: int, pose) -> typing.Optional[str]:
+        """! Writes joint PR[pr_number], pose uses the list layout of writeJointPositionRegister.
+        """
+        reply = await self.generic_message(0x10, 0x7C, 0x01, pr_number,
+                                           JOINT_LAYOUT.pack(0, 0, *pose[2:11]))
+        return reply.error
+
+    # Digital I/O
+
+    async def read_digital_inputs(self) -> list:
+        reply = await self.generic_message(0x0E, 0x04, 0x320, 0x03)
+        return list(reply.value)
+
+    async def read_digital_outputs(self) -> list:
+        reply = await self.generic_message(0x0E, 0x04, 0x321, 0x03)
+        return list(reply.value)
+
+    async def read_digital_input(self, input_number: int) -> int:
+        """! Reads DI[input_number] (1 or 0).
+        """
+        if not input_number:
+            raise ValueError("Cannot select 0-th register, does not exist")
+        inputs = await self.read_digital_inputs()
+        return (inputs[(input_number - 1) // 8] >> ((input_number - 1) % 8)) & 1
+
+    async def read_digital_output(self, output_number: int) -> int:
+        """! Reads DO[output_number] (1 or 0).
+        """
+        if not output_number:
+            raise ValueError("Cannot select 0-th register, does not exist")
+        outputs = await self.read_digital_outputs()
+        return (outputs[(output_number - 1) // 8] >> ((output_number - 1) % 8)) & 1
+
+    # Alarms
+
+    async def get_alarm_attribute(self, class_code=FANUCAlarm.types.alarm_history,
+                                  instance: int=1, attribute=FANUCAlarm.attributes.alarm_number) -> typing.Optional[dict]:
+        """! Async FANUCAlarm.get_attribute_single.
+        """
+        reply = await self.generic_message(0x0E, class_code.value, instance, attribute.value[0])
+        if reply.status != 0:
+            print(f'[ERROR] alarm attribute {attribute.name}: {reply.error}')
+            return None
+        if attribute.value[1] is None:
+            return {attribute.name: FANUCAlarm.__string_decode__(reply.value, 0, attribute.value[3])}
+        return {attribute.name: attribute.value[1].decode(reply.value)}
+
+    async def get_alarm(self, class_code=FANUCAlarm.types.alarm_history, instance: int=1) -> typing.Optional[dict]:
+        """! Async FANUCAlarm.get_attributes_all.
+        """
+        reply = await self.generic_message(0x01, class_code.value, instance)
+        if reply.status != 0:
+            print(f'[ERROR] alarm {class_code.name}: {reply.error}')
+            return None
+        buff = reply.value
+        alarm_dict = {
+            'alarm_id': DataTypes.int.decode(buff[:2]),
+            'alarm_number': DataTypes.int.decode(buff[2:4]),
+            'alarm_id_cause_code': DataTypes.int.decode(buff[4:6]),
+            'alarm_num_cause_code': DataTypes.int.decode(buff[6:8]),
+            'alarm_severity': DataTypes.int.decode(buff[8:10]),
+            'pad': DataTypes.int.decode(buff[10:12]),
+            'time_stamp': DataTypes.dint.decode(buff[12:16]),
+        }
+        alarm_dict['date_time_str'] = FANUCAlarm.__string_decode__(buff, 16, 28)
+        alarm_dict['alarm_message'] = FANUCAlarm.__string_decode__(buff, 44, 88)
+        alarm_dict['cause_code_message'] = FANUCAlarm.__string_decode__(buff, 132, 88)
+        alarm_dict['alarm_severity_str'] = FANUCAlarm.__string_decode__(buff, 220, 28)
+        return alarm_dict
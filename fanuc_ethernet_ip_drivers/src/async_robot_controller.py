@@ -0,0 +1,302 @@
+"""! @brief Defines the asyncio robot controller class."""
+
+##
+# @file async_robot_controller.py
+#
+# @brief Defines AsyncRobot, an asyncio mirror of robot_controller.robot.
+#
+# @section description_async_robot_controller Description
+# AsyncRobot exposes the same operations as robot_controller.robot as coroutines on top of
+# async_driver.AsyncFANUCDriver. One event loop can then drive motion, telemetry polling
+# and PLC traffic concurrently, and independent requests can be pipelined with
+# asyncio.gather() on a single EtherNet/IP session.
+#
+# @section example_async_robot_controller Example
+#   async with AsyncRobot(ROBOT_IP) as woody:
+#       pose, speed = await asyncio.gather(woody.read_current_cartesian_pose(), woody.get_speed())
+#       await woody.write_cartesian_position([200, 0, 50])
+#
+
+# Imports
+import asyncio
+import time
+import FANUCethernetipDriver
+from async_driver import AsyncFANUCDriver
+from motion_monitor import MotionStats, backoff_intervals
+
+
+## Async Robot Class
+# @param self, robotIP
+class AsyncRobot:
+    def __init__(self, robotIP: str, DEBUG: bool=False):
+        """! Creates the robot, call connect() or use "async with" before issuing commands.
+        @param robotIP      IP address of robot
+        """
+        self.robot_IP = robotIP
+        self.driver = AsyncFANUCDriver(robotIP)
+        self.CurJointPosList = None
+        self.CurCartesianPosList = None
+        self.PRNumber = 1 # This is the position register for holding coordinates
+        self.PRNumber2 = 2
+        self.PRNumber3 = 3
+
+        self.start_register = 1
+        self.sync_register = 2 # gripper/conveyor?
+        self.sync_value = 1
+        self.speed_register = 5
+        self.speed_percent = 6
+        self.uframe = 7
+        self.utool = 8
+
+        self.in_position_do = None # optional DO[] set by the TP program while in position
+        self.motion_timeout = 60.0
+        self.motion_stats = MotionStats()
+        self._move_started = None
+
+        self.DEBUG = DEBUG
+        FANUCethernetipDriver.DEBUG = DEBUG
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def connect(self):
+        """! Opens the session and reads the current joint and cartesian position.
+        """
+        await self.driver.open()
+        joints, cart = await asyncio.gather(self.driver.read_joint_current_pose(),
+                                            self.driver.read_cartesian_current_pose())
+        self.CurJointPosList = list(joints)
+        self.CurCartesianPosList = list(cart)
+        print("Connection made with robot at ", self.robot_IP)
+
+    async def close(self):
+        """! Closes the session with the robot.
+        """
+        await self.driver.close()
+
+    # Joint movement functions
+
+    async def read_current_joint_position(self) -> list:
+        """! Returns list of angles at each joint. [0] -> joint 1
+        """
+        self.CurJointPosList = list(await self.driver.read_joint_current_pose())
+        return self.CurJointPosList[2:8]
+
+    async def write_joint_pose(self, joint_position_array: list, blocking: bool=True):
+        """! Set a pose(all joint positions) for robot
+        @param joint_position_array         a list of joint angles, or a list of such lists
+        """
+        if isinstance(joint_position_array[0], list):
+            if not all(isinstance(x, list) for x in joint_position_array):
+                raise Warning("If passing a list of lists, all elements must be lists!")
+            for jlist in joint_position_array:
+                await self.write_joint_pose(jlist, blocking=blocking)
+            return
+
+        for joint_number, angle in enumerate(joint_position_array, start=2):
+            self.CurJointPosList[joint_number] = angle
+        await self.driver.write_joint_position_register(self.PRNumber, self.CurJointPosList)
+        await self.start_robot(blocking=blocking)
+
+    # Cartesian Movement Functions
+
+    async def read_current_cartesian_pose(self) -> list:
+        """! Returns current cartesian coordinates [X, Y, Z, W, P, R]
+        """
+        pose = await self.driver.read_cartesian_current_pose()
+        return list(pose[2:8])
+
+    async def write_cartesian_position(self, coords: list, blocking: bool=True, pr_number: int=None):
+        """! Send cartesian coordinates to robot using X, Y, Z, W, P, R system.
+        @param coords[X, Y, Z, W, P, R]  OR  coords[X, Y, Z]  OR  coords[[X,Y,Z,W,P,R], [X,Y,Z,...], ...]
+        @param pr_number    position register to use, defaults to PR[1]
+        """
+        if isinstance(coords[0], list):
+            if not all(isinstance(x, list) for x in coords):
+                raise Warning("If passing a list of lists, all elements must be lists!")
+            for coord in coords:
+                await self.write_cartesian_position(coord, blocking=blocking, pr_number=pr_number)
+            return
+
+        if len(coords) not in (3, 6):
+            raise Warning("Not enough values passed!")
+        self.CurCartesianPosList[2:2 + len(coords)] = coords
+        await self.driver.write_cartesian_position_register(pr_number or self.PRNumber, self.CurCartesianPosList)
+        await self.start_robot(blocking=blocking)
+
+    # Utility Functions
+
+    async def set_speed(self, value: int):
+        """! Set movement speed of robot in mm/s
+        @param value        speed in mm/s
+        """
+        if value > 300 or value < 0:
+            raise Warning(f"Speed should be in the range of [0, 300], got {value}")
+        await self.driver.write_register(self.speed_register, value)
+
+    async def get_speed(self) -> int:
+        """! Returns current set speed of robot in mm/s
+        """
+        return await self.driver.read_register(self.speed_register)
+
+    async def set_robot_speed_percent(self, value: int):
+        """! Set speed override percentage of robot
+        @param value        percent 0-100
+        """
+        if value > 100 or value < 0:
+            raise Warning(f"Speed percent should be in the range of [0, 100], got {value}")
+        await self.driver.write_register(self.speed_percent, value)
+
+    async def get_robot_speed_percent(self) -> int:
+        return await self.driver.read_register(self.speed_percent)
+
+    async def set_robot_uframe(self, value: int):
+        """! Set the active user frame register on the robot, value within [0, 30].
+        """
+        if not (0 <= value <= 30):
+            raise ValueError(f"User frame must be within the range [0, 30], received: {value}")
+        await self.driver.write_register(self.uframe, value)
+
+    async def get_robot_uframe(self) -> int:
+        return await self.driver.read_register(self.uframe)
+
+    async def set_robot_utool(self, value: int):
+        """! Set the active user tool register on the robot, value within [0, 10].
+        """
+        if not (0 <= value <= 10):
+            raise ValueError(f"User tool must be within the range [0, 10], received: {value}")
+        await self.driver.write_register(self.utool, value)
+
+    async def get_robot_utool(self) -> int:
+        return await self.driver.read_register(self.utool)
+
+    async def get_actual_robot_speed(self) -> float:
+        """! Actual speed in mm/sec from the set speed and speed percentage (one round trip).
+        """
+        values = await self.driver.read_registers([self.speed_register, self.speed_percent])
+        return (values[self.speed_percent] / 100.0) * values[self.speed_register]
+
+    async def start_robot(self, blocking: bool=True):
+        """! starts robot movement by setting the start register to 1 on the TP program executing commands.
+        @param blocking     True/False wait to continue till move is finished. Default=True
+        """
+        await self.driver.write_register(self.start_register, 1)
+        self._move_started = time.monotonic()
+        if blocking:
+            await self.wait_for_motion()
+
+    async def wait_for_motion(self, timeout: float=None, deadline: float=None) -> float:
+        """! Waits until the TP program clears the start register (and sets the in-position DO),
+        polling with adaptive backoff, see motion_monitor.MotionMonitor.wait_for_completion.
+        @return             move latency in seconds since start_robot()
+        """
+        if deadline is None:
+            deadline = time.monotonic() + (self.motion_timeout if timeout is None else timeout)
+        started = self._move_started if self._move_started is not None else time.monotonic()
+        self._move_started = None
+        polls = 0
+        for interval in backoff_intervals():
+            polls += 1
+            if not await self.is_moving():
+                latency = time.monotonic() - started
+                self.motion_stats.record(latency, polls)
+                return latency
+            now = time.monotonic()
+            if now >= deadline:
+                self.motion_stats.timeouts += 1
+                raise TimeoutError(f"Move did not complete within {now - started:.2f} s, "
+                                   f"R[{self.start_register}] is still set, check TP for further diagnosis")
+            await asyncio.sleep(min(interval, deadline - now))
+
+    async def is_moving(self) -> bool:
+        """! checks the start register (and in-position DO) handshake, True while a move is executing
+        """
+        start, in_position = await self.driver.read_motion_status(self.start_register, self.in_position_do)
+        if start is None:
+            raise IOError(f"Could not read R[{self.start_register}] on {self.robot_IP}")
+        return start != 0 or (self.in_position_do is not None and in_position != 1)
+
+    async def read_robot_start_register(self) -> int:
+        return await self.driver.read_register(self.start_register)
+
+    async def schunk_gripper(self, command: str, wait: bool=True):
+        """! controls schunk gripper.
+        @param command      string 'open' or 'close'
+        """
+        if command == 'open':
+            await self.driver.write_registers({20: 0, 23: 1, self.sync_register: 1})
+        elif command == 'close':
+            await self.driver.write_registers({20: 1, 23: 0, self.sync_register: 1})
+        else:
+            raise Warning(f"Gripper only supports 'open' or 'closed' strings")
+        if wait is True:
+            await asyncio.sleep(0.5)
+
+    async def onRobot_gripper(self, width_in_mm: int, force_in_newtons: int, wait: bool=True):
+        """! moves the onRobot gripper
+        @param width_in_mm          value in mm to set gripper jaw distance
+        @param force_in_newtons     value 0-120 in newtons
+        """
+        if width_in_mm > 160 or width_in_mm < 0:
+            raise Warning(f"Width should be in the range of [0, 160], got {width_in_mm}")
+        if force_in_newtons > 120 or force_in_newtons < 0:
+            raise Warning(f"Force should be in the range of [0, 120], got {force_in_newtons}")
+
+        await self.driver.write_registers({35: 0, 36: width_in_mm, 37: force_in_newtons, 3: 1})
+        if wait is True:
+            await self.driver.write_registers({42: 4, 43: 50})
+            await asyncio.sleep(0.5)
+            gripper_is_moving = True
+            while gripper_is_moving:
+                await self.driver.write_register(3, 3)
+                gripper_is_moving = await self.driver.read_register(50)
+
+    async def conveyor_proximity_sensor(self, sensor) -> int:
+        """! reads proximity sensors
+        @param sensor               string 'right' or 'left' sensor
+        """
+        if sensor == "right":
+            return await self.driver.read_register(31)
+        elif sensor == "left":
+            return await self.driver.read_register(30)
+        raise Warning("Invalid Sensor, Try 'right' or 'left'\n")
+
+    async def conveyor(self, command: str):
+        """! Controls conveyor belt
+        @param command          string 'forward' or 'reverse' or 'stop'
+        """
+        forward_register = 21
+        reverse_register = 22
+        stop_belt = {reverse_register: 0, forward_register: 0, self.sync_register: self.sync_value}
+
+        if command == 'forward':
+            await self.driver.write_registers(stop_belt)
+            await self.driver.write_registers({forward_register: 1, self.sync_register: self.sync_value})
+        elif command == 'reverse':
+            await self.driver.write_registers(stop_belt)
+            await self.driver.write_registers({reverse_register: 1, self.sync_register: self.sync_value})
+        elif command == 'stop':
+            await self.driver.write_registers(stop_belt)
+        else:
+            raise Warning(f"Conveyor only supports 'forward', 'reverse' or 'stop' strings")
+
+    async def read_robot_connection_bit(self) -> int:
+        """! Reads and returns the value at DI[1]
+        """
+        return await self.driver.read_digital_input(1)
+
+    async def write_robot_connection_bit(self, status):
+        """! Writes a value to R[1]->DO[1]
+        """
+        if status > 1 or status < 0:
+            raise ValueError("Value must be either 1 or 0")
+        await self.driver.write_registers({1: status, self.sync_register: self.sync_value})
+
+    async def get_alarm(self, class_code=FANUCethernetipDriver.FANUCAlarm.types.active_alarm, instance: int=1):
+        """! Returns all attributes of an alarm object as a dict, see FANUCAlarm.get_attributes_all.
+        """
+        return await self.driver.get_alarm(class_code, instance)
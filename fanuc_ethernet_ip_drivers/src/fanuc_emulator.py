@@ -0,0 +1,536 @@
+"""! @brief Loopback EtherNet/IP emulator of the FANUC objects used by the driver."""
+
+##
+# @file fanuc_emulator.py
+#
+# @brief Emulates a FANUC controller with the EtherNet/IP explicit messaging option.
+#
+# @section description_fanuc_emulator Description
+# FANUCEmulator is an EtherNet/IP (TCP 44818 style) server that answers the unconnected
+# explicit messages issued by FANUCethernetipDriver and async_driver:
+#   - R[] registers                     class 0x6B
+#   - PR[] cartesian / joint            class 0x7B / 0x7C
+#   - CURPOS / CURJPOS                  class 0x7D / 0x7E
+#   - DI / DO                           class 0x04, instance 0x320 / 0x321
+#   - alarm objects                     class 0xA0 - 0xA6
+#   - identity (keep-alive probe)       class 0x01
+#   - Multiple Service Packet           service 0x0A on class 0x02
+#
+# Writing 1 to R[start_register] starts a move toward the most recently written PR, the
+# way the ros2_eip TP program does. The look-ahead loop of ros2_eip_stream_pt (see
+# trajectory_streamer.py) is emulated as well, streamed segments are chained without stops. The move runs at R[speed_register] mm/s (cartesian)
+# or joint_speed deg/s (joint) and clears R[start_register] when it finishes. Network
+# latency and jitter are added to every reply, so driver throughput and end-to-end move
+# latency can be benchmarked and regression-tested on a plain Linux box. Requests are
+# executed in arrival order but their replies are delayed independently, so requests
+# pipelined on one session (async_driver) overlap their latency like on a real network
+# and jitter may reorder the replies.
+#
+# Motion is evaluated lazily from a monotonic clock whenever a request arrives, so the
+# emulator has no tick thread. Cartesian and joint positions are not kinematically
+# linked: a cartesian move leaves CURJPOS unchanged and vice versa.
+#
+# @section example_fanuc_emulator Example
+#   with FANUCEmulator(latency=0.002, jitter=0.0005) as emu:
+#       woody = robot(emu.address)
+#       woody.write_cartesian_position([200, 0, 50])
+#
+#   python fanuc_emulator.py --port 44818 --latency-ms 2
+#
+
+# Imports
+import argparse
+import asyncio
+import math
+import random
+import struct
+import threading
+import time
+import typing
+
+from FANUCethernetipDriver import CARTESIAN_LAYOUT, JOINT_LAYOUT
+from async_driver import ENCAP_HEADER, REGISTER_SESSION, UNREGISTER_SESSION, SEND_RR_DATA
+from trajectory_streamer import (STREAM_WRITE_REGISTER, STREAM_READ_REGISTER, STREAM_STATE_REGISTER,
+                                 STREAM_FIRST_PR, STREAM_SLOTS, STREAM_IDLE, STREAM_FINISH)
+
+NOP = 0x00
+LIST_IDENTITY = 0x63
+
+# CIP general status codes
+SUCCESS = 0x00
+PATH_DESTINATION_UNKNOWN = 0x05
+SERVICE_NOT_SUPPORTED = 0x08
+NOT_ENOUGH_DATA = 0x13
+ATTRIBUTE_NOT_SUPPORTED = 0x14
+EMBEDDED_SERVICE_ERROR = 0x1E
+
+GET_ATTRIBUTES_ALL = 0x01
+GET_ATTRIBUTE_SINGLE = 0x0E
+SET_ATTRIBUTE_SINGLE = 0x10
+MULTIPLE_SERVICE = 0x0A
+
+ALARM_CLASSES = range(0xA0, 0xA7)
+# alarm attribute number -> (offset, length) inside the get_attributes_all buffer
+ALARM_FIELDS = {1: (0, 2), 2: (2, 2), 3: (4, 2), 4: (6, 2), 5: (8, 2), 6: (12, 4),
+                7: (16, 28), 8: (44, 88), 9: (132, 88), 10: (220, 28)}
+ALARM_SIZE = 248
+
+
+## One alarm held by the emulator
+class EmulatedAlarm(typing.NamedTuple):
+    alarm_id: int = 0
+    alarm_number: int = 0
+    severity: int = 0
+    message: str = ''
+    cause: str = ''
+    severity_str: str = ''
+    date_time: str = ''
+
+    def encode(self) -> bytes:
+        buff = bytearray(ALARM_SIZE)
+        struct.pack_into('<hhhhhhi', buff, 0, self.alarm_id, self.alarm_number, 0, 0,
+                         self.severity, 0, int(time.time()) & 0x7FFFFFFF)
+        for attribute, text in ((7, self.date_time), (8, self.message), (9, self.cause), (10, self.severity_str)):
+            offset, length = ALARM_FIELDS[attribute]
+            raw = text.encode('utf-8')[:length - 5]
+            # FANUC strings: 2 byte length (including terminator), 2 byte pad, characters
+            struct.pack_into('<h2x%ds' % len(raw), buff, offset, len(raw) + 1, raw)
+        return bytes(buff)
+
+
+## Emulated motion in progress
+class _Move(typing.NamedTuple):
+    kind: str            # 'cartesian' or 'joint'
+    start: tuple
+    target: tuple
+    t0: float
+    duration: float
+    stream: bool = False # issued by the look-ahead stream program
+
+
+## FANUC Emulator Class
+# @param host, port, latency, jitter
+class FANUCEmulator:
+    def __init__(self, host: str='127.0.0.1', port: int=0, latency: float=0.0, jitter: float=0.0,
+                 default_speed: float=100.0, joint_speed: float=60.0, settle: float=0.0, seed: int=None):
+        """! Creates an emulator, call start() or use it as a context manager.
+        @param host             interface to listen on
+        @param port             TCP port, 0 picks a free port (see address)
+        @param latency          seconds added before every reply
+        @param jitter           extra uniformly distributed delay in [0, jitter] seconds
+        @param default_speed    mm/s used when R[speed_register] is 0
+        @param joint_speed      deg/s for joint moves
+        @param settle           seconds the robot stays "moving" after reaching the target
+        @param seed             random seed for reproducible jitter
+        """
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.default_speed = default_speed
+        self.joint_speed = joint_speed
+        self.settle = settle
+        self._random = random.Random(seed)
+
+        # TP program register map, same defaults as robot_controller.robot
+        self.start_register = 1
+        self.speed_register = 5
+        self.uframe_register = 7
+        self.utool_register = 8
+        self.in_position_do = None    # DO[] held on while no move is executing, None to disable
+
+        self._lock = threading.RLock()
+        self.registers = {}                                   # R[n] -> int
+        self.cartesian_prs = {}                               # PR[n] -> 44 byte payload
+        self.joint_prs = {}                                   # PR[n] -> 40 byte payload
+        self.cartesian = (0.0, 0.0, 0.0, 0.0, 90.0, 0.0)      # X Y Z W P R
+        self.joints = (0.0,) * 6
+        self.digital_inputs = bytearray(16)
+        self.digital_outputs = bytearray(16)
+        self.alarms = {code: [] for code in ALARM_CLASSES}    # class -> [EmulatedAlarm], newest first
+        self._last_pr = ('cartesian', 1)
+        self._move = None
+
+        # statistics
+        self.requests = 0
+        self.sessions = 0
+        self.moves = 0
+
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._ready = threading.Event()
+        self._error = None      # exception that stopped the server from starting
+
+    # Lifecycle
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    @property
+    def address(self) -> str:
+        """! "host:port" string accepted by the driver functions and robot()."""
+        return f"{self.host}:{self.port}"
+
+    def start(self):
+        """! Starts serving on a background thread with its own event loop.
+        Raises the error of the server if it could not start, e.g. OSError when the port is in use.
+        """
+        self._ready.clear()
+        self._error = None
+        self._thread = threading.Thread(target=self._serve, name='FANUCEmulator', daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        if self._error is not None:
+            self._thread.join()
+            self._thread = None
+            raise self._error
+
+    def stop(self):
+        """! Stops the server and its thread.
+        """
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+        if self._thread is not None:
+            self._thread.join()
+        self._thread = None
+
+    def _serve(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._server = self._loop.run_until_complete(
+                asyncio.start_server(self._handle_client, self.host, self.port))
+        except Exception as e:
+            self._error = e
+            self._loop.close()
+            self._loop = None
+            self._ready.set()
+            return
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._ready.set()
+        try:
+            self._loop.run_forever()
+        finally:
+            self._server.close()
+            # drop clients that are still connected (e.g. pooled driver sessions)
+            clients = asyncio.all_tasks(self._loop)
+            for task in clients:
+                task.cancel()
+            self._loop.run_until_complete(asyncio.gather(*clients, return_exceptions=True))
+            self._loop.run_until_complete(self._server.wait_closed())
+            self._loop.close()
+            self._loop = None
+
+    # Controller state helpers
+
+    def set_cartesian(self, pose):
+        """! Teleports CURPOS to pose [X, Y, Z, W, P, R]."""
+        with self._lock:
+            self._move = None
+            self.cartesian = tuple(float(v) for v in pose)
+
+    def set_joints(self, joints):
+        """! Teleports CURJPOS to joints [J1 .. J6]."""
+        with self._lock:
+            self._move = None
+            self.joints = tuple(float(v) for v in joints)
+
+    def raise_alarm(self, message: str, alarm_class: int=0xA0, alarm_id: int=11, alarm_number: int=1,
+                    severity: int=2, cause: str='', severity_str: str='WARN'):
+        """! Adds an alarm as instance 1 (most recent) of alarm_class and of the alarm history."""
+        alarm = EmulatedAlarm(alarm_id, alarm_number, severity, message, cause, severity_str,
+                              time.strftime('%d-%b-%y %H:%M'))
+        with self._lock:
+            self.alarms[alarm_class].insert(0, alarm)
+            if alarm_class != 0xA1:
+                self.alarms[0xA1].insert(0, alarm)
+
+    def clear_alarms(self):
+        """! Clears active alarms, the history is kept."""
+        with self._lock:
+            self.alarms[0xA0].clear()
+
+    def is_moving(self) -> bool:
+        with self._lock:
+            self._advance(time.monotonic())
+            return self._move is not None
+
+    def _advance(self, now: float):
+        # brings the lazily evaluated motion up to time now (called with the lock held)
+        while True:
+            move = self._move
+            if move is None:
+                # an idle stream program picks up queued poses immediately
+                if not self._stream_step(now):
+                    return
+                continue
+            elapsed = now - move.t0
+            if move.duration <= 0:
+                fraction = 1.0
+            else:
+                fraction = min(1.0, elapsed / move.duration)
+            pose = tuple(a + (b - a) * fraction for a, b in zip(move.start, move.target))
+            if move.kind == 'cartesian':
+                self.cartesian = pose
+            else:
+                self.joints = pose
+            if move.stream:
+                # streamed segments blend: the next one starts where this one ends, without settling
+                if elapsed < move.duration:
+                    return
+                self._move = None
+                if not self._stream_step(move.t0 + move.duration):
+                    return
+                continue
+            if elapsed < move.duration + self.settle:
+                return
+            self._move = None
+            self.registers[self.start_register] = 0
+            return
+
+    def _stream_step(self, t: float) -> bool:
+        # one pass of the ros2_eip_stream_pt TP loop at time t, True if a move was issued
+        state = self.registers.get(STREAM_STATE_REGISTER, STREAM_IDLE)
+        if state == STREAM_IDLE:
+            return False
+        issued = self.registers.get(STREAM_READ_REGISTER, 0)
+        if self.registers.get(STREAM_WRITE_REGISTER, 0) > issued:
+            pr_number = STREAM_FIRST_PR + issued % STREAM_SLOTS
+            self.registers[STREAM_READ_REGISTER] = issued + 1
+            return self._start_move(t, 'cartesian', pr_number, stream=True)
+        if state == STREAM_FINISH:
+            self.registers[STREAM_STATE_REGISTER] = STREAM_IDLE
+        return False
+
+    def _start_move(self, now: float, kind: str, number: int, stream: bool=False) -> bool:
+        if kind == 'cartesian':
+            payload = self.cartesian_prs.get(number)
+            if payload is None:
+                return False
+            target = CARTESIAN_LAYOUT.unpack(payload)[2:8]
+            distance = math.dist(self.cartesian[:3], target[:3])
+            speed = self.registers.get(self.speed_register) or self.default_speed
+            duration = distance / speed
+            start = self.cartesian
+        else:
+            payload = self.joint_prs.get(number)
+            if payload is None:
+                return False
+            target = JOINT_LAYOUT.unpack(payload)[2:8]
+            duration = max(abs(a - b) for a, b in zip(self.joints, target)) / self.joint_speed
+            start = self.joints
+        self._move = _Move(kind, start, tuple(target), now, duration, stream)
+        self.moves += 1
+        return True
+
+    # EtherNet/IP encapsulation
+
+    async def _reply(self, writer, packet, delay):
+        await asyncio.sleep(delay)
+        if not writer.is_closing():
+            writer.write(packet)
+
+    async def _handle_client(self, reader, writer):
+        session = 0
+        replies = set()     # delayed replies still to be sent
+        try:
+            while True:
+                header = await reader.readexactly(ENCAP_HEADER.size)
+                command, length, _, _, context, options = ENCAP_HEADER.unpack(header)
+                data = await reader.readexactly(length) if length else b''
+
+                if command == NOP:
+                    continue
+                if command == REGISTER_SESSION:
+                    self.sessions += 1
+                    session = random.getrandbits(31) | 1
+                    reply = data[:4]
+                elif command == UNREGISTER_SESSION:
+                    break
+                elif command == LIST_IDENTITY:
+                    reply = struct.pack('<H', 0)
+                elif command == SEND_RR_DATA:
+                    reply = self._send_rr_data(data)
+                else:
+                    writer.write(ENCAP_HEADER.pack(command, 0, session, 0x01, context, options))
+                    continue
+
+                packet = ENCAP_HEADER.pack(command, len(reply), session, 0, context, options) + reply
+                delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0.0)
+                if delay > 0 and command == SEND_RR_DATA:
+                    # the next request is read while this reply is still on its way
+                    task = asyncio.ensure_future(self._reply(writer, packet, delay))
+                    replies.add(task)
+                    task.add_done_callback(replies.discard)
+                    continue
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                writer.write(packet)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            for task in replies:
+                task.cancel()
+            writer.close()
+
+    def _send_rr_data(self, data: bytes) -> bytes:
+        # parse the common packet format and answer the unconnected data item
+        item_count = struct.unpack_from('<H', data, 6)[0]
+        offset = 8
+        message = b''
+        for _ in range(item_count):
+            item_type, item_len = struct.unpack_from('<HH', data, offset)
+            if item_type == 0x00B2:
+                message = data[offset + 4:offset + 4 + item_len]
+            offset += 4 + item_len
+        response = self._handle_message(message)
+        return struct.pack('<IHHHHHH', 0, 0, 2, 0x0000, 0, 0x00B2, len(response)) + response
+
+    # CIP
+
+    @staticmethod
+    def _parse_path(message: bytes):
+        # returns (service, class, instance, attribute, request data)
+        service = message[0]
+        size = message[1] * 2
+        path = message[2:2 + size]
+        ids = {}
+        i = 0
+        while i < len(path):
+            segment = path[i]
+            kind = {0x20: 'class', 0x24: 'instance', 0x30: 'attribute'}.get(segment & 0xFC)
+            if segment & 0x03 == 0:
+                value = path[i + 1]
+                i += 2
+            elif segment & 0x03 == 1:
+                value = struct.unpack_from('<H', path, i + 2)[0]
+                i += 4
+            else:
+                value = struct.unpack_from('<I', path, i + 2)[0]
+                i += 6
+            if kind:
+                ids[kind] = value
+        return service, ids.get('class'), ids.get('instance'), ids.get('attribute'), message[2 + size:]
+
+    def _handle_message(self, message: bytes) -> bytes:
+        self.requests += 1
+        service, class_code, instance, attribute, data = self._parse_path(message)
+        if service == MULTIPLE_SERVICE and class_code == 0x02:
+            status, value = self._multiple_service(data)
+        else:
+            with self._lock:
+                self._advance(time.monotonic())
+                status, value = self._service(service, class_code, instance, attribute, data)
+        return bytes([service | 0x80, 0, status, 0]) + value
+
+    def _multiple_service(self, data: bytes):
+        count = struct.unpack_from('<H', data, 0)[0]
+        offsets = struct.unpack_from('<%dH' % count, data, 2)
+        replies = []
+        failed = False
+        with self._lock:
+            self._advance(time.monotonic())
+            for i, start in enumerate(offsets):
+                end = offsets[i + 1] if i + 1 < count else len(data)
+                service, class_code, instance, attribute, request = self._parse_path(data[start:end])
+                status, value = self._service(service, class_code, instance, attribute, request)
+                failed |= status != SUCCESS
+                replies.append(bytes([service | 0x80, 0, status, 0]) + value)
+        offset = 2 + 2 * count
+        table = []
+        for reply in replies:
+            table.append(offset)
+            offset += len(reply)
+        body = struct.pack('<%dH' % (count + 1), count, *table) + b''.join(replies)
+        return (EMBEDDED_SERVICE_ERROR if failed else SUCCESS), body
+
+    def _service(self, service, class_code, instance, attribute, data):
+        # called with the lock held, returns (general status, reply data)
+        if class_code == 0x6B:
+            if service == GET_ATTRIBUTE_SINGLE:
+                return SUCCESS, struct.pack('<i', self.registers.get(attribute, 0))
+            if service == SET_ATTRIBUTE_SINGLE:
+                if len(data) < 4:
+                    return NOT_ENOUGH_DATA, b''
+                value = struct.unpack_from('<i', data)[0]
+                self.registers[attribute] = value
+                if attribute == self.start_register and value == 1 and self._move is None:
+                    if not self._start_move(time.monotonic(), *self._last_pr):
+                        self.registers[self.start_register] = 0
+                return SUCCESS, b''
+            return SERVICE_NOT_SUPPORTED, b''
+
+        if class_code in (0x7B, 0x7C):
+            prs, layout = (self.cartesian_prs, CARTESIAN_LAYOUT) if class_code == 0x7B else (self.joint_prs, JOINT_LAYOUT)
+            if service == GET_ATTRIBUTE_SINGLE:
+                return SUCCESS, prs.get(attribute, bytes(layout.size))
+            if service == SET_ATTRIBUTE_SINGLE:
+                if len(data) < layout.size:
+                    return NOT_ENOUGH_DATA, b''
+                prs[attribute] = bytes(data[:layout.size])
+                self._last_pr = ('cartesian' if class_code == 0x7B else 'joint', attribute)
+                return SUCCESS, b''
+            return SERVICE_NOT_SUPPORTED, b''
+
+        if class_code == 0x7D and service == GET_ATTRIBUTE_SINGLE:
+            return SUCCESS, CARTESIAN_LAYOUT.pack(self.registers.get(self.utool_register, 0),
+                                                  self.registers.get(self.uframe_register, 0),
+                                                  *self.cartesian, 0, 0, 0, 0, 0.0, 0.0, 0.0)
+        if class_code == 0x7E and service == GET_ATTRIBUTE_SINGLE:
+            return SUCCESS, JOINT_LAYOUT.pack(0, 0, *self.joints, math.nan, math.nan, math.nan)
+
+        if class_code == 0x04 and attribute == 0x03:
+            io = {0x320: self.digital_inputs, 0x321: self.digital_outputs}.get(instance)
+            if io is None:
+                return PATH_DESTINATION_UNKNOWN, b''
+            if service == GET_ATTRIBUTE_SINGLE:
+                if io is self.digital_outputs and self.in_position_do:
+                    byte, bit = (self.in_position_do - 1) // 8, (self.in_position_do - 1) % 8
+                    io[byte] = (io[byte] & ~(1 << bit)) | ((self._move is None) << bit)
+                return SUCCESS, bytes(io)
+            return SERVICE_NOT_SUPPORTED, b''
+
+        if class_code in self.alarms:
+            alarms = self.alarms[class_code]
+            alarm = alarms[instance - 1] if instance and instance <= len(alarms) else EmulatedAlarm()
+            buff = alarm.encode()
+            if service == GET_ATTRIBUTES_ALL:
+                return SUCCESS, buff
+            if service == GET_ATTRIBUTE_SINGLE:
+                if attribute not in ALARM_FIELDS:
+                    return ATTRIBUTE_NOT_SUPPORTED, b''
+                offset, length = ALARM_FIELDS[attribute]
+                return SUCCESS, buff[offset:offset + length]
+            return SERVICE_NOT_SUPPORTED, b''
+
+        if class_code == 0x01 and service == GET_ATTRIBUTE_SINGLE:
+            # identity: vendor id, device type, product code
+            return SUCCESS, struct.pack('<H', {1: 356, 2: 12, 3: 1}.get(attribute, 0))
+
+        return PATH_DESTINATION_UNKNOWN, b''
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Loopback FANUC EtherNet/IP emulator")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=44818)
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--jitter-ms', type=float, default=0.0)
+    parser.add_argument('--speed', type=float, default=100.0, help="mm/s when R[5] is 0")
+    args = parser.parse_args()
+
+    emulator = FANUCEmulator(args.host, args.port, args.latency_ms / 1000, args.jitter_ms / 1000,
+                             default_speed=args.speed)
+    emulator.start()
+    print(f"FANUC emulator listening on {emulator.address}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        emulator.stop()
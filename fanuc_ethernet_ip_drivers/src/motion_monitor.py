@@ -0,0 +1,143 @@
+"""! @brief Motion completion detection for the FANUC TP program handshake."""
+
+##
+# @file motion_monitor.py
+#
+# @brief Waits for moves to finish using the start register / in-position DO handshake.
+#
+# @section description_motion_monitor Description
+# The TP program clears R[start_register] once it has executed the move requested by the
+# PC, and can optionally hold a DO "in position" bit while the robot is at rest. Instead of
+# comparing consecutive CURPOS reads, MotionMonitor polls that handshake (one Multiple
+# Service Packet per poll) with an adaptive backoff: it polls fast right after the start,
+# slows down geometrically during long moves, and gives up at a deadline.
+# Every completed move is recorded in MotionStats.
+#
+
+# Imports
+import collections
+import statistics
+import time
+import typing
+import FANUCethernetipDriver
+
+POLL_INITIAL = 0.004    # seconds between the first polls
+POLL_MAX = 0.05         # longest interval between polls
+POLL_BACKOFF = 1.5      # interval growth factor per poll
+
+
+def backoff_intervals(initial: float=POLL_INITIAL, maximum: float=POLL_MAX, factor: float=POLL_BACKOFF):
+    """! Yields poll intervals growing geometrically from initial up to maximum.
+    """
+    interval = initial
+    while True:
+        yield interval
+        interval = min(maximum, interval * factor)
+
+
+## Per-move latency record
+class MoveRecord(typing.NamedTuple):
+    ## seconds from the start request until completion was seen
+    latency: float
+    ## handshake polls needed
+    polls: int
+    ## time.time() when the move completed
+    finished: float
+
+
+## Move latency statistics
+class MotionStats:
+    def __init__(self, history: int=1000):
+        """! Keeps the last history move records.
+        """
+        self.moves = collections.deque(maxlen=history)
+        self.timeouts = 0
+
+    def record(self, latency: float, polls: int):
+        self.moves.append(MoveRecord(latency, polls, time.time()))
+
+    @property
+    def count(self) -> int:
+        return len(self.moves)
+
+    @property
+    def last(self) -> typing.Optional[MoveRecord]:
+        return self.moves[-1] if self.moves else None
+
+    def summary(self) -> dict:
+        """! Returns count, mean, max and p95 move latency in seconds, and mean polls per move.
+        """
+        if not self.moves:
+            return {'count': 0, 'timeouts': self.timeouts}
+        latencies = sorted(m.latency for m in self.moves)
+        return {'count': len(latencies),
+                'timeouts': self.timeouts,
+                'mean': statistics.mean(latencies),
+                'max': latencies[-1],
+                'p95': latencies[max(0, int(len(latencies) * 0.95) - 1)],
+                'polls': statistics.mean(m.polls for m in self.moves)}
+
+
+## Motion Monitor Class
+# @param robot_IP, start_register, in_position_do
+class MotionMonitor:
+    def __init__(self, robot_IP: str, start_register: int=1, in_position_do: int=None,
+                 poll_initial: float=POLL_INITIAL, poll_max: float=POLL_MAX, poll_backoff: float=POLL_BACKOFF):
+        """! Creates a monitor for the TP program handshake.
+        @param robot_IP         IP address of robot
+        @param start_register   R[] the TP program clears when the move is finished
+        @param in_position_do   optional DO[] the TP program sets while the robot is in position
+        @param poll_initial     first poll interval in seconds
+        @param poll_max         longest poll interval in seconds
+        @param poll_backoff     poll interval growth factor
+        """
+        self.robot_IP = robot_IP
+        self.start_register = start_register
+        self.in_position_do = in_position_do
+        self.poll_initial = poll_initial
+        self.poll_max = poll_max
+        self.poll_backoff = poll_backoff
+        self.stats = MotionStats()
+        self._started = None
+
+    def mark_start(self):
+        """! Records the time the start register was written, latency is measured from here.
+        """
+        self._started = time.monotonic()
+
+    def is_complete(self) -> bool:
+        """! True when the TP program has cleared the start register (and set the in-position DO).
+        """
+        start, in_position = FANUCethernetipDriver.read_motion_status(
+            self.robot_IP, self.start_register, self.in_position_do)
+        if start is None:
+            raise IOError(f"Could not read R[{self.start_register}] on {self.robot_IP}")
+        return start == 0 and (self.in_position_do is None or in_position == 1)
+
+    def wait_for_completion(self, timeout: float=None, deadline: float=None) -> float:
+        """! Blocks until the current move is finished.
+        @param timeout      seconds to wait from now
+        @param deadline     absolute time.monotonic() deadline, overrides timeout
+        @return             move latency in seconds, measured from mark_start()
+        @raise TimeoutError if the move did not finish in time
+        """
+        if deadline is None and timeout is not None:
+            deadline = time.monotonic() + timeout
+        started = self._started if self._started is not None else time.monotonic()
+        polls = 0
+        for interval in backoff_intervals(self.poll_initial, self.poll_max, self.poll_backoff):
+            polls += 1
+            if self.is_complete():
+                latency = time.monotonic() - started
+                self.stats.record(latency, polls)
+                self._started = None
+                return latency
+            now = time.monotonic()
+            if deadline is not None and now >= deadline:
+                self.stats.timeouts += 1
+                self._started = None
+                raise TimeoutError(f"Move did not complete within {now - started:.2f} s, "
+                                   f"R[{self.start_register}] is still set, check TP for further diagnosis")
+            if deadline is not None:
+                interval = min(interval, deadline - now)
+            time.sleep(interval)
@@ -0,0 +1,126 @@
+"""! @brief Cyclic background streaming of the robot's current position."""
+
+##
+# @file pose_stream.py
+#
+# @brief Keeps a timestamped snapshot of CURPOS/CURJPOS updated at a fixed RPI.
+#
+# @section description_pose_stream Description
+# The FANUC EtherNet/IP adapter does not map CURPOS into its implicit (Class 1) I/O
+# assembly, so true producer/consumer I/O is not available for positions. This module
+# gives the same consumer side behaviour: one producer thread reads class 0x7D (and
+# optionally 0x7E) on its own pooled session at a fixed requested packet interval (RPI)
+# and publishes an immutable snapshot. Any number of readers get the latest pose from
+# memory without network I/O.
+#
+
+# Imports
+import threading
+import time
+import typing
+import FANUCethernetipDriver
+
+
+## Immutable pose sample published by PoseStream
+class PoseSnapshot(typing.NamedTuple):
+    ## time.monotonic() when the reply arrived
+    timestamp: float
+    ## time.time() when the reply arrived, for logging
+    wall_time: float
+    ## [X, Y, Z, W, P, R]
+    cartesian: tuple
+    ## [J1 .. J6] or None when joints are not streamed
+    joints: typing.Optional[tuple]
+    ## increments with every published snapshot
+    sequence: int
+    ## request/response round trip of this sample in seconds
+    latency: float
+
+    def age(self) -> float:
+        """! Seconds since this snapshot was taken."""
+        return time.monotonic() - self.timestamp
+
+
+## Pose Stream Class
+# @param robot_IP, rpi_ms, joints
+class PoseStream(threading.Thread):
+    def __init__(self, robot_IP: str, rpi_ms: float=16, joints: bool=False):
+        """! Creates a pose stream, call start() to begin producing snapshots.
+        @param robot_IP     IP address of robot
+        @param rpi_ms       requested packet interval in milliseconds (8-32 ms is typical)
+        @param joints       also stream CURJPOS (one extra request per cycle)
+        """
+        super().__init__(name=f"PoseStream-{robot_IP}", daemon=True)
+        if rpi_ms <= 0:
+            raise ValueError(f"RPI must be positive, got {rpi_ms}")
+        self.robot_IP = robot_IP
+        self.rpi = rpi_ms / 1000.0
+        self.joints = joints
+
+        self._snapshot = None
+        self._updated = threading.Condition()
+        self._running = threading.Event()
+        self._running.set()
+
+        # counters
+        self.cycles = 0
+        self.overruns = 0   # cycles whose request took longer than the RPI
+        self.errors = 0
+        self.last_error = None
+
+    def run(self):
+        sequence = 0
+        next_deadline = time.monotonic()
+        while self._running.is_set():
+            start = time.monotonic()
+            try:
+                cart = FANUCethernetipDriver.returnCartesianCurrentPose(self.robot_IP)
+                joints = None
+                if self.joints:
+                    joints = tuple(FANUCethernetipDriver.returnJointCurrentPose(self.robot_IP)[2:8])
+                now = time.monotonic()
+                sequence += 1
+                snapshot = PoseSnapshot(now, time.time(), tuple(cart[2:8]), joints, sequence, now - start)
+                with self._updated:
+                    self._snapshot = snapshot
+                    self._updated.notify_all()
+            except Exception as e:
+                self.errors += 1
+                self.last_error = e
+                if FANUCethernetipDriver.DEBUG:
+                    print(f"[PoseStream] Error: {e}")
+            self.cycles += 1
+
+            # schedule on absolute deadlines so request time does not stretch the period
+            next_deadline += self.rpi
+            delay = next_deadline - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                self.overruns += 1
+                next_deadline = time.monotonic()
+
+    def latest(self) -> typing.Optional[PoseSnapshot]:
+        """! Returns the most recent snapshot, or None if nothing has been received yet.
+        """
+        return self._snapshot
+
+    def wait_for_update(self, after_sequence: int=0, timeout: float=1.0) -> typing.Optional[PoseSnapshot]:
+        """! Blocks until a snapshot newer than after_sequence is published.
+        @param after_sequence   sequence number the caller already has
+        @param timeout          seconds to wait
+        @return                 the new snapshot, or None on timeout
+        """
+        with self._updated:
+            if not self._updated.wait_for(
+                    lambda: self._snapshot is not None and self._snapshot.sequence > after_sequence,
+                    timeout):
+                return None
+            return self._snapshot
+
+    def stop(self):
+        """! Stops the producer thread and waits for it to exit.
+        """
+        self._running.clear()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join()
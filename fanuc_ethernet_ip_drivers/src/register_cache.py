@@ -0,0 +1,101 @@
+"""! @brief Write-through cache of R[] registers owned by the PC."""
+
+##
+# @file register_cache.py
+#
+# @brief Suppresses redundant R[] writes such as repeated set_speed() calls.
+#
+# @section description_register_cache Description
+# The speed, speed percent, user frame and user tool registers are only written by the PC,
+# so the last value written is also the value on the controller. RegisterCache keeps those
+# values, skips writes that would not change the register and answers reads from memory.
+# The cache is dropped when the driver's session pool reconnects to the robot (a new
+# session generation) and when invalidate() is called, e.g. after an alarm.
+# Registers the TP program writes (start, sync, gripper status, ...) must not be cached.
+#
+
+# Imports
+import threading
+import FANUCethernetipDriver
+
+
+## Register Cache Class
+# @param robot_IP, registers
+class RegisterCache:
+    def __init__(self, robot_IP: str, registers):
+        """! Creates an empty cache.
+        @param robot_IP     IP address of robot
+        @param registers    R[] numbers that may be cached
+        """
+        self.robot_IP = robot_IP
+        self.registers = frozenset(registers)
+        self._values = {}
+        self._lock = threading.Lock()
+        self._generation = FANUCethernetipDriver.session_pool.generation(robot_IP)
+
+        # counters
+        self.hits = 0       # reads answered and writes skipped from the cache
+        self.misses = 0     # reads and writes that went to the controller
+        self.invalidations = 0
+
+    def _check_generation(self):
+        # a reconnect means the controller may have been restarted, forget everything
+        generation = FANUCethernetipDriver.session_pool.generation(self.robot_IP)
+        if generation != self._generation:
+            self._generation = generation
+            self._values.clear()
+            self.invalidations += 1
+
+    def write(self, reg_num: int, value: int):
+        """! Writes R[reg_num] unless the cache already holds value.
+        @return             error string of the write, None on success or when skipped
+        """
+        with self._lock:
+            if reg_num in self.registers:
+                self._check_generation()
+                if self._values.get(reg_num) == value:
+                    self.hits += 1
+                    return None
+            self.misses += 1
+            # drop the entry first so a failed write never leaves a stale value behind
+            self._values.pop(reg_num, None)
+            error = FANUCethernetipDriver.writeR_Register(self.robot_IP, reg_num, value)
+            if error is None and reg_num in self.registers:
+                self._values[reg_num] = value
+            return error
+
+    def read(self, reg_num: int) -> int:
+        """! Returns R[reg_num], from memory when it is cached.
+        """
+        with self._lock:
+            if reg_num in self.registers:
+                self._check_generation()
+                if reg_num in self._values:
+                    self.hits += 1
+                    return self._values[reg_num]
+            self.misses += 1
+            value = FANUCethernetipDriver.readR_Register(self.robot_IP, reg_num)
+            if reg_num in self.registers and value is not None:
+                self._values[reg_num] = value
+            return value
+
+    def invalidate(self, reg_num: int=None):
+        """! Forgets one register, or every register when reg_num is None.
+        """
+        with self._lock:
+            if reg_num is None:
+                self._values.clear()
+            else:
+                self._values.pop(reg_num, None)
+            self.invalidations += 1
+
+    def stats(self) -> dict:
+        """! Returns the hit/miss counters and the cached values.
+        """
+        with self._lock:
+            total = self.hits + self.misses
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'hit_rate': self.hits / total if total else 0.0,
+                    'invalidations': self.invalidations,
+                    'values': dict(self._values)}
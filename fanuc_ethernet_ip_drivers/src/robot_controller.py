@@ -23,6 +23,10 @@ import math
 import time
 import typing
 import FANUCethernetipDriver
+from pose_stream import PoseStream
+from motion_monitor import MotionMonitor
+from trajectory_streamer import TrajectoryStreamer
+from register_cache import RegisterCache
 
 ## The mode of operation; 
 
@@ -34,8 +38,9 @@ class robot:
         @param robotIP      IP address of robot
         """
         self.robot_IP = robotIP
-        self.CurJointPosList = FANUCethernetipDriver.returnJointCurrentPosition(self.robot_IP)
-        self.CurCartesianPosList = FANUCethernetipDriver.returnCartesianCurrentPostion(self.robot_IP)
+        # current positions are fetched on first use, see connect()
+        self._CurJointPosList = None
+        self._CurCartesianPosList = None
         self.PRNumber = 1 # This is the position register for holding coordinates
         self.PRNumber2 = 2
         self.PRNumber3 = 3
@@ -48,20 +53,110 @@ class robot:
         self.uframe = 7
         self.utool = 8
 
+        self.pose_stream = None # optional background CURPOS stream, see start_pose_stream()
+
+        # move completion handshake, see wait_for_motion()
+        self.motion_timeout = 60.0 # seconds a blocking move may take
+        self.motion = MotionMonitor(self.robot_IP, self.start_register, in_position_do=None)
+
+        # PC owned registers, repeated writes of the same value are skipped
+        self.register_cache = RegisterCache(self.robot_IP, (self.speed_register, self.speed_percent, self.uframe, self.utool))
+
         self.DEBUG = DEBUG
         FANUCethernetipDriver.DEBUG = DEBUG
+
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    # Open the connection and read the current position
+    def connect(self):
+        """! Opens the CIP session and reads the current joint and cartesian position.
+        Calling this is optional, every function connects on first use.
+        """
+        self._CurJointPosList = FANUCethernetipDriver.returnJointCurrentPosition(self.robot_IP)
+        self._CurCartesianPosList = FANUCethernetipDriver.returnCartesianCurrentPostion(self.robot_IP)
         print("Connection made with robot at ", self.robot_IP)
+        return self
+
+    # Position lists used as templates for PR[] writes, fetched on first access
+    @property
+    def CurJointPosList(self) -> list:
+        if self._CurJointPosList is None:
+            self._CurJointPosList = FANUCethernetipDriver.returnJointCurrentPosition(self.robot_IP)
+        return self._CurJointPosList
+
+    @CurJointPosList.setter
+    def CurJointPosList(self, value: list):
+        self._CurJointPosList = value
+
+    @property
+    def CurCartesianPosList(self) -> list:
+        if self._CurCartesianPosList is None:
+            self._CurCartesianPosList = FANUCethernetipDriver.returnCartesianCurrentPostion(self.robot_IP)
+        return self._CurCartesianPosList
+
+    @CurCartesianPosList.setter
+    def CurCartesianPosList(self, value: list):
+        self._CurCartesianPosList = value
 
 
     # set debug on or off
     def set_debug(state:bool):
         FANUCethernetipDriver.DEBUG = state
 
+    # Release the pooled EtherNet/IP sessions to this robot
+    def close(self):
+        """! Closes the CIP sessions held open to this robot by the driver's session pool.
+        Sessions are reopened automatically on the next register access.
+        """
+        FANUCethernetipDriver.close_sessions(self.robot_IP)
+        self.register_cache.invalidate()
+
+    # Start streaming current position in the background
+    def start_pose_stream(self, rpi_ms: float=16, joints: bool=False):
+        """! Starts a background thread that reads CURPOS every rpi_ms milliseconds.
+        While it runs, read_current_cartesian_pose() (and read_current_joint_position() if
+        joints=True) return the latest snapshot from memory instead of making a request.
+        @param rpi_ms       requested packet interval in milliseconds (8-32 ms is typical)
+        @param joints       also stream joint angles
+        """
+        self.stop_pose_stream()
+        self.pose_stream = PoseStream(self.robot_IP, rpi_ms=rpi_ms, joints=joints)
+        self.pose_stream.start()
+        # wait for the first sample so readers never see an empty stream
+        self.pose_stream.wait_for_update(timeout=max(1.0, 10 * self.pose_stream.rpi))
+        return self.pose_stream
+
+    # Stop streaming current position
+    def stop_pose_stream(self):
+        """! Stops the background position stream, reads go back to the network.
+        """
+        if self.pose_stream is not None:
+            self.pose_stream.stop()
+            self.pose_stream = None
+
+    def _streamed_pose(self):
+        # latest snapshot if the stream is running and fresh, otherwise None
+        stream = self.pose_stream
+        if stream is None:
+            return None
+        snapshot = stream.latest()
+        if snapshot is None or snapshot.age() > 4 * stream.rpi + 0.1:
+            return None
+        return snapshot
+
     # Joint movement functions
 
     def read_current_joint_position(self) -> list:
         """! Returns list of angles at each joint. [0] -> joint 1
         """
+        snapshot = self._streamed_pose()
+        if snapshot is not None and snapshot.joints is not None:
+            return list(snapshot.joints)
         self.CurJointPosList = FANUCethernetipDriver.returnJointCurrentPosition(self.robot_IP)
         return self.CurJointPosList[2:8]
 
@@ -168,6 +263,9 @@ class robot:
         # print("--------------------------")
         # print("| read CURPOS from Robot |")
         # print("--------------------------")
+        snapshot = self._streamed_pose()
+        if snapshot is not None:
+            return list(snapshot.cartesian)
         CurPosList = FANUCethernetipDriver.returnCartesianCurrentPostion(self.robot_IP)
 
         #print("CURPOS=", CurPosList)
@@ -230,6 +328,29 @@ class robot:
             raise Warning("Not enough values passed!")
         
     
+    # Stream a cartesian path through the look-ahead PR ring
+    # Requires the ros2_eip_stream_pt TP program, see trajectory_streamer.py
+    def stream_cartesian_path(self, coords:list[list[float]], cnt:int=100):
+        """! Send a path of cartesian coordinates that the robot blends with CNT termination
+        instead of stopping at every vertex. Blocks until the last pose is reached.
+        @param coords[[X,Y,Z,W,P,R], [X,Y,Z], ...]
+        @param cnt          CNT termination 0-100 used between segments
+        @return             the TrajectoryStreamer used, for its counters
+        """
+        if not all(isinstance(x, list) for x in coords):
+            raise Warning("Path must be a list of lists!")
+
+        streamer = TrajectoryStreamer(self.robot_IP, template=self.CurCartesianPosList, cnt=cnt,
+                                      timeout=self.motion_timeout)
+        with streamer:
+            streamer.extend(coords)
+        self.CurCartesianPosList = streamer.template
+
+        print("********************************************")
+        print("* Streaming Path of %5d Poses: COMPLETE  *" % len(coords))
+        print("********************************************")
+        return streamer
+
         # write PR[1] Cartesian Coordinates
     # Takes x, y, z, w, p, r coords.
     # WPR are the orientation of the end effector, DEFAULT to current orientation
@@ -521,14 +642,14 @@ class robot:
         if value > 300 or value < 0:
             raise Warning(f"Speed should be in the range of [0, 300], got {value}")
         
-        FANUCethernetipDriver.writeR_Register(self.robot_IP, self.speed_register, value)
+        self.register_cache.write(self.speed_register, value)
 
     # get current speed
     def get_speed(self) -> int:
         """! Returns current set speed of robot
         @return             speed in mm/s
         """
-        return FANUCethernetipDriver.readR_Register(self.robot_IP, self.speed_register)
+        return self.register_cache.read(self.speed_register)
 
         # Utility Functions
     # write R[5] to set Speed in mm/sec
@@ -542,7 +663,7 @@ class robot:
         if value > 100 or value < 0:
             raise Warning(f"Speed percent should be in the range of [0, 100], got {value}")
         
-        FANUCethernetipDriver.writeR_Register(self.robot_IP, self.speed_percent, value)
+        self.register_cache.write(self.speed_percent, value)
 
     # Utility Functions
     def set_robot_uframe(self, value: int):
@@ -559,7 +680,7 @@ class robot:
         print(f"| Setting User Frame to: {value} |")
         print("------------------------------")
 
-        FANUCethernetipDriver.writeR_Register(self.robot_IP, self.uframe, value)
+        self.register_cache.write(self.uframe, value)
 
 
     def get_robot_uframe(self) -> int:
@@ -569,7 +690,7 @@ class robot:
         Returns:
             int: Active User Frame index.
         """
-        return FANUCethernetipDriver.readR_Register(self.robot_IP, self.uframe)
+        return self.register_cache.read(self.uframe)
 
     
     # Utility Functions
@@ -587,7 +708,7 @@ class robot:
         print(f"| Setting User Tool to: {value} |")
         print("------------------------------")
 
-        FANUCethernetipDriver.writeR_Register(self.robot_IP, self.utool, value)
+        self.register_cache.write(self.utool, value)
 
 
     def get_robot_utool(self) -> int:
@@ -597,7 +718,7 @@ class robot:
         Returns:
             int: Active user tool index.
         """
-        return FANUCethernetipDriver.readR_Register(self.robot_IP, self.utool)
+        return self.register_cache.read(self.utool)
 
 
     def get_robot_speed_percent(self) -> int:
@@ -607,7 +728,7 @@ class robot:
         Returns:
             int: Speed as a percentage (0–100).
         """
-        return FANUCethernetipDriver.readR_Register(self.robot_IP, self.speed_percent)
+        return self.register_cache.read(self.speed_percent)
     
     def get_actual_robot_speed(self) -> float:
         """
@@ -615,12 +736,36 @@ class robot:
 
         Returns:
             float: Actual speed in mm/sec.
+
+        Raises:
+            ValueError: If either register could not be read.
         """
-        base_speed = self.get_speed()  # Maximum or nominal speed
-        percent = self.get_robot_speed_percent()
+        # Read both registers in one round trip
+        values = FANUCethernetipDriver.read_registers(self.robot_IP, [self.speed_register, self.speed_percent])
+        base_speed = values[self.speed_register]  # Maximum or nominal speed
+        percent = values[self.speed_percent]
+        if base_speed is None or percent is None:
+            raise ValueError(f"Could not read the speed registers R[{self.speed_register}]={base_speed}, "
+                             f"R[{self.speed_percent}]={percent}")
         actual_speed = (percent / 100.0) * base_speed
         return actual_speed
         
+    # Register cache statistics
+    def get_register_cache_stats(self) -> dict:
+        """! Returns hits, misses and invalidations of the register cache, see RegisterCache.stats().
+        """
+        return self.register_cache.stats()
+
+    # Read an alarm object
+    def get_alarm(self, class_code=FANUCethernetipDriver.FANUCAlarm.types.active_alarm, instance: int=1) -> dict:
+        """! Returns all attributes of an alarm object as a dict, see FANUCAlarm.get_attributes_all.
+        An active alarm invalidates the register cache.
+        """
+        alarm = FANUCethernetipDriver.FANUCAlarm.get_attributes_all(self.robot_IP, class_code, instance)
+        if class_code == FANUCethernetipDriver.FANUCAlarm.types.active_alarm and alarm and alarm.get('alarm_id'):
+            self.register_cache.invalidate()
+        return alarm
+
     # Starts robot movement and checks to see when it has completed
     # Default to blocking 
     # Function will block until move action is complete
@@ -630,17 +775,11 @@ class robot:
         """
         # Write to start register to begin movement
         FANUCethernetipDriver.writeR_Register(self.robot_IP, self.start_register, 1)
+        self.motion.mark_start()
 
         # Wait till robot is done moving
         if blocking == True:
-            time.sleep(0.8)
-            moving = self.is_moving()
-            while(moving):
-                #print('in while:', moving)
-                moving = self.is_moving()
-            if self.read_robot_start_register() == 1:
-                    # If the start register is still 1 but the robot is no longer moving, then there is an error
-                    raise TimeoutError("Error has occurred on robot, check TP for further diagnois")
+            self.wait_for_motion()
 
             # Signal end of move action
             print("********************************************")
@@ -649,16 +788,34 @@ class robot:
         elif blocking == False:
             pass # If an error happens here, it 'dies quietly' 
 
+    # Wait for the TP program to finish the current move
+    def wait_for_motion(self, timeout: float=None, deadline: float=None) -> float:
+        """! Blocks until the TP program clears the start register (and sets the in-position DO
+        if self.motion.in_position_do is configured). Polls with adaptive backoff.
+        @param timeout      seconds to wait, defaults to self.motion_timeout
+        @param deadline     absolute time.monotonic() deadline, overrides timeout
+        @return             move latency in seconds since start_robot()
+        """
+        if timeout is None and deadline is None:
+            timeout = self.motion_timeout
+        try:
+            return self.motion.wait_for_completion(timeout=timeout, deadline=deadline)
+        except TimeoutError:
+            # the TP program stopped, most likely on an alarm: cached registers may be stale
+            self.register_cache.invalidate()
+            raise
+
+    # Move latency statistics
+    def get_motion_stats(self) -> dict:
+        """! Returns count, mean, max and p95 latency of completed moves, see MotionStats.summary().
+        """
+        return self.motion.stats.summary()
+
     # Detect if the robot is moving
     def is_moving(self) -> bool:
-        """! checks to see if robot is moving based on the value of the sync register 1=moving 0=not moving
+        """! checks to see if robot is moving based on the value of the start register 1=moving 0=not moving
         """
-        pose1 = self.read_current_cartesian_pose()
-        pose2 = self.read_current_cartesian_pose()
-        diff = list(map(lambda a, b: a - b, pose1, pose2))
-        #print("Difference: ", diff)
-
-        if all([ value == 0.0 for value in diff ]): # If there is no difference
+        if self.motion.is_complete():
             return 0 # Not moving
         else:
             return 1 
@@ -706,15 +863,11 @@ class robot:
         if command == 'open':
             print("Opening Gripper...\n")
             # set bits to toggle 20 off and 23 on
-            FANUCethernetipDriver.writeR_Register(self.robot_IP, 20, 0)
-            FANUCethernetipDriver.writeR_Register(self.robot_IP, 23, 1)
-            FANUCethernetipDriver.writeR_Register(self.robot_IP, self.sync_register, 1)
+            FANUCethernetipDriver.write_registers(self.robot_IP, {20: 0, 23: 1, self.sync_register: 1})
 
         elif command == 'close':
             print("Closing Gripper...\n")
-            FANUCethernetipDriver.writeR_Register(self.robot_IP, 20, 1)
-            FANUCethernetipDriver.writeR_Register(self.robot_IP, 23, 0)
-            FANUCethernetipDriver.writeR_Register(self.robot_IP, self.sync_register, 1)
+            FANUCethernetipDriver.write_registers(self.robot_IP, {20: 1, 23: 0, self.sync_register: 1})
 
         else:
             raise Warning(f"Gripper only supports 'open' or 'closed' strings")
@@ -737,22 +890,16 @@ class robot:
             raise Warning(f"Force should be in the range of [0, 120], got {force_in_newtons}")
 
         # R[35] holds boolean for wait. Set it to false so we can manually check moving status
-        FANUCethernetipDriver.writeR_Register(self.robot_IP, 35, 0)
-
-        # Set open width in mm & open force in newtons
-        FANUCethernetipDriver.writeR_Register(self.robot_IP, 36, width_in_mm)
-        FANUCethernetipDriver.writeR_Register(self.robot_IP, 37, force_in_newtons)
-
-        # Set sync bit to 1 to move onRobot gripper
-        FANUCethernetipDriver.writeR_Register(self.robot_IP, 3, 1)
+        # R[36]/R[37] hold open width in mm & open force in newtons
+        # Sync bit R[3] is written last to move onRobot gripper
+        FANUCethernetipDriver.write_registers(self.robot_IP, {35: 0, 36: width_in_mm, 37: force_in_newtons, 3: 1})
 
         # Implement wait functionality by polling R[50],
         # which stores 1 if busy (moving) & 0 if not busy
         if wait is True:
             # Set R[42] to 4 to check if gripper 'is_busy' (if the gripper is busy, it is moving)
             # Store the result in R[50]
-            FANUCethernetipDriver.writeR_Register(self.robot_IP, 42, 4)
-            FANUCethernetipDriver.writeR_Register(self.robot_IP, 43, 50)
+            FANUCethernetipDriver.write_registers(self.robot_IP, {42: 4, 43: 50})
 
             # Wait for the gripper to start moving
             time.sleep(0.5)
@@ -793,28 +940,21 @@ class robot:
         sync_register = 2
         sync_value = 1
 
+        # Each write_registers call is one round trip, the sync bit is always written last
+        stop_belt = {reverse_register: off, forward_register: off, sync_register: sync_value}
+
         if command == 'forward':
             # Make sure belt is not moving
-            FANUCethernetipDriver.writeR_Register(self.robot_IP, reverse_register, off)
-            FANUCethernetipDriver.writeR_Register(self.robot_IP, forward_register, off)
-            FANUCethernetipDriver.writeR_Register(self.robot_IP, sync_register, sync_value)
-
-            FANUCethernetipDriver.writeR_Register(self.robot_IP, forward_register, on)
+            FANUCethernetipDriver.write_registers(self.robot_IP, stop_belt)
             ## Set sync bit to update
-            FANUCethernetipDriver.writeR_Register(self.robot_IP, sync_register, sync_value)
+            FANUCethernetipDriver.write_registers(self.robot_IP, {forward_register: on, sync_register: sync_value})
         elif command == 'reverse':
-            FANUCethernetipDriver.writeR_Register(self.robot_IP, reverse_register, off)
-            FANUCethernetipDriver.writeR_Register(self.robot_IP, forward_register, off)
-            FANUCethernetipDriver.writeR_Register(self.robot_IP, sync_register, sync_value)
-
-            FANUCethernetipDriver.writeR_Register(self.robot_IP, reverse_register, on)
+            FANUCethernetipDriver.write_registers(self.robot_IP, stop_belt)
             ## Set sync bit to update
-            FANUCethernetipDriver.writeR_Register(self.robot_IP, sync_register, sync_value)
+            FANUCethernetipDriver.write_registers(self.robot_IP, {reverse_register: on, sync_register: sync_value})
         elif command == 'stop':
-            FANUCethernetipDriver.writeR_Register(self.robot_IP, reverse_register, off)
-            FANUCethernetipDriver.writeR_Register(self.robot_IP, forward_register, off)
             ## Set sync bit to update
-            FANUCethernetipDriver.writeR_Register(self.robot_IP, sync_register, sync_value)
+            FANUCethernetipDriver.write_registers(self.robot_IP, stop_belt)
         else:
             raise Warning(f"Conveyor only supports 'forward', 'reverse' or 'stop' strings")
 
@@ -836,6 +976,5 @@ class robot:
         DigitalOut = 1
         sync_register = 2
         sync_value = 1
-        FANUCethernetipDriver.writeR_Register(self.robot_IP, DigitalOut, status)
-        ## Set sync bit to update
-        FANUCethernetipDriver.writeR_Register(self.robot_IP, sync_register, sync_value)
+        ## Set sync bit to update, both registers go out in one round trip
+        FANUCethernetipDriver.write_registers(self.robot_IP, {DigitalOut: status, sync_register: sync_value})
@@ -0,0 +1,168 @@
+"""! @brief Look-ahead streaming of cartesian poses through a ring of position registers."""
+
+##
+# @file trajectory_streamer.py
+#
+# @brief Keeps N position registers filled ahead of the executing TP program.
+#
+# @section description_trajectory_streamer Description
+# write_cartesian_position() runs one PR[] move at a time and waits for the robot to stop
+# before the next pose is written, so the robot decelerates to zero at every vertex of a
+# path. TrajectoryStreamer instead writes poses into a ring of PR[] slots ahead of the
+# TP program FANUC_TP_Program/ros2_eip_stream_pt.ls. That program issues the moves with
+# CNT termination, so consecutive segments blend. The handshake uses R[] registers:
+#   - R[STREAM_WRITE_REGISTER]  poses written by the PC (count, written after the PR)
+#   - R[STREAM_READ_REGISTER]   poses issued by the TP program (count)
+#   - R[STREAM_STATE_REGISTER]  PC writes 1 to run and 2 to finish, TP writes 0 when done
+#   - R[STREAM_CNT_REGISTER]    CNT value used for every streamed segment
+# Each pose costs one Multiple Service Packet (PR[] slot + write count), and the PC only
+# waits when all slots are full.
+#
+# @section example_trajectory_streamer Example
+#   with TrajectoryStreamer(ROBOT_IP, template=woody.CurCartesianPosList) as stream:
+#       stream.extend(wall_path)
+#
+
+# Imports
+import struct
+import time
+from pycomm3.packets.util import request_path
+
+import FANUCethernetipDriver
+from FANUCethernetipDriver import CARTESIAN_LAYOUT
+from motion_monitor import backoff_intervals
+
+STREAM_WRITE_REGISTER = 11
+STREAM_READ_REGISTER = 12
+STREAM_STATE_REGISTER = 13
+STREAM_CNT_REGISTER = 14
+STREAM_FIRST_PR = 11    # PR[11] .. PR[11 + STREAM_SLOTS - 1] hold the ring
+STREAM_SLOTS = 8
+
+STREAM_IDLE = 0
+STREAM_RUN = 1
+STREAM_FINISH = 2
+
+
+## Trajectory Streamer Class
+# @param robot_IP, template, cnt
+class TrajectoryStreamer:
+    def __init__(self, robot_IP: str, template: list=None, cnt: int=100, slots: int=STREAM_SLOTS,
+                 first_pr: int=STREAM_FIRST_PR, timeout: float=60.0):
+        """! Creates a streamer, call begin() or use it as a context manager.
+        @param robot_IP     IP address of robot
+        @param template     position list [UTOOL, UFRAME, X, Y, Z, W, P, R, ...] supplying W, P, R,
+                            configuration and extended axes for poses given as [X, Y, Z]
+        @param cnt          CNT termination 0-100 for every streamed segment
+        @param slots        number of PR[] in the ring, must match the TP program
+        @param first_pr     first PR[] of the ring, must match the TP program
+        @param timeout      seconds to wait for a free slot or for the stream to finish
+        """
+        if not (0 <= cnt <= 100):
+            raise ValueError(f"CNT must be within the range [0, 100], received: {cnt}")
+        if slots < 2:
+            raise ValueError(f"At least 2 slots are needed to stream, received: {slots}")
+        self.robot_IP = robot_IP
+        self.template = list(template) if template is not None else \
+            FANUCethernetipDriver.returnCartesianCurrentPostion(robot_IP)
+        self.cnt = cnt
+        self.slots = slots
+        self.first_pr = first_pr
+        self.timeout = timeout
+
+        self.written = 0
+        self.consumed = 0
+        self.waits = 0      # times push() had to wait for a free slot
+        self.active = False
+        self._state = None
+
+    def __enter__(self):
+        self.begin()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.finish()
+        else:
+            self.abort()
+
+    def begin(self):
+        """! Resets the counters and tells the TP program to start consuming the ring.
+        """
+        error = FANUCethernetipDriver.write_registers(self.robot_IP, [
+            (STREAM_WRITE_REGISTER, 0), (STREAM_READ_REGISTER, 0),
+            (STREAM_CNT_REGISTER, self.cnt), (STREAM_STATE_REGISTER, STREAM_RUN)])
+        if error:
+            raise IOError(f"Could not start stream: {error}")
+        self.written = 0
+        self.consumed = 0
+        self.active = True
+
+    def push(self, coords: list):
+        """! Queues one pose, blocks only while every slot is still waiting to be issued.
+        @param coords       [X, Y, Z] or [X, Y, Z, W, P, R]
+        """
+        if not self.active:
+            raise RuntimeError("Stream is not active, call begin() first")
+        if len(coords) not in (3, 6):
+            raise Warning("Not enough values passed!")
+
+        # one slot is kept free so the PR the TP program is planning is never overwritten
+        if self.written - self.consumed >= self.slots - 1:
+            self.waits += 1
+            self._wait_for(lambda: self.written - self.consumed < self.slots - 1, "a free slot")
+
+        self.template[2:2 + len(coords)] = coords
+        pr_number = self.first_pr + self.written % self.slots
+        requests = [
+            b'\x10' + request_path(0x7B, 0x01, pr_number) + CARTESIAN_LAYOUT.pack(0, 0, *self.template[2:15]),
+            b'\x10' + request_path(0x6B, 0x01, STREAM_WRITE_REGISTER) + struct.pack('<i', self.written + 1),
+        ]
+        replies = FANUCethernetipDriver._send_multiple_service(self.robot_IP, requests, 'fanucStreamPush')
+        if any(status != 0 for status, _ in replies):
+            raise IOError(f"Could not write PR[{pr_number}] for streamed pose {self.written + 1}")
+        self.written += 1
+
+    def extend(self, path: list):
+        """! Queues every pose of path in order.
+        """
+        for coords in path:
+            self.push(coords)
+
+    def finish(self):
+        """! Waits until the TP program has executed every queued pose and the robot has stopped.
+        """
+        if not self.active:
+            return
+        FANUCethernetipDriver.writeR_Register(self.robot_IP, STREAM_STATE_REGISTER, STREAM_FINISH)
+        self._wait_for(lambda: self._state == STREAM_IDLE, "the stream to finish")
+        self.active = False
+
+    def abort(self):
+        """! Stops after the move in progress, poses that were not issued yet are dropped.
+        """
+        if not self.active:
+            return
+        self.active = False
+        self._poll()
+        FANUCethernetipDriver.write_registers(self.robot_IP, [
+            (STREAM_WRITE_REGISTER, self.consumed), (STREAM_STATE_REGISTER, STREAM_FINISH)])
+
+    def _poll(self):
+        # one round trip for both the consumed count and the stream state
+        values = FANUCethernetipDriver.read_registers(self.robot_IP, [STREAM_READ_REGISTER, STREAM_STATE_REGISTER])
+        if values[STREAM_READ_REGISTER] is None or values[STREAM_STATE_REGISTER] is None:
+            raise IOError(f"Could not read the stream registers on {self.robot_IP}")
+        self.consumed = values[STREAM_READ_REGISTER]
+        self._state = values[STREAM_STATE_REGISTER]
+
+    def _wait_for(self, condition, what: str):
+        deadline = time.monotonic() + self.timeout
+        for interval in backoff_intervals():
+            self._poll()
+            if condition():
+                return
+            if time.monotonic() >= deadline:
+                raise TimeoutError(f"Timed out waiting for {what}: {self.consumed}/{self.written} poses issued, "
+                                   "check TP for further diagnosis")
+            time.sleep(interval)
@@ -0,0 +1,285 @@
+"""
+Streaming G-code reader that prints slicer output on the robot and the gantry.
+
+read_gcode() parses a file line by line into GcodeMoves in absolute millimetres:
+G0/G1 moves, G2/G3 arcs (I/J or R, split into chords), feed rates, G20/G21 units,
+G90/G91 and M82/M83 positioning, G92 coordinate offsets, extrusion from E words or from the
+M3/M101 (on) and M5/M103 (off) extruder M-codes, and layer changes from ;LAYER: comments
+or a rising Z.
+
+gcode_layers() maps the moves onto the robot frame with a GcodeMapping. While a move is
+within the robot reach it is done by the robot alone, when it leaves the reach window the
+gantry Y/Z axis is shifted and the robot target is offset by the same amount; a printed
+line crossing the edge of the window is split there and resumed after the shift. The moves
+are grouped into toolpath Layers of at most max_segments segments, which
+toolpath.compile_stream() validates and compiles one at a time. Nothing holds more than one
+chunk, so a multi-megabyte file starts printing right away:
+
+    print_gcode("part.gcode", woody, plc, GcodeMapping(origin=(0, -350, 0)))
+"""
+import math
+import re
+from typing import NamedTuple
+
+from PyPLCConnection import MD_PELLET_UFRAME, MD_PELLET_UTOOL
+from toolpath import (
+    FRAME, Z_ABSOLUTE, Command, Layer, Limits, Segment, Toolpath, compile_stream, run_commands,
+)
+
+ARC_TOLERANCE = 0.05    # mm between an arc and its chords
+MAX_SEGMENTS = 256      # segments per compiled chunk
+
+_WORD = re.compile(r"([A-Z])\s*([-+]?(?:\d+\.?\d*|\.\d+))")
+_LAYER_COMMENT = re.compile(r";\s*LAYER\s*:\s*(-?\d+)", re.IGNORECASE)
+
+
+class GcodeMove(NamedTuple):
+    """
+    Straight move to an absolute machine position in mm.
+    """
+    x: float
+    y: float
+    z: float
+    extrude: bool
+    feed: float     # mm/s, None until the file sets a feed rate
+    layer: int
+    line: int       # line number in the file, for error messages
+
+
+class GcodeMapping(NamedTuple):
+    """
+    Placement of the G-code coordinates on the robot and the gantry.
+    """
+    origin: tuple = (0.0, 0.0, 0.0)     # robot X, Y, Z of G-code (0, 0, 0) with the gantry at 0
+    reach_y: tuple = (-400.0, 400.0)    # robot Y window, outside it the gantry Y axis moves
+    reach_z: tuple = (-50.0, 300.0)     # robot Z window, outside it the gantry Z axis moves
+    max_speed: float = Limits().speed[1]    # slicer feeds above this are clamped, mm/s
+    uframe: int = MD_PELLET_UFRAME
+    utool: int = MD_PELLET_UTOOL
+
+
+def _arc(start, end, center, clockwise, tolerance):
+    # chord end points of an XY arc, Z is interpolated linearly (helix)
+    radius = math.hypot(start[0] - center[0], start[1] - center[1])
+    a0 = math.atan2(start[1] - center[1], start[0] - center[0])
+    a1 = math.atan2(end[1] - center[1], end[0] - center[0])
+    sweep = a1 - a0
+    if clockwise and sweep >= 0:
+        sweep -= 2 * math.pi
+    elif not clockwise and sweep <= 0:
+        sweep += 2 * math.pi
+    step = 2 * math.acos(max(-1.0, 1 - tolerance / radius)) if radius > tolerance else math.pi / 2
+    count = max(1, math.ceil(abs(sweep) / step))
+    for i in range(1, count):
+        angle = a0 + sweep * i / count
+        yield (center[0] + radius * math.cos(angle), center[1] + radius * math.sin(angle),
+               start[2] + (end[2] - start[2]) * i / count)
+    yield end
+
+
+def read_gcode(lines, arc_tolerance=ARC_TOLERANCE):
+    """
+    Parse G-code lazily.
+
+    :param lines: iterable of lines, e.g. an open file
+    :return: generator of GcodeMove
+    """
+    position = [0.0, 0.0, 0.0]     # machine position
+    offset = [0.0, 0.0, 0.0]       # machine - programmed coordinates, set by G92
+    e_position = 0.0
+    absolute = True
+    e_absolute = True
+    scale = 1.0             # mm per unit
+    feed = None
+    extruder_on = False     # M-code extruder state, used for moves without E
+    layer = 0
+    layer_z = None
+    explicit_layers = False
+    motion = None           # modal G0-G3 of lines that only carry coordinates
+
+    for number, raw in enumerate(lines, 1):
+        match = _LAYER_COMMENT.search(raw)
+        if match:
+            explicit_layers = True
+            layer = int(match.group(1))
+        code = re.sub(r"\(.*?\)", "", raw.split(";", 1)[0]).upper()
+        words = _WORD.findall(code)
+        if not words:
+            continue
+        params = {}
+        commands = []
+        for letter, value in words:
+            if letter in "GM":
+                commands.append((letter, float(value)))
+            else:
+                params[letter] = float(value)
+
+        if not any(letter == "G" and value in (0, 1, 2, 3) for letter, value in commands) \
+                and motion is not None and any(axis in params for axis in "XYZE"):
+            commands.append(("G", motion))
+
+        for letter, value in commands:
+            if letter == "M":
+                if value in (3, 4, 101):
+                    extruder_on = True
+                elif value in (5, 103):
+                    extruder_on = False
+                elif value == 82:
+                    e_absolute = True
+                elif value == 83:
+                    e_absolute = False
+                continue
+            if value == 20:
+                scale = 25.4
+            elif value == 21:
+                scale = 1.0
+            elif value == 90:
+                absolute = True
+            elif value == 91:
+                absolute = False
+            elif value == 92:
+                # redefine the programmed coordinates, the machine stays where it is
+                for i, axis in enumerate("XYZ"):
+                    if axis in params:
+                        offset[i] = position[i] - params[axis] * scale
+                if "E" in params:
+                    e_position = params["E"] * scale
+            elif value in (0, 1, 2, 3):
+                motion = value
+                if "F" in params:
+                    feed = params["F"] * scale / 60.0
+                target = list(position)
+                for i, axis in enumerate("XYZ"):
+                    if axis in params:
+                        target[i] = params[axis] * scale + (offset[i] if absolute else position[i])
+                extrude = extruder_on
+                if "E" in params:
+                    e = params["E"] * scale
+                    e_delta = e - e_position if e_absolute else e
+                    e_position = e if e_absolute else e_position + e
+                    extrude = e_delta > 0
+                if value == 0:
+                    extrude = False
+                if target == position:
+                    continue    # feed or E only
+
+                if not explicit_layers and extrude and target[2] != layer_z:
+                    if layer_z is not None and target[2] > layer_z:
+                        layer += 1
+                    layer_z = target[2]
+
+                if value in (2, 3):
+                    if "R" in params:
+                        center = _arc_center(position, target, params["R"] * scale, value == 2)
+                    else:
+                        center = (position[0] + params.get("I", 0.0) * scale,
+                                  position[1] + params.get("J", 0.0) * scale)
+                    points = _arc(tuple(position), tuple(target), center, value == 2, arc_tolerance)
+                else:
+                    points = (tuple(target),)
+                for point in points:
+                    yield GcodeMove(point[0], point[1], point[2], extrude, feed, layer, number)
+                position = target
+
+
+def _arc_center(start, end, radius, clockwise):
+    # center of an R-form arc, a negative radius selects the arc longer than 180 degrees
+    dx, dy = end[0] - start[0], end[1] - start[1]
+    chord = math.hypot(dx, dy)
+    if chord == 0 or chord > 2 * abs(radius) + 1e-9:
+        raise ValueError(f"Arc radius {radius} cannot join {start[:2]} and {end[:2]}")
+    h = math.sqrt(max(radius ** 2 - (chord / 2) ** 2, 0.0))
+    sign = (-1 if clockwise else 1) * (1 if radius > 0 else -1)
+    return (start[0] + dx / 2 - sign * h * dy / chord, start[1] + dy / 2 + sign * h * dx / chord)
+
+
+def _trailing_offset(resume, target, window):
+    # gantry offset placing the resume coordinate on the window edge behind the motion,
+    # so the robot has the whole window ahead of it
+    return resume - (window[0] if target >= resume else window[1])
+
+
+def gcode_layers(moves, mapping=GcodeMapping(), max_segments=MAX_SEGMENTS):
+    """
+    Group GcodeMoves into toolpath Layers in the robot frame.
+
+    Moves beyond the robot's Y reach are split at the edge of the reach window, the gantry
+    is shifted so the robot resumes at the trailing edge of the window, and the next Layer
+    starts with a travel back to the split point. Z beyond the reach shifts the gantry Z
+    axis the same way. A new Layer also starts at every G-code layer change and after
+    max_segments segments.
+
+    :return: generator of Layer
+    """
+    x0, y0, z0 = mapping.origin
+    gantry_y = gantry_z = 0.0
+    layer = None
+    number = None
+    last = None     # last point in the robot frame with the gantry at 0
+
+    def begin(resume):
+        # new chunk at the current gantry position, starting with a travel to resume
+        chunk = Layer((resume or (0, 0, 0))[2] - gantry_z, gantry_y, gantry_z)
+        if resume is not None:
+            chunk.add(Segment(resume[0], resume[1] - gantry_y, resume[2] - gantry_z, False, None, Z_ABSOLUTE))
+        return chunk
+
+    for move in moves:
+        point = (move.x + x0, move.y + y0, move.z + z0)
+        speed = min(move.feed, mapping.max_speed) if move.feed else None
+        if layer is None or move.layer != number or len(layer.segments) >= max_segments:
+            if layer is not None and layer.segments:
+                yield layer
+            layer, number = begin(None), move.layer
+
+        if not mapping.reach_z[0] <= point[2] - gantry_z <= mapping.reach_z[1]:
+            if layer.segments:
+                yield layer
+            gantry_z = _trailing_offset(point[2], point[2] + (point[2] - (last or point)[2]), mapping.reach_z)
+            layer = begin(None)
+
+        while not mapping.reach_y[0] <= point[1] - gantry_y <= mapping.reach_y[1]:
+            if last is not None and move.extrude and point[1] != last[1]:
+                # print up to the edge of the window, then continue from there
+                edge = mapping.reach_y[1] if point[1] - gantry_y > mapping.reach_y[1] else mapping.reach_y[0]
+                t = (edge + gantry_y - last[1]) / (point[1] - last[1])
+                split = tuple(a + (b - a) * t for a, b in zip(last, point))
+                layer.add(Segment(split[0], split[1] - gantry_y, split[2] - gantry_z, True, speed, Z_ABSOLUTE))
+                last = split
+            resume = last if last is not None and move.extrude else None
+            if layer.segments:
+                yield layer
+            gantry_y = _trailing_offset((resume or point)[1], point[1], mapping.reach_y)
+            layer = begin(resume)
+
+        layer.add(Segment(point[0], point[1] - gantry_y, point[2] - gantry_z, move.extrude, speed, Z_ABSOLUTE))
+        last = point
+    if layer is not None and layer.segments:
+        yield layer
+
+
+def gcode_commands(lines, mapping=GcodeMapping(), toolpath=None, max_segments=MAX_SEGMENTS, **kwargs):
+    """
+    Lazily compile G-code to toolpath Commands, starting with the user frame and tool.
+    Keyword arguments are passed to toolpath.ToolpathCompiler.
+
+    :param toolpath: Toolpath supplying the default travel/print speeds and the orientation
+    :return: generator of Command
+    """
+    toolpath = toolpath or Toolpath()
+    yield Command(FRAME, (mapping.uframe, mapping.utool))
+    layers = gcode_layers(read_gcode(lines), mapping, max_segments)
+    yield from compile_stream(toolpath, layers, gantry=(0.0, 0.0), **kwargs)
+
+
+def print_gcode(path, robot, plc, mapping=GcodeMapping(), toolpath=None, stream=False, cnt=0, **kwargs):
+    """
+    Print a G-code file, reading, compiling and executing it chunk by chunk.
+
+    :param path: G-code file
+    :param robot: robot_controller.robot
+    :param plc: PyPLCConnection
+    :param stream: send runs of moves through the look-ahead streamer, see toolpath.run_commands()
+    """
+    with open(path) as lines:
+        run_commands(gcode_commands(lines, mapping, toolpath, **kwargs), robot, plc, stream, cnt)
@@ -0,0 +1,742 @@
+"""
+Offline dry run of print jobs against a time model of the robot and the gantry.
+
+DryRun swaps the hardware for models while a job runs:
+  - robot_controller.robot creates a DryRunRobot, which times cartesian moves with a
+    trapezoidal velocity profile (speed, acceleration, FINE settle) and joint moves at a
+    fixed joint speed
+  - PyPLCConnection.PyPLCConnection creates a DryRunPLC, a real PyPLCConnection whose
+    requests are answered in-process by a GantryPLCSimulator, so frame counts, pulse rates
+    and the Z correction program behave as on the gantry
+  - time.sleep/monotonic/time/perf_counter follow a VirtualClock, MotionPlan steps are
+    scheduled on it and threads started by the job get their own simulated time
+
+Every modelled second is booked under a category: PRINT (robot or gantry motion while the
+extruder is on), TRAVEL (motion with the extruder off), DWELL (time.sleep in the job) and
+IO (robot explicit messages and Modbus requests). The job runs at CPU speed, so a full wall
+print takes seconds:
+
+    report = simulate_job("pla_wall_1000mm.py")
+    print(report.format())
+
+    python job_simulator.py wall_plc_correction.py wall_path.py
+
+Jobs written against robot/plc objects run the same way:
+
+    with DryRun() as dry:
+        program.run(dry.robot(), dry.plc())
+    print(dry.report().format())
+
+Asyncio jobs are not supported: the event loop would wait in real time for timers on the
+virtual clock.
+"""
+import argparse
+import collections
+import contextlib
+import math
+import os
+import runpy
+import struct
+import sys
+import threading
+import time
+from typing import NamedTuple
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.normpath(os.path.join(current_dir, "fanuc_ethernet_ip_drivers", "src")))
+
+import robot_controller
+import PyPLCConnection as plc_module
+from PyPLCConnection import MD_EXTRUDER_ADDRESS, PLC_IP, ROBOT_IP, PyPLCConnection, TravelFuture
+from motion_executor import ExecutionReport, MotionPlan
+from plc_simulator import (
+    READ_COILS, READ_HOLDING_REGISTERS, WRITE_MULTIPLE_COILS, WRITE_MULTIPLE_REGISTERS,
+    WRITE_SINGLE_COIL, WRITE_SINGLE_REGISTER, GantryPLCSimulator,
+)
+
+# time categories of the report
+PRINT = "print"
+TRAVEL = "travel"
+DWELL = "dwell"
+IO = "io"
+CATEGORIES = (PRINT, TRAVEL, DWELL, IO)
+
+TRAVEL_STEP = 0.05      # simulated seconds between checks of TravelFuture.stop()
+STALL = 0.005           # real seconds a job thread waits for the main thread before running ahead
+FRESH_MODULES = ("utils",)  # modules that connect to the hardware on import, re-imported per dry run
+
+
+class TimeModel(NamedTuple):
+    """
+    Timing parameters of the dry run. The defaults are typical LR Mate 200iD and CLICK values,
+    calibrate them against robot.get_motion_stats() and PLC request timings of a real print.
+    """
+    robot_accel: float = 1500.0         # mm/s^2, cartesian acceleration and braking
+    robot_settle: float = 0.03          # s per FINE stop at the end of a move
+    joint_speed: float = 60.0           # deg/s of joint moves, like FANUCEmulator
+    default_speed: float = 100.0        # mm/s while R[5] is 0, like FANUCEmulator
+    robot_round_trip: float = 0.004     # s per EtherNet/IP explicit message
+    plc_round_trip: float = 0.003       # s per Modbus TCP request
+    move_messages: int = 3              # PR write, start register write, completion poll
+
+    def move_time(self, distance, speed):
+        """
+        Seconds of a point to point move with a trapezoidal (or triangular) speed profile.
+        """
+        if distance <= 0:
+            return 0.0
+        if distance >= speed * speed / self.robot_accel:
+            return distance / speed + speed / self.robot_accel
+        return 2 * math.sqrt(distance / self.robot_accel)
+
+
+class CycleReport(NamedTuple):
+    """
+    Result of a dry run, times in simulated seconds.
+    """
+    cycle_time: float
+    breakdown: dict     # category -> seconds booked
+    counts: dict        # category -> number of bookings (moves, sleeps, round trips)
+    robot_moves: int
+    plc_frames: int
+    unmodelled: dict    # robot method -> calls answered with one round trip and None
+
+    @property
+    def overlap(self):
+        """
+        Seconds of concurrent activity, e.g. MotionPlan steps or job threads.
+        """
+        return max(0.0, sum(self.breakdown.values()) - self.cycle_time)
+
+    def format(self):
+        lines = [f"cycle time   {self.cycle_time:10.1f} s"]
+        for category in CATEGORIES:
+            seconds = self.breakdown.get(category, 0.0)
+            share = 100 * seconds / self.cycle_time if self.cycle_time else 0.0
+            lines.append(f"  {category:<10} {seconds:10.1f} s {share:5.1f} %  ({self.counts.get(category, 0)})")
+        if self.overlap >= 0.05:
+            lines.append(f"  overlap    {-self.overlap:10.1f} s")
+        lines.append(f"robot moves {self.robot_moves}, PLC frames {self.plc_frames}")
+        if self.unmodelled:
+            calls = ", ".join(f"{name} x{count}" for name, count in sorted(self.unmodelled.items()))
+            lines.append(f"not modelled: {calls}")
+        return "\n".join(lines)
+
+
+class VirtualClock:
+    """
+    Simulated time of a dry run in seconds from the start of the job.
+
+    The thread that entered the DryRun owns the clock. Threads the job starts get their
+    own time, starting at the owner's time when start() was called. A job thread that
+    sleeps past the owner's time waits, and before the owner advances to t it first lets
+    every job thread due before t run up to its next sleep, so all threads see the
+    simulated PLC in time order. Waiting on a thread that is blocked outside the clock
+    (a lock, a join) gives up after `stall` real seconds.
+    """
+
+    def __init__(self, limit=None, stall=STALL):
+        """
+        :param limit: simulated seconds after which the owner's next step raises TimeoutError
+        """
+        self.limit = limit
+        self.stall = stall
+        self.epoch = time.time()    # base of time(), so job timestamps look real
+        self.owner = threading.get_ident()
+        self.busy = collections.defaultdict(float)
+        self.counts = collections.Counter()
+        self.finished = False
+        self._time = 0.0
+        self._changed = threading.Condition()
+        self._waiting = {}      # job thread ident -> simulated time it sleeps until
+        self._active = 0        # job threads running, i.e. not waiting on the clock
+
+    def __call__(self):
+        return self.now()
+
+    def now(self):
+        if threading.get_ident() == self.owner:
+            return self._time
+        return getattr(threading.current_thread(), "_dry_run_time", self._time)
+
+    def time(self):
+        return self.epoch + self.now()
+
+    def book(self, category, seconds):
+        """
+        Add seconds to a category without advancing the clock, e.g. for overlapped work.
+        """
+        with self._changed:
+            self.busy[category] += seconds
+            self.counts[category] += 1
+
+    def advance(self, seconds, category=None):
+        if category is not None:
+            self.book(category, seconds)
+        self._set(self.now() + max(seconds, 0.0))
+
+    def advance_to(self, t, category=None):
+        now = self.now()
+        if t > now:
+            self.advance(t - now, category)
+
+    def sleep(self, seconds):
+        if seconds < 0:
+            raise ValueError("sleep length must be non-negative")
+        self.advance(seconds, DWELL if threading.get_ident() == self.owner else None)
+
+    def place(self, t):
+        """
+        Set the calling thread's time, also backwards, without waiting (MotionPlan scheduling).
+        """
+        if threading.get_ident() == self.owner:
+            self._time = t
+        else:
+            threading.current_thread()._dry_run_time = t
+
+    def finish(self):
+        with self._changed:
+            self.finished = True
+            self._waiting.clear()
+            self._changed.notify_all()
+
+    def attach(self, thread):
+        """
+        Give a thread the caller's time and make the clock wait for it, see DryRun.
+        """
+        thread._dry_run_time = self.now()
+        run = thread.run
+
+        def tracked():
+            try:
+                run()
+            finally:
+                with self._changed:
+                    self._active -= 1
+                    self._changed.notify_all()
+
+        thread.run = tracked
+        with self._changed:
+            self._active += 1
+
+    def _set(self, t):
+        if threading.get_ident() == self.owner:
+            if self.limit is not None and t > self.limit:
+                raise TimeoutError(f"Job still running after {self.limit} simulated seconds")
+            with self._changed:
+                # run the job threads due before t first, one wake-up time after the other
+                while not self.finished:
+                    due = [w for w in self._waiting.values() if w < t]
+                    if self._active == 0:
+                        if not due:
+                            break
+                        self._time = max(self._time, min(due))
+                        for ident, wake in list(self._waiting.items()):
+                            if wake <= self._time:
+                                del self._waiting[ident]
+                                self._active += 1
+                        self._changed.notify_all()
+                    if not self._changed.wait(self.stall):
+                        break
+                self._time = max(self._time, t)
+                self._changed.notify_all()
+            return
+
+        thread = threading.current_thread()
+        attached = hasattr(thread, "_dry_run_time")
+        thread._dry_run_time = t
+        if not attached:
+            return
+        ident = threading.get_ident()
+        with self._changed:
+            if self._time >= t or self.finished:
+                return
+            self._waiting[ident] = t
+            self._active -= 1
+            self._changed.notify_all()
+            while ident in self._waiting:
+                if not self._changed.wait(self.stall) and ident in self._waiting:
+                    # the owner is blocked outside the clock, most likely on this thread
+                    del self._waiting[ident]
+                    self._active += 1
+
+
+class DryRunRobot:
+    """
+    Stand-in for robot_controller.robot that moves on the virtual clock.
+
+    Methods without a model cost one round trip, return None and are listed in the report.
+    """
+
+    def __init__(self, robotIP, clock, model=TimeModel(), extruding=lambda: False):
+        """
+        :param extruding: callable telling whether the extruder is on, moves are booked as PRINT then
+        """
+        self.robot_IP = robotIP
+        self.clock = clock
+        self.model = model
+        self.extruding = extruding
+        self.cartesian = [0.0, 0.0, 0.0, 0.0, 90.0, 0.0]     # X Y Z W P R, FANUCEmulator start pose
+        self.joints = [0.0] * 6
+        self.moves = 0
+        self.unmodelled = collections.Counter()
+        self._registers = {}        # register name -> value known to the PC, like RegisterCache
+        self._busy_until = None     # end of a non-blocking move
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        def unmodelled(*args, **kwargs):
+            self.unmodelled[name] += 1
+            self._io()
+        return unmodelled
+
+    def _io(self, messages=1):
+        self.clock.advance(messages * self.model.robot_round_trip, IO)
+
+    def _write(self, name, value):
+        # repeated writes of the same value are skipped, like RegisterCache
+        if self._registers.get(name) != value:
+            self._io()
+            self._registers[name] = value
+
+    def _read(self, name, default):
+        if name not in self._registers:
+            self._io()
+            self._registers[name] = default
+        return self._registers[name]
+
+    def _move(self, duration, blocking):
+        # a new move waits for the running one, like the TP program
+        self.wait_for_motion()
+        self._io(self.model.move_messages - 1)
+        duration += self.model.robot_settle
+        category = PRINT if self.extruding() else TRAVEL
+        self.moves += 1
+        if blocking:
+            self.clock.advance(duration, category)
+            self._io()
+        else:
+            self.clock.book(category, duration)
+            self._busy_until = self.clock.now() + duration
+
+    def _speed(self):
+        speed = self._registers.get("speed") or self.model.default_speed
+        return speed * self._registers.get("percent", 100) / 100.0
+
+    def connect(self):
+        pass
+
+    def close(self):
+        pass
+
+    @property
+    def CurCartesianPosList(self):
+        return [0, 0] + self.cartesian
+
+    @property
+    def CurJointPosList(self):
+        return [0, 0] + self.joints
+
+    # === Motion ===
+
+    def write_cartesian_position(self, coords, blocking=True):
+        if isinstance(coords[0], list):
+            if not all(isinstance(x, list) for x in coords):
+                raise Warning("If passing a list of lists, all elements must be lists!")
+            for coord in coords:
+                self.write_cartesian_position(coord, blocking=blocking)
+            return
+        if len(coords) not in (3, 6):
+            raise Warning("Not enough values passed!")
+        target = list(coords) + self.cartesian[len(coords):]
+        distance = math.dist(self.cartesian[:3], target[:3])
+        rotation = max(abs(a - b) for a, b in zip(self.cartesian[3:], target[3:]))
+        duration = max(self.model.move_time(distance, self._speed()), rotation / self.model.joint_speed)
+        self._move(duration, blocking)
+        self.cartesian = target
+
+    # the alternative PR variants take as long as the PR[1] move
+    write_cartesian_position_2 = write_cartesian_position
+    write_cartesian_position_3 = write_cartesian_position
+    write_cartesian_position_register = write_cartesian_position
+    write_cartesian_position_register2 = write_cartesian_position
+    write_cartesian_position_register3 = write_cartesian_position
+
+    def stream_cartesian_path(self, coords, cnt=100):
+        """
+        Streamed path. With cnt > 0 it is blended: one acceleration and one stop for the
+        whole path. With cnt 0 every segment accelerates and stops. Only the first pose
+        write is on the critical path, the others overlap the motion.
+        """
+        self.wait_for_motion()
+        path = [list(c) + self.cartesian[len(c):] for c in coords]
+        lengths = [math.dist(a[:3], b[:3]) for a, b in zip([self.cartesian] + path, path)]
+        self._io(2)
+        self.clock.book(IO, (len(path) - 1) * self.model.robot_round_trip)
+        self.moves += len(path)
+        if cnt > 0:
+            duration = self.model.move_time(sum(lengths), self._speed()) + self.model.robot_settle
+        else:
+            duration = sum(self.model.move_time(length, self._speed()) + self.model.robot_settle
+                           for length in lengths)
+        self.clock.advance(duration, PRINT if self.extruding() else TRAVEL)
+        self._io()
+        if path:
+            self.cartesian = path[-1]
+
+    def write_joint_pose(self, joint_position_array, blocking=True):
+        if isinstance(joint_position_array[0], list):
+            for joints in joint_position_array:
+                self.write_joint_pose(joints, blocking=blocking)
+            return
+        target = list(joint_position_array) + self.joints[len(joint_position_array):]
+        self._move(max(abs(a - b) for a, b in zip(self.joints, target)) / self.model.joint_speed, blocking)
+        self.joints = target
+
+    def write_joint_position(self, joint, value, blocking=True):
+        target = list(self.joints)
+        target[joint - 1] = value
+        self.write_joint_pose(target, blocking)
+
+    def write_joint_offset(self, joint, value, blocking=True):
+        self.write_joint_position(joint + 1, self.joints[joint] + value, blocking)
+
+    def start_robot(self, blocking=True):
+        self._io()
+        if blocking:
+            self.wait_for_motion()
+
+    def wait_for_motion(self, timeout=None, deadline=None):
+        if self._busy_until is None:
+            return 0.0
+        waited = self._busy_until - self.clock.now()
+        self.clock.advance_to(self._busy_until)
+        self._busy_until = None
+        self._io()
+        return max(waited, 0.0)
+
+    def is_moving(self):
+        self._io()
+        return int(self._busy_until is not None and self.clock.now() < self._busy_until)
+
+    def read_current_cartesian_pose(self):
+        self._io()
+        return list(self.cartesian)
+
+    def read_current_joint_position(self):
+        self._io()
+        return list(self.joints)
+
+    # === Registers ===
+
+    def set_speed(self, value):
+        if value > 300 or value < 0:
+            raise Warning(f"Speed should be in the range of [0, 300], got {value}")
+        self._write("speed", value)
+
+    def get_speed(self):
+        return self._read("speed", 0)
+
+    def set_robot_speed_percent(self, value):
+        if value > 100 or value < 0:
+            raise Warning(f"Speed percent should be in the range of [0, 100], got {value}")
+        self._write("percent", value)
+
+    def get_robot_speed_percent(self):
+        return self._read("percent", 100)
+
+    def get_actual_robot_speed(self):
+        self._io()
+        return self._speed()
+
+    def set_robot_uframe(self, value):
+        if not (0 <= value <= 30):
+            raise ValueError(f"User frame must be within the range [0, 30], received: {value}")
+        self._write("uframe", value)
+
+    def get_robot_uframe(self):
+        return self._read("uframe", 0)
+
+    def set_robot_utool(self, value):
+        if not (0 <= value <= 10):
+            raise ValueError(f"User tool must be within the range [0, 10], received: {value}")
+        self._write("utool", value)
+
+    def get_robot_utool(self):
+        return self._read("utool", 0)
+
+
+class _Response:
+    # the parts of a pymodbus response PyPLCConnection uses
+    def __init__(self, reply):
+        self.function = reply[0]
+        self.bits = []
+        self.registers = []
+        if self.isError():
+            return
+        if self.function == READ_COILS:
+            self.bits = [bool(byte >> i & 1) for byte in reply[2:2 + reply[1]] for i in range(8)]
+        elif self.function == READ_HOLDING_REGISTERS:
+            self.registers = list(struct.unpack(">%dH" % (reply[1] // 2), reply[2:2 + reply[1]]))
+
+    def isError(self):
+        return bool(self.function & 0x80)
+
+
+class DryRunModbusClient:
+    """
+    Stand-in for pymodbus's ModbusTcpClient that hands every request to a GantryPLCSimulator
+    in-process, one round trip on the virtual clock per request.
+    """
+    connected = True
+
+    def __init__(self, simulator, clock, round_trip):
+        self.simulator = simulator
+        self.clock = clock
+        self.round_trip = round_trip
+
+    def connect(self):
+        return True
+
+    def close(self):
+        pass
+
+    def _request(self, function, data):
+        self.clock.advance(self.round_trip, IO)
+        return _Response(self.simulator.handle_pdu(bytes([function]) + data))
+
+    def read_coils(self, address, count=1, **kwargs):
+        return self._request(READ_COILS, struct.pack(">HH", address, count))
+
+    def read_holding_registers(self, address, count=1, **kwargs):
+        return self._request(READ_HOLDING_REGISTERS, struct.pack(">HH", address, count))
+
+    def write_coil(self, address, value, **kwargs):
+        return self._request(WRITE_SINGLE_COIL, struct.pack(">HH", address, 0xFF00 if value else 0))
+
+    def write_register(self, address, value, **kwargs):
+        return self._request(WRITE_SINGLE_REGISTER, struct.pack(">HH", address, int(value) & 0xFFFF))
+
+    def write_coils(self, address, values, **kwargs):
+        packed = bytearray((len(values) + 7) // 8)
+        for i, value in enumerate(values):
+            if value:
+                packed[i // 8] |= 1 << (i % 8)
+        return self._request(WRITE_MULTIPLE_COILS,
+                              struct.pack(">HHB", address, len(values), len(packed)) + bytes(packed))
+
+    def write_registers(self, address, values, **kwargs):
+        words = [int(v) & 0xFFFF for v in values]
+        return self._request(WRITE_MULTIPLE_REGISTERS, struct.pack(">HHB%dH" % len(words), address,
+                                                                    len(words), 2 * len(words), *words))
+
+
+class DryRunPLC(PyPLCConnection):
+    """
+    PyPLCConnection answered by a GantryPLCSimulator on the virtual clock.
+    """
+
+    def __init__(self, simulator, clock, model=TimeModel(), ip_address=PLC_IP, port=502, tags=None):
+        super().__init__(ip_address, port, tags)
+        self.simulator = simulator
+        self.clock = clock
+        self.client = DryRunModbusClient(simulator, clock, model.plc_round_trip)
+
+    def start_poller(self, rate_hz=20, *args, **kwargs):
+        # requests are answered in-process, a poller thread would only add frames
+        return None
+
+    def travel_async(self, coil_address, distance, unit, axis):
+        future = super().travel_async(coil_address, distance, unit, axis)
+        future.deadline = self.clock.now() + future.travel_time
+        return future
+
+    def _finish_travel(self, coil_address, start, travel_time, stop_event, countdown=True):
+        # the coil is held on the virtual clock in TRAVEL_STEP slices, so stop() ends it early
+        category = PRINT if self.simulator.coils[MD_EXTRUDER_ADDRESS - 1] else TRAVEL
+        deadline = start + travel_time
+        try:
+            while not stop_event.is_set() and self.clock.now() < deadline:
+                self.clock.advance(min(TRAVEL_STEP, deadline - self.clock.now()), category)
+        finally:
+            self.write_modbus_coils(coil_address, False)
+        return self.clock.now() - start
+
+
+class DryRun:
+    """
+    Context in which the robot, the PLC and the time functions are simulated, see the module docstring.
+    """
+
+    def __init__(self, model=TimeModel(), limit=None, stall=STALL, **simulator_options):
+        """
+        :param model: TimeModel
+        :param limit: simulated seconds after which the job is stopped with TimeoutError
+        :param simulator_options: GantryPLCSimulator arguments, e.g. z or bed_height
+        """
+        self.model = model
+        self.clock = VirtualClock(limit, stall)
+        self.simulator = GantryPLCSimulator(clock=self.clock, **simulator_options)
+        self.robots = {}    # IP -> DryRunRobot, one per physical robot
+        self.plcs = []      # every DryRunPLC connection of the job
+        self._patches = []
+
+    def __enter__(self):
+        self.clock.owner = threading.get_ident()
+        clock = self.clock
+        thread_start, thread_join = threading.Thread.start, threading.Thread.join
+        future_result = TravelFuture.result
+
+        def start(thread):
+            clock.attach(thread)
+            thread_start(thread)
+
+        def join(thread, timeout=None):
+            thread_join(thread, timeout)
+            if not thread.is_alive():
+                clock.advance_to(getattr(thread, "_dry_run_time", 0.0))
+
+        def result(future, timeout=None):
+            # waiting for a dry run travel moves the waiting thread to the end of the travel
+            deadline = getattr(future, "deadline", None)
+            if deadline is not None and not future._stop_event.is_set():
+                clock.advance_to(deadline)
+            return future_result(future, timeout)
+
+        self._patch(time, "sleep", clock.sleep)
+        self._patch(time, "monotonic", clock.now)
+        self._patch(time, "perf_counter", clock.now)
+        self._patch(time, "time", clock.time)
+        self._patch(threading.Thread, "start", start)
+        self._patch(threading.Thread, "join", join)
+        self._patch(TravelFuture, "result", result)
+        self._patch(MotionPlan, "execute", lambda plan, max_workers=None: self._execute_plan(plan))
+        self._patch(robot_controller, "robot", lambda robotIP=ROBOT_IP, *args, **kwargs: self.robot(robotIP))
+        self._patch(plc_module, "PyPLCConnection",
+                    lambda ip_address=PLC_IP, port=502, tags=None: self.plc(ip_address, port, tags))
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.clock.finish()
+        while self._patches:
+            owner, name, original = self._patches.pop()
+            setattr(owner, name, original)
+
+    def _patch(self, owner, name, value):
+        self._patches.append((owner, name, getattr(owner, name)))
+        setattr(owner, name, value)
+
+    def robot(self, robotIP=ROBOT_IP):
+        """
+        The DryRunRobot at an address, created on first use.
+        """
+        if robotIP not in self.robots:
+            self.robots[robotIP] = DryRunRobot(robotIP, self.clock, self.model, self.extruding)
+        return self.robots[robotIP]
+
+    def plc(self, ip_address=PLC_IP, port=502, tags=None):
+        """
+        A new DryRunPLC connection to the simulated gantry.
+        """
+        plc = DryRunPLC(self.simulator, self.clock, self.model, ip_address, port, tags)
+        self.plcs.append(plc)
+        return plc
+
+    def extruding(self):
+        return self.simulator.coils[MD_EXTRUDER_ADDRESS - 1]
+
+    def _execute_plan(self, plan):
+        # steps run in plan order (dependencies are always earlier steps), each placed at the
+        # simulated time its dependencies finished, so overlap is reproduced on one thread
+        t0 = self.clock.now()
+        ends = {}
+        for step in plan.steps:
+            start = max((ends[dep] for dep in step.after), default=t0)
+            self.clock.place(start)
+            step.started = start - t0
+            step.result = step.fn(*step.args, **step.kwargs)
+            ends[step] = self.clock.now()
+            step.finished = ends[step] - t0
+        end = max(ends.values(), default=t0)
+        self.clock.place(end)
+        return ExecutionReport(end - t0, sum(step.duration for step in plan.steps), tuple(plan.steps))
+
+    def report(self):
+        """
+        :return: CycleReport of everything run so far
+        """
+        unmodelled = collections.Counter()
+        for robot in self.robots.values():
+            unmodelled.update(robot.unmodelled)
+        return CycleReport(self.clock.now(), dict(self.clock.busy), dict(self.clock.counts),
+                           sum(robot.moves for robot in self.robots.values()),
+                           sum(plc.frames for plc in self.plcs), dict(unmodelled))
+
+
+def simulate_job(path, argv=(), model=TimeModel(), limit=None, quiet=True, **simulator_options):
+    """
+    Dry run a job script as __main__.
+
+    :param path: job script, e.g. "pla_wall_1000mm.py"
+    :param argv: command line arguments of the script
+    :param quiet: discard the script's output
+    :return: CycleReport
+    """
+    path = os.path.abspath(path)
+    saved_argv, saved_path = sys.argv, list(sys.path)
+    saved_modules = {name: sys.modules.pop(name) for name in FRESH_MODULES if name in sys.modules}
+    # a real text stream: jobs may call sys.stdout.reconfigure(), e.g. through ArucoMarkers
+    output = open(os.devnull, "w") if quiet else sys.stdout
+    try:
+        sys.argv = [path, *argv]
+        sys.path.insert(0, os.path.dirname(path))
+        with DryRun(model, limit, **simulator_options) as dry, contextlib.redirect_stdout(output):
+            try:
+                runpy.run_path(path, run_name="__main__")
+            except SystemExit as e:
+                if e.code not in (None, 0):
+                    raise
+        return dry.report()
+    finally:
+        sys.argv, sys.path[:] = saved_argv, saved_path
+        if quiet:
+            output.close()
+        for name in FRESH_MODULES:
+            sys.modules.pop(name, None)
+        sys.modules.update(saved_modules)
+
+
+def compare_jobs(paths, **kwargs):
+    """
+    Dry run several job variants and format their cycle times side by side.
+    Keyword arguments are passed to simulate_job().
+
+    :return: (list of CycleReport, table string)
+    """
+    reports = [simulate_job(path, **kwargs) for path in paths]
+    names = [os.path.basename(path) for path in paths]
+    width = max(12, *(len(name) for name in names))
+    rows = [f"{'':<10}" + "".join(f"{name:>{width + 2}}" for name in names)]
+    rows.append(f"{'cycle':<10}" + "".join(f"{r.cycle_time:>{width}.1f} s" for r in reports))
+    for category in CATEGORIES:
+        rows.append(f"{category:<10}" + "".join(f"{r.breakdown.get(category, 0.0):>{width}.1f} s" for r in reports))
+    rows.append(f"{'frames':<10}" + "".join(f"{r.plc_frames:>{width + 2}}" for r in reports))
+    return reports, "\n".join(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Dry run print jobs and estimate their cycle time")
+    parser.add_argument("jobs", nargs="+", help="job scripts")
+    parser.add_argument("--limit", type=float, default=None, help="stop a job after this many simulated seconds")
+    parser.add_argument("--verbose", action="store_true", help="show the output of the jobs")
+    parser.add_argument("--z", type=float, default=50.0, help="initial nozzle to bed gap in mm")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    if len(args.jobs) == 1:
+        print(simulate_job(args.jobs[0], limit=args.limit, quiet=not args.verbose, z=args.z).format())
+    else:
+        print(compare_jobs(args.jobs, limit=args.limit, quiet=not args.verbose, z=args.z)[1])
+    print(f"simulated in {time.perf_counter() - started:.1f} s")
@@ -0,0 +1,195 @@
+"""
+Coordinated execution of robot and gantry moves.
+
+The FANUC arm and the PLC gantry axes are independent machines, yet the print scripts
+command them one blocking call after another. A MotionPlan describes a sequence of steps
+with the resources each step occupies (ROBOT, GANTRY_Y, GANTRY_Z, EXTRUDER). A step
+implicitly waits for the previous step on any of its resources, and explicit after=
+dependencies add ordering across resources. Steps whose dependencies are met run
+concurrently on worker threads, so e.g. the robot lifts the nozzle while the gantry
+already starts traversing:
+
+    plan = MotionPlan(woody, plc)
+    off = plan.extruder("off")
+    lift = plan.move_robot(lifted_pose, after=[off])
+    travel = plan.travel(Y_LEFT_MOTION, 400, "mm", "y", after=[off])
+    plan.move_robot(lowered_pose, after=[travel])
+    report = plan.execute()
+    print(report.makespan, report.sequential, report.saved)
+
+If a step fails, no further steps are started, the running ones are allowed to finish
+(a gantry travel always drops its coil) and the first error is raised.
+"""
+import concurrent.futures
+import threading
+import time
+from typing import NamedTuple
+
+ROBOT = "robot"
+GANTRY_Y = "gantry_y"
+GANTRY_Z = "gantry_z"
+EXTRUDER = "extruder"
+
+
+class MotionStep:
+    """
+    One action of a MotionPlan and its timing once executed.
+    """
+
+    def __init__(self, index, name, fn, args, kwargs, resources, after):
+        self.index = index
+        self.name = name
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.resources = frozenset(resources)
+        self.after = set(after)     # MotionStep dependencies
+        self.started = None         # time.monotonic() offsets from the start of execute()
+        self.finished = None
+        self.result = None
+
+    @property
+    def duration(self):
+        return None if self.finished is None else self.finished - self.started
+
+    def __repr__(self):
+        return f"MotionStep({self.index}, {self.name!r}, resources={sorted(self.resources)})"
+
+
+class ExecutionReport(NamedTuple):
+    """
+    Timing of an executed MotionPlan, in seconds.
+    """
+    makespan: float     # wall time of the whole plan
+    sequential: float   # sum of the step durations, the time the plan takes run one step at a time
+    steps: tuple        # executed MotionSteps in plan order
+
+    @property
+    def saved(self):
+        return self.sequential - self.makespan
+
+
+class MotionPlan:
+    """
+    Dependency graph of robot, gantry and extruder steps.
+    """
+
+    def __init__(self, robot=None, plc=None):
+        """
+        :param robot: robot_controller.robot used by move_robot() and set_speed()
+        :param plc: PyPLCConnection used by travel() and extruder()
+        """
+        self.robot = robot
+        self.plc = plc
+        self.steps = []
+        self._last = {}         # resource -> last step using it
+        self._barrier = None    # last barrier(), every later step follows it
+
+    def add(self, name, fn, *args, resources=(), after=(), **kwargs):
+        """
+        Add a step calling fn(*args, **kwargs).
+
+        :param resources: resources the step occupies for its whole duration
+        :param after: steps that must finish before this one starts
+        :return: the MotionStep, usable in later after= lists
+        """
+        after = set(after)
+        unknown = [step for step in after if step not in self.steps]
+        if unknown:
+            raise ValueError(f"Dependencies {unknown} are not steps of this plan")
+        if self._barrier is not None:
+            after.add(self._barrier)
+        for resource in resources:
+            if resource in self._last:
+                after.add(self._last[resource])
+        step = MotionStep(len(self.steps), name, fn, args, kwargs, resources, after)
+        for resource in resources:
+            self._last[resource] = step
+        self.steps.append(step)
+        return step
+
+    # === Step builders ===
+
+    def move_robot(self, pose, after=()):
+        """
+        Blocking cartesian move of the robot to pose ([X, Y, Z] or [X, Y, Z, W, P, R]).
+        """
+        return self.add(f"robot -> {list(pose)}", self.robot.write_cartesian_position, list(pose),
+                        resources=(ROBOT,), after=after)
+
+    def set_speed(self, speed, after=()):
+        return self.add(f"robot speed {speed}", self.robot.set_speed, speed, resources=(ROBOT,), after=after)
+
+    def travel(self, coil_address, distance, unit, axis, after=()):
+        """
+        Gantry travel through PyPLCConnection.travel().
+        """
+        resource = GANTRY_Z if axis.lower() == "z" else GANTRY_Y
+        return self.add(f"gantry {axis} {distance} {unit} (coil {coil_address})", self.plc.travel,
+                        coil_address, distance, unit, axis, resources=(resource,), after=after)
+
+    def extruder(self, status, after=()):
+        return self.add(f"extruder {status}", self.plc.md_extruder_switch, status,
+                        resources=(EXTRUDER,), after=after)
+
+    def barrier(self, name="barrier"):
+        """
+        A step that waits for everything added so far, later steps on any resource follow it.
+        """
+        self._barrier = self.add(name, lambda: None, after=self.steps)
+        return self._barrier
+
+    # === Execution ===
+
+    def execute(self, max_workers=None):
+        """
+        Run the plan, each step as soon as its dependencies have finished.
+
+        :param max_workers: worker threads, default one per resource plus one for resource-free steps
+        :return: ExecutionReport
+        """
+        resources = set().union(*(step.resources for step in self.steps)) if self.steps else set()
+        workers = max_workers or len(resources) + 1
+        pending = {step: set(step.after) for step in self.steps}
+        done = threading.Condition()
+        finished = []
+        error = None
+        running = 0
+        t0 = time.monotonic()
+
+        def run(step):
+            nonlocal error, running
+            step.started = time.monotonic() - t0
+            try:
+                step.result = step.fn(*step.args, **step.kwargs)
+            except BaseException as e:
+                with done:
+                    if error is None:
+                        error = e
+            step.finished = time.monotonic() - t0
+            with done:
+                running -= 1
+                finished.append(step)
+                done.notify()
+
+        with concurrent.futures.ThreadPoolExecutor(workers, thread_name_prefix="MotionPlan") as pool:
+            with done:
+                while pending or running:
+                    if error is None:
+                        ready = [step for step, deps in pending.items() if not deps]
+                        for step in ready:
+                            del pending[step]
+                            running += 1
+                            pool.submit(run, step)
+                    elif not running:
+                        break
+                    done.wait()
+                    for step in finished:
+                        for deps in pending.values():
+                            deps.discard(step)
+                    finished.clear()
+
+        if error is not None:
+            raise error
+        makespan = time.monotonic() - t0
+        return ExecutionReport(makespan, sum(step.duration for step in self.steps), tuple(self.steps))
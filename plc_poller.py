@@ -0,0 +1,139 @@
+import threading
+import time
+from typing import NamedTuple, Optional
+
+
+class PLCSnapshot(NamedTuple):
+    """
+    Immutable PLC state published by PLCPoller.
+    """
+    timestamp: float        # time.monotonic() when the last reply arrived
+    wall_time: float        # time.time() of the same moment, for logging
+    registers: dict         # {register_address: int}
+    coils: dict             # {coil_address: bool}
+    sequence: int           # increments with every published snapshot
+    latency: float          # seconds the poll cycle spent on the wire
+    writes: int             # PyPLCConnection.writes when the poll started
+
+    def age(self):
+        """
+        Seconds since this snapshot was taken.
+        """
+        return time.monotonic() - self.timestamp
+
+
+class PLCPoller(threading.Thread):
+    """
+    Reads a block of holding registers and a block of coils at a fixed rate and publishes
+    them as a PLCSnapshot, so consumers read the latest PLC state from memory.
+
+    Each block is read with one Modbus request over its spanning address range, so a poll
+    cycle costs two frames on the PLC's shared connection.
+    """
+
+    def __init__(self, plc, registers=(), coils=(), rate_hz=20):
+        """
+        :param plc: PyPLCConnection to poll through
+        :param registers: holding register addresses to read every cycle
+        :param coils: coil addresses to read every cycle
+        :param rate_hz: poll rate in cycles per second
+        """
+        super().__init__(name=f"PLCPoller-{plc.ip_address}", daemon=True)
+        if rate_hz <= 0:
+            raise ValueError(f"Poll rate must be positive, got {rate_hz}")
+        self.plc = plc
+        self.registers = tuple(sorted(registers))
+        self.coils = tuple(sorted(coils))
+        self.period = 1.0 / rate_hz
+
+        self._snapshot = None
+        self._updated = threading.Condition()
+        self._running = threading.Event()
+        self._running.set()
+
+        # metrics
+        self.cycles = 0
+        self.overruns = 0       # cycles that took longer than the period
+        self.errors = 0
+        self.last_error = None
+        self.max_latency = 0.0
+
+    def run(self):
+        sequence = 0
+        next_deadline = time.monotonic()
+        while self._running.is_set():
+            start = time.monotonic()
+            writes = self.plc.writes
+            try:
+                registers = self.plc.read_register_set(self.registers) if self.registers else {}
+                coils = self.plc.read_coil_set(self.coils) if self.coils else {}
+                now = time.monotonic()
+                sequence += 1
+                latency = now - start
+                self.max_latency = max(self.max_latency, latency)
+                snapshot = PLCSnapshot(now, time.time(), registers, coils, sequence, latency, writes)
+                with self._updated:
+                    self._snapshot = snapshot
+                    self._updated.notify_all()
+            except Exception as e:
+                self.errors += 1
+                self.last_error = e
+                print(f"[PLCPoller] Error: {e}")
+            self.cycles += 1
+
+            # absolute deadlines keep the rate independent of request time
+            next_deadline += self.period
+            delay = next_deadline - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                self.overruns += 1
+                next_deadline = time.monotonic()
+
+    def latest(self) -> Optional[PLCSnapshot]:
+        """
+        Most recent snapshot, or None before the first poll completed.
+        """
+        return self._snapshot
+
+    def staleness(self):
+        """
+        Age of the latest snapshot in seconds, infinity if there is none.
+        """
+        snapshot = self._snapshot
+        return snapshot.age() if snapshot is not None else float("inf")
+
+    def wait_for_update(self, after_sequence=0, timeout=1.0) -> Optional[PLCSnapshot]:
+        """
+        Block until a snapshot newer than after_sequence is published.
+
+        :return: the new snapshot, or None on timeout
+        """
+        with self._updated:
+            if not self._updated.wait_for(
+                    lambda: self._snapshot is not None and self._snapshot.sequence > after_sequence,
+                    timeout):
+                return None
+            return self._snapshot
+
+    def metrics(self):
+        """
+        Poll statistics: cycles, overruns, errors, last and max latency and staleness in seconds.
+        """
+        snapshot = self._snapshot
+        return {
+            "cycles": self.cycles,
+            "overruns": self.overruns,
+            "errors": self.errors,
+            "latency": snapshot.latency if snapshot else None,
+            "max_latency": self.max_latency,
+            "staleness": self.staleness(),
+        }
+
+    def stop(self):
+        """
+        Stop polling and wait for the thread to exit.
+        """
+        self._running.clear()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join()
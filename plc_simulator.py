@@ -0,0 +1,407 @@
+"""
+Loopback Modbus TCP simulator of the gantry PLC program (GantryAutomation_V2).
+
+GantryPLCSimulator answers the Modbus requests issued by PyPLCConnection and
+AsyncPyPLCConnection with the coil and holding register map of
+PLC/GantryAutomation_V2_EXPORT_CMORE.csv:
+
+    coils     1/2 z up/down, 3/4 y right/left, 5 distance sensor, 13 extruder,
+              16 motor disable, 17 Z correction enable
+    registers 6 distance sensor, 10/12 Y/Z pulse rate, 16 layer height,
+              18/19 Z/Y pulses per rev, 20/21 Z/Y screw lead, 22 Z gear ratio,
+              23 tolerance, 27 cumulative Z display
+
+While a motion coil is on, the axis moves at pulse_rate / pulses_per_mm mm/s. While the
+Z correction coil is on, the simulated ladder scan moves Z until the measured distance is
+within tolerance of the layer height. Register 6 reports the distance along the tilted
+sensor beam, so read_current_distance() returns the vertical gap between the nozzle and
+the bed surface under it. The bed surface is flat unless bed_height(x, y) is given.
+
+Motion is integrated lazily from a monotonic clock whenever a request arrives, so the
+simulator has no tick thread. It speaks Modbus TCP directly (functions 1-6, 15 and 16)
+and does not depend on the pymodbus server datastore.
+
+    with GantryPLCSimulator(bed_height=lambda x, y: 0.002 * y) as sim:
+        plc = PyPLCConnection(sim.host, sim.port)
+        plc.travel(Y_RIGHT_MOTION, 100, "mm", "y")
+        print(sim.y, plc.read_current_distance())
+
+    python plc_simulator.py --port 5020
+"""
+import argparse
+import asyncio
+import math
+import random
+import struct
+import threading
+import time
+
+from PyPLCConnection import (
+    DIP_SWITCH_SETTING_Y, DIP_SWITCH_SETTING_Y_ADDRESS, DIP_SWITCH_SETTING_Z, DIP_SWITCH_SETTING_Z_ADDRESS,
+    DISABLE_PIN, DISTANCE_DATA_ADDRESS, DISTANCE_SENSOR_ANGLE, LAYER_HEIGHT_ADDRESS, LEAD_Y_SCREW,
+    LEAD_Y_SCREW_ADDRESS, LEAD_Z_SCREW, LEAD_Z_SCREW_ADDRESS, PPS_Y_ADDRESS, PPS_Z_ADDRESS,
+    TOLERANCE_ADDRESS, Y_LEFT_MOTION, Y_RIGHT_MOTION, Z_CORRECTION_ENABLE, Z_DOWN_MOTION,
+    Z_GEAR_RATIO, Z_GEAR_RATIO_ADDRESS, Z_UP_MOTION,
+)
+
+COIL_COUNT = 1024       # MC block size in the export
+REGISTER_COUNT = 2048   # MHR block size in the export
+SCAN_TIME = 0.01        # seconds per simulated ladder scan of the Z correction program
+
+# Modbus function codes
+READ_COILS = 0x01
+READ_DISCRETE_INPUTS = 0x02
+READ_HOLDING_REGISTERS = 0x03
+READ_INPUT_REGISTERS = 0x04
+WRITE_SINGLE_COIL = 0x05
+WRITE_SINGLE_REGISTER = 0x06
+WRITE_MULTIPLE_COILS = 0x0F
+WRITE_MULTIPLE_REGISTERS = 0x10
+
+# Modbus exception codes
+ILLEGAL_FUNCTION = 0x01
+ILLEGAL_DATA_ADDRESS = 0x02
+ILLEGAL_DATA_VALUE = 0x03
+
+
+class GantryPLCSimulator:
+    """
+    Modbus TCP server emulating the gantry PLC, run on a background thread.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, z=50.0, y=0.0, nozzle_x=0.0,
+                 bed_height=None, y_limits=(0.0, 3000.0), z_limits=(0.0, 1000.0),
+                 latency=0.0, jitter=0.0, seed=None, clock=time.monotonic, sensor_scale=1, sensor_noise=0.0):
+        """
+        :param host: interface to listen on
+        :param port: TCP port, 0 picks a free port (see address)
+        :param z: initial gap in mm between the nozzle and the bed at height 0
+        :param y: initial Y axis position in mm
+        :param nozzle_x: X position in mm of the nozzle over the bed, see set_nozzle_x()
+        :param bed_height: optional callable (x, y) -> bed surface height in mm under the nozzle
+        :param y_limits: (min, max) Y travel in mm, the limit switches stop the axis there
+        :param z_limits: (min, max) Z travel in mm
+        :param latency: seconds added before every reply
+        :param jitter: extra uniformly distributed delay in [0, jitter] seconds
+        :param seed: random seed for reproducible jitter and sensor noise
+        :param clock: time source of the motion integration, e.g. a job_simulator.VirtualClock
+        :param sensor_scale: register 6 counts per mm along the sensor beam, 1 like the PLC program,
+                             e.g. 100 for a distance_sensor.SensorModel(scale=0.01)
+        :param sensor_noise: standard deviation in mm of the beam distance noise
+        """
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.bed_height = bed_height
+        self.y_limits = y_limits
+        self.z_limits = z_limits
+        self._random = random.Random(seed)
+        self.clock = clock
+        self.sensor_scale = sensor_scale
+        self.sensor_noise = sensor_noise
+
+        self._lock = threading.RLock()
+        self.coils = [False] * COIL_COUNT           # index = 1-based coil address - 1
+        self.registers = [0] * REGISTER_COUNT       # index = 1-based register address - 1
+        self.y = y
+        self.z = z
+        self.nozzle_x = nozzle_x
+        self._last = clock()
+
+        # the PLC program's power-up values of the drive parameters
+        for address, value in ((PPS_Y_ADDRESS, 40000), (PPS_Z_ADDRESS, 60000),
+                               (DIP_SWITCH_SETTING_Y_ADDRESS, DIP_SWITCH_SETTING_Y),
+                               (DIP_SWITCH_SETTING_Z_ADDRESS, DIP_SWITCH_SETTING_Z),
+                               (LEAD_Y_SCREW_ADDRESS, round(LEAD_Y_SCREW)),
+                               (LEAD_Z_SCREW_ADDRESS, LEAD_Z_SCREW),
+                               (Z_GEAR_RATIO_ADDRESS, Z_GEAR_RATIO)):
+            self.registers[address - 1] = value
+
+        # counters
+        self.requests = 0
+        self.connections = 0
+        self.corrections = 0    # scans in which the Z correction program moved the axis
+
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._ready = threading.Event()
+        self._error = None      # exception that stopped the server from starting
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    @property
+    def address(self):
+        return f"{self.host}:{self.port}"
+
+    def start(self):
+        """
+        Start serving on a background thread with its own event loop.
+
+        :raises OSError: if the server cannot bind, e.g. the port is in use or needs root
+        """
+        self._ready.clear()
+        self._error = None
+        self._thread = threading.Thread(target=self._serve, name="GantryPLCSimulator", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        if self._error is not None:
+            self._thread.join()
+            self._thread = None
+            raise self._error
+
+    def stop(self):
+        """
+        Stop the server and its thread.
+        """
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+        if self._thread is not None:
+            self._thread.join()
+        self._thread = None
+
+    def _serve(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._server = self._loop.run_until_complete(
+                asyncio.start_server(self._handle_client, self.host, self.port))
+        except Exception as e:
+            self._error = e
+            self._loop.close()
+            self._loop = None
+            self._ready.set()
+            return
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._ready.set()
+        try:
+            self._loop.run_forever()
+        finally:
+            self._server.close()
+            clients = asyncio.all_tasks(self._loop)
+            for task in clients:
+                task.cancel()
+            self._loop.run_until_complete(asyncio.gather(*clients, return_exceptions=True))
+            self._loop.close()
+            self._loop = None
+
+    # === Simulation ===
+
+    def set_nozzle_x(self, x):
+        """
+        Position of the nozzle across the bed, e.g. the robot X, used for bed_height(x, y).
+        """
+        with self._lock:
+            self._advance(self.clock())
+            self.nozzle_x = x
+
+    def position(self):
+        """
+        :return: (y, z) axis positions in mm
+        """
+        with self._lock:
+            self._advance(self.clock())
+            return self.y, self.z
+
+    def gap(self):
+        """
+        Vertical distance in mm from the nozzle to the bed surface under it.
+        """
+        with self._lock:
+            self._advance(self.clock())
+            return self._gap()
+
+    def _gap(self):
+        surface = self.bed_height(self.nozzle_x, self.y) if self.bed_height is not None else 0.0
+        return self.z - surface
+
+    def _speed(self, axis):
+        # mm/s of an axis from the pulse rate and drive registers, 0 if a parameter is unset
+        if axis == "z":
+            pps, per_rev, lead, gear_ratio = (self.registers[PPS_Z_ADDRESS - 1],
+                                              self.registers[DIP_SWITCH_SETTING_Z_ADDRESS - 1],
+                                              self.registers[LEAD_Z_SCREW_ADDRESS - 1],
+                                              self.registers[Z_GEAR_RATIO_ADDRESS - 1])
+        else:
+            # the Y screw lead (2.54 mm) does not fit an integer register, use the constant
+            pps, per_rev, lead, gear_ratio = (self.registers[PPS_Y_ADDRESS - 1],
+                                              self.registers[DIP_SWITCH_SETTING_Y_ADDRESS - 1],
+                                              LEAD_Y_SCREW, 1)
+        if not (per_rev and lead and gear_ratio):
+            return 0.0
+        return pps / (per_rev * gear_ratio / lead)
+
+    def _direction(self, positive_coil, negative_coil):
+        return int(self.coils[positive_coil - 1]) - int(self.coils[negative_coil - 1])
+
+    def _advance(self, now):
+        """
+        Integrate both axes from the last request up to now. Coils and registers only change
+        on requests, so the velocities are constant in between except for the Z correction
+        program, which is stepped one scan at a time.
+        """
+        dt = now - self._last
+        if dt <= 0:
+            return
+        self._last = now
+        if self.coils[DISABLE_PIN - 1]:
+            return
+
+        y_velocity = self._direction(Y_RIGHT_MOTION, Y_LEFT_MOTION) * self._speed("y")
+        z_velocity = self._direction(Z_UP_MOTION, Z_DOWN_MOTION) * self._speed("z")
+        correcting = self.coils[Z_CORRECTION_ENABLE - 1]
+        if not correcting or z_velocity:
+            # manual Z motion has priority over the correction program
+            self.y = min(max(self.y + y_velocity * dt, self.y_limits[0]), self.y_limits[1])
+            self.z = min(max(self.z + z_velocity * dt, self.z_limits[0]), self.z_limits[1])
+            return
+
+        layer_height = self.registers[LAYER_HEIGHT_ADDRESS - 1]
+        tolerance = self.registers[TOLERANCE_ADDRESS - 1]
+        z_speed = self._speed("z")
+        while dt > 0:
+            step = min(dt, SCAN_TIME)
+            dt -= step
+            self.y = min(max(self.y + y_velocity * step, self.y_limits[0]), self.y_limits[1])
+            error = self._gap() - layer_height
+            if abs(error) > tolerance:
+                # move toward the layer height, never past it within one scan
+                move = min(abs(error), z_speed * step)
+                self.z = min(max(self.z - math.copysign(move, error), self.z_limits[0]), self.z_limits[1])
+                self.corrections += 1
+
+    def _sensor_value(self):
+        # distance along the sensor beam, tilted DISTANCE_SENSOR_ANGLE degrees from vertical
+        beam = self._gap() / math.cos(math.radians(DISTANCE_SENSOR_ANGLE))
+        if self.sensor_noise:
+            beam += self._random.gauss(0.0, self.sensor_noise)
+        return min(max(int(beam * self.sensor_scale), 0), 0xFFFF)
+
+    # === Modbus TCP ===
+
+    async def _handle_client(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                header = await reader.readexactly(7)
+                transaction, protocol, length, unit = struct.unpack(">HHHB", header)
+                pdu = await reader.readexactly(length - 1)
+                reply = self.handle_pdu(pdu)
+                delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                writer.write(struct.pack(">HHHB", transaction, protocol, len(reply) + 1, unit) + reply)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    def handle_pdu(self, pdu):
+        """
+        Answer one Modbus request PDU (function code and data, without the MBAP header).
+        Also usable without the TCP server, e.g. by an in-process client.
+        """
+        function = pdu[0]
+        with self._lock:
+            self.requests += 1
+            self._advance(self.clock())
+            try:
+                return bytes([function]) + self._function(function, pdu[1:])
+            except _ModbusError as e:
+                return bytes([function | 0x80, e.code])
+            except (struct.error, IndexError):
+                return bytes([function | 0x80, ILLEGAL_DATA_VALUE])
+
+    @staticmethod
+    def _check(address, count, size):
+        if count < 1 or address + count > size:
+            raise _ModbusError(ILLEGAL_DATA_ADDRESS)
+
+    def _function(self, function, data):
+        if function in (READ_COILS, READ_DISCRETE_INPUTS):
+            address, count = struct.unpack(">HH", data[:4])
+            self._check(address, count, COIL_COUNT)
+            bits = self.coils[address:address + count] if function == READ_COILS else [False] * count
+            packed = bytearray((count + 7) // 8)
+            for i, bit in enumerate(bits):
+                if bit:
+                    packed[i // 8] |= 1 << (i % 8)
+            return bytes([len(packed)]) + bytes(packed)
+
+        if function in (READ_HOLDING_REGISTERS, READ_INPUT_REGISTERS):
+            address, count = struct.unpack(">HH", data[:4])
+            self._check(address, count, REGISTER_COUNT)
+            self.registers[DISTANCE_DATA_ADDRESS - 1] = self._sensor_value()
+            values = self.registers[address:address + count]
+            return bytes([2 * count]) + struct.pack(">%dH" % count, *values)
+
+        if function == WRITE_SINGLE_COIL:
+            address, value = struct.unpack(">HH", data[:4])
+            self._check(address, 1, COIL_COUNT)
+            if value not in (0x0000, 0xFF00):
+                raise _ModbusError(ILLEGAL_DATA_VALUE)
+            self.coils[address] = value == 0xFF00
+            return data[:4]
+
+        if function == WRITE_SINGLE_REGISTER:
+            address, value = struct.unpack(">HH", data[:4])
+            self._check(address, 1, REGISTER_COUNT)
+            self.registers[address] = value
+            return data[:4]
+
+        if function == WRITE_MULTIPLE_COILS:
+            address, count, size = struct.unpack(">HHB", data[:5])
+            self._check(address, count, COIL_COUNT)
+            packed = data[5:5 + size]
+            for i in range(count):
+                self.coils[address + i] = bool(packed[i // 8] >> (i % 8) & 1)
+            return data[:4]
+
+        if function == WRITE_MULTIPLE_REGISTERS:
+            address, count, size = struct.unpack(">HHB", data[:5])
+            self._check(address, count, REGISTER_COUNT)
+            self.registers[address:address + count] = struct.unpack(">%dH" % count, data[5:5 + 2 * count])
+            return data[:4]
+
+        raise _ModbusError(ILLEGAL_FUNCTION)
+
+
+class _ModbusError(Exception):
+    def __init__(self, code):
+        super().__init__(code)
+        self.code = code
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Loopback Modbus TCP simulator of the gantry PLC")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5020, help="502 needs root on Linux")
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--z", type=float, default=50.0, help="initial nozzle to bed gap in mm")
+    parser.add_argument("--bed-slope", type=float, default=0.0, help="bed rise in mm per mm of Y travel")
+    parser.add_argument("--sensor-scale", type=int, default=1, help="distance register counts per mm of beam")
+    parser.add_argument("--sensor-noise", type=float, default=0.0, help="beam distance noise in mm (std dev)")
+    args = parser.parse_args()
+
+    slope = args.bed_slope
+    simulator = GantryPLCSimulator(args.host, args.port, z=args.z,
+                                   bed_height=(lambda x, y: slope * y) if slope else None,
+                                   latency=args.latency_ms / 1000, jitter=args.jitter_ms / 1000,
+                                   sensor_scale=args.sensor_scale, sensor_noise=args.sensor_noise)
+    simulator.start()
+    print(f"Gantry PLC simulator listening on {simulator.address}")
+    try:
+        while True:
+            time.sleep(1)
+            y, z = simulator.position()
+            print(f"\rY: {y:8.2f} mm  Z: {z:8.2f} mm  gap: {simulator.gap():7.2f} mm", end="")
+    except KeyboardInterrupt:
+        simulator.stop()
@@ -0,0 +1,247 @@
+"""
+Tag database of the Modbus-visible PLC memory, loaded from the C-more exports in PLC/.
+
+A Do-more/BRX export (PLC/*_EXPORT_CMORE.csv) lists every element the project uses. The
+Modbus TCP server exposes the MC block as coils and the MHR block as holding registers.
+The gantry program mirrors them index for index into C and D memory (MC17 <-> C17
+z_enable, MHR16 <-> D16 layer_height), so an MC/MHR tag takes the nickname of its C/D
+partner and falls back to the element name (MHR27) when the partner has none. Element
+names always work as aliases.
+
+read_plan() coalesces the requested tags into the fewest Modbus block reads, reading
+across small gaps rather than sending another frame, and caches the plan per tag set:
+
+    tags = TagDatabase.from_export("PLC/GantryAutomation_V2_EXPORT_CMORE.csv")
+    plan = tags.read_plan(["z_measured", "pps_y", "pulse_rate", "layer_height"])
+    # -> one read of holding registers 6..16
+"""
+import csv
+import re
+import struct
+from typing import NamedTuple
+
+COIL = "coil"
+HOLDING = "holding"
+
+# Modbus limits per request
+MAX_READ_COILS = 2000
+MAX_READ_REGISTERS = 125
+COALESCE_GAP = 16       # unused addresses read to join two blocks, cheaper than another frame
+
+# data type -> (struct format of one value, number of 16 bit words)
+DATA_TYPES = {
+    "DISCRETE": (None, 1),
+    "SIGNED_INT_16": ("h", 1),
+    "UNSIGNED_INT_16": ("H", 1),
+    "SIGNED_INT_32": ("i", 2),
+    "UNSIGNED_INT_32": ("I", 2),
+    "FLOATING_PT_32": ("f", 2),
+}
+
+# elements whose block type does not fit their values: the pulse rates go up to 60000,
+# beyond SIGNED_INT_16, and PyPLCConnection.pulse_rate() reads them unsigned
+DATA_TYPE_OVERRIDES = {"MHR10": "UNSIGNED_INT_16", "MHR12": "UNSIGNED_INT_16"}
+
+# Modbus server blocks of the export -> table, and the memory the program mirrors them to
+MODBUS_BLOCKS = {"MC": (COIL, "C"), "MHR": (HOLDING, "D")}
+
+_ELEMENT = re.compile(r"^([A-Z]+)(\d+)$")
+
+
+class Tag(NamedTuple):
+    """
+    One Modbus-visible PLC value.
+    """
+    name: str
+    table: str              # COIL or HOLDING
+    address: int            # 1-based address, as used by PyPLCConnection
+    data_type: str          # key of DATA_TYPES
+    word_order: str = "big" # "big": high word first (BRX), "little": low word first
+    element: str = ""       # PLC element, e.g. "MHR6"
+
+    @property
+    def words(self):
+        return DATA_TYPES[self.data_type][1]
+
+    def encode(self, value):
+        """
+        :return: list of 16 bit register words, or the bool for a coil
+        """
+        if self.table == COIL:
+            return bool(value)
+        fmt = DATA_TYPES[self.data_type][0]
+        if fmt == "f":
+            raw = struct.pack(">f", float(value))
+        else:
+            # two's complement in the register width, like the PLC stores an out of range value
+            raw = struct.pack(">" + fmt.upper(), int(value) & (0xFFFF if self.words == 1 else 0xFFFFFFFF))
+        words = list(struct.unpack(">%dH" % self.words, raw))
+        return words if self.word_order == "big" else words[::-1]
+
+    def decode(self, words):
+        """
+        :param words: the tag's register words as read, or the coil bit
+        """
+        if self.table == COIL:
+            return bool(words)
+        words = list(words) if self.word_order == "big" else list(words)[::-1]
+        fmt = DATA_TYPES[self.data_type][0]
+        return struct.unpack(">" + fmt, struct.pack(">%dH" % self.words, *words))[0]
+
+
+class ReadBlock(NamedTuple):
+    """
+    One Modbus read request of a read plan.
+    """
+    table: str
+    start: int          # first 1-based address
+    count: int          # coils or registers to read
+    tags: tuple         # tags decoded from this block
+
+
+class TagDatabase:
+    """
+    Indexed tag table with cached, coalesced read plans.
+    """
+
+    def __init__(self, tags=(), max_gap=COALESCE_GAP):
+        """
+        :param tags: iterable of Tag
+        :param max_gap: largest run of unused addresses read to merge two blocks
+        """
+        self.max_gap = max_gap
+        self._tags = {}
+        self._plans = {}
+        for tag in tags:
+            self.add(tag)
+
+    @classmethod
+    def from_export(cls, path, word_order="big", max_gap=COALESCE_GAP, data_types=DATA_TYPE_OVERRIDES):
+        """
+        Load the MC (coil) and MHR (holding register) elements of a C-more export.
+
+        :param data_types: {element or tag name: data type} replacing the block's data type
+        """
+        blocks = {}         # block name -> data type
+        nicknames = {}      # element -> nickname
+        elements = []
+        section = None
+        with open(path, newline="") as export:
+            for row in csv.reader(export):
+                if not row or row[0].startswith("//"):
+                    continue
+                if row[0].startswith("#BEGIN"):
+                    section = row[0].split()[1]
+                    continue
+                if row[0].startswith("#"):
+                    section = None
+                    continue
+                if section == "DM_BUILTIN_DATA_BLOCKS" and len(row) > 2:
+                    blocks[row[0]] = row[2]
+                elif section == "DM_NICKNAMES" and len(row) > 2:
+                    nickname, element = row[0].strip(), row[2].strip()
+                    if nickname:
+                        nicknames[element] = nickname
+                    elements.append(element)
+
+        tags = []
+        for element in dict.fromkeys(elements):
+            match = _ELEMENT.match(element)
+            if match is None or match.group(1) not in MODBUS_BLOCKS:
+                continue
+            block, index = match.group(1), int(match.group(2))
+            table, partner = MODBUS_BLOCKS[block]
+            name = nicknames.get(element) or nicknames.get(f"{partner}{index}") or element
+            data_type = data_types.get(element) or data_types.get(name) \
+                or blocks.get(block, "DISCRETE" if table == COIL else "SIGNED_INT_16")
+            tags.append(Tag(name, table, index, data_type, word_order, element))
+        return cls(tags, max_gap)
+
+    def add(self, tag, *aliases):
+        """
+        Add a tag, reachable by its name, its element and any aliases.
+        """
+        for key in (tag.name, tag.element, *aliases):
+            if key:
+                self._tags[key] = tag
+        self._plans.clear()
+        return tag
+
+    def __getitem__(self, name):
+        try:
+            return self._tags[name]
+        except KeyError:
+            raise KeyError(f"Unknown PLC tag '{name}'") from None
+
+    def __contains__(self, name):
+        return name in self._tags
+
+    def __len__(self):
+        return len(self.tags)
+
+    @property
+    def tags(self):
+        """
+        Distinct tags sorted by table and address.
+        """
+        return sorted(set(self._tags.values()), key=lambda t: (t.table, t.address))
+
+    def read_plan(self, names):
+        """
+        Block reads covering the named tags, adjacent tags coalesced into one request.
+
+        :return: tuple of ReadBlock
+        """
+        key = frozenset(names)
+        plan = self._plans.get(key)
+        if plan is None:
+            plan = self._plans[key] = self._coalesce({self[name] for name in key})
+        return plan
+
+    def _coalesce(self, tags):
+        plan = []
+        for table, limit in ((COIL, MAX_READ_COILS), (HOLDING, MAX_READ_REGISTERS)):
+            start = end = None
+            members = []
+            for tag in sorted((t for t in tags if t.table == table), key=lambda t: t.address):
+                tag_end = tag.address + tag.words - 1
+                if members and tag.address - end - 1 <= self.max_gap and max(end, tag_end) - start < limit:
+                    end = max(end, tag_end)
+                    members.append(tag)
+                    continue
+                if members:
+                    plan.append(ReadBlock(table, start, end - start + 1, tuple(members)))
+                start, end, members = tag.address, tag_end, [tag]
+            if members:
+                plan.append(ReadBlock(table, start, end - start + 1, tuple(members)))
+        return tuple(plan)
+
+    @staticmethod
+    def decode(block, values):
+        """
+        Decode the bits or registers read for one ReadBlock.
+
+        :return: dict {Tag: value}
+        """
+        result = {}
+        for tag in block.tags:
+            offset = tag.address - block.start
+            raw = values[offset] if tag.table == COIL else values[offset:offset + tag.words]
+            result[tag] = tag.decode(raw)
+        return result
+
+    def encode(self, values):
+        """
+        Encode {tag name: value} into coil and register writes.
+
+        :return: ({coil_address: bool}, {register_address: word})
+        """
+        coils, registers = {}, {}
+        for name, value in values.items():
+            tag = self[name]
+            if tag.table == COIL:
+                coils[tag.address] = tag.encode(value)
+            else:
+                for offset, word in enumerate(tag.encode(value)):
+                    registers[tag.address + offset] = word
+        return coils, registers
@@ -0,0 +1,497 @@
+"""
+Toolpath intermediate representation and compiler for wall prints.
+
+A Toolpath is a list of layers, each a list of straight segments to an end pose with
+extrusion on or off, a speed, a Z mode and the gantry position the layer is printed at:
+
+    path = Toolpath(travel_speed=200, print_speed=12)
+    for n in range(4):
+        layer = path.layer(z=n * 3.5)
+        layer.travel(-60, -400)
+        layer.print(-60, 400).print(100, 400).print(100, -400).print(-60, -400)
+
+compile_toolpath() validates the whole path against the workspace limits before anything
+moves and turns it into a flat command stream for the robot and the PLC:
+
+    - redundant speed and extruder commands are dropped, zero length moves removed and
+      collinear segments with the same extrusion and speed merged
+    - a change of gantry position compiles to extruder off, lift, gantry travel, lower
+    - every command carries an estimated duration, so a print can be timed up front
+    - with a bed_map (see bed_map.py) every pose Z follows the measured bed surface
+
+    program = compile_toolpath(path)
+    print(program.estimate(), len(program))
+    program.run(woody, plc)
+"""
+import math
+from typing import NamedTuple
+
+from PyPLCConnection import (
+    Y_LEFT_MOTION, Y_RIGHT_MOTION, Z_DOWN_MOTION, Z_UP_MOTION, pulses_per_mm,
+)
+
+# Z modes of a segment
+Z_LAYER = "layer"           # z is relative to the layer height
+Z_ABSOLUTE = "absolute"     # z is a robot user frame coordinate
+
+# Command operations
+SPEED = "speed"             # robot speed in mm/s
+EXTRUDER = "extruder"       # "on" / "off"
+MOVE = "move"               # robot cartesian move to [X, Y, Z, W, P, R]
+GANTRY = "gantry"           # (motion coil, distance mm, axis)
+Z_CORRECTION = "z_correction"   # "on" / "off"
+FRAME = "frame"             # robot (user frame, user tool)
+
+DEFAULT_ORIENTATION = (0, 90, 0)    # W, P, R of the wall scripts
+DEFAULT_PULSE_RATES = {"y": 40000, "z": 60000}
+LIFT_HEIGHT = 20            # mm the nozzle is lifted while the gantry moves
+COLLINEAR_TOLERANCE = 1e-6  # mm a merged vertex may deviate from the straight line
+STREAM_BATCH = 64           # moves per streamed run in run_commands()
+
+
+class ToolpathError(ValueError):
+    """
+    Raised by compile_toolpath() with every problem found in the path.
+    """
+
+    def __init__(self, problems):
+        super().__init__("Invalid toolpath:\n  " + "\n  ".join(problems))
+        self.problems = problems
+
+
+class Limits(NamedTuple):
+    """
+    Workspace limits checked by the compiler, (min, max) in mm and mm/s.
+    The defaults cover the poses of the wall scripts, pass the real cell limits.
+    """
+    x: tuple = (-300.0, 300.0)
+    y: tuple = (-500.0, 500.0)
+    z: tuple = (-100.0, 400.0)
+    gantry_y: tuple = (-3000.0, 3000.0)
+    gantry_z: tuple = (-1000.0, 1000.0)
+    speed: tuple = (1, 300)           # robot.set_speed() range, whole mm/s
+
+
+class Segment(NamedTuple):
+    """
+    Straight move to (x, y, z) in the robot user frame.
+    """
+    x: float
+    y: float
+    z: float = 0.0
+    extrude: bool = False
+    speed: float = None         # mm/s, None: the toolpath's travel or print speed
+    z_mode: str = Z_LAYER
+    z_correct: bool = False     # run the PLC Z correction while this segment prints
+
+
+class Layer:
+    """
+    Segments printed at one layer height and gantry position.
+    """
+
+    def __init__(self, z=0.0, gantry_y=0.0, gantry_z=0.0):
+        """
+        :param z: robot Z of the layer, base of Z_LAYER segments
+        :param gantry_y: gantry Y position in mm while the layer prints
+        :param gantry_z: gantry Z position in mm while the layer prints
+        """
+        self.z = z
+        self.gantry_y = gantry_y
+        self.gantry_z = gantry_z
+        self.segments = []
+
+    def add(self, segment):
+        self.segments.append(segment)
+        return self
+
+    def travel(self, x, y, z=0.0, speed=None, z_mode=Z_LAYER):
+        """
+        Move without extruding, chainable.
+        """
+        return self.add(Segment(x, y, z, False, speed, z_mode))
+
+    def print(self, x, y, z=0.0, speed=None, z_mode=Z_LAYER, z_correct=False):
+        """
+        Move while extruding, chainable.
+        """
+        return self.add(Segment(x, y, z, True, speed, z_mode, z_correct))
+
+
+class Toolpath:
+    """
+    Layers of segments plus the defaults they share.
+    """
+
+    def __init__(self, travel_speed=200, print_speed=12, orientation=DEFAULT_ORIENTATION):
+        """
+        :param travel_speed: mm/s of segments without extrusion
+        :param print_speed: mm/s of extruding segments
+        :param orientation: W, P, R of every pose
+        """
+        self.travel_speed = travel_speed
+        self.print_speed = print_speed
+        self.orientation = tuple(orientation)
+        self.layers = []
+
+    def layer(self, z=0.0, gantry_y=None, gantry_z=None):
+        """
+        Append a layer, the gantry stays where the previous layer left it unless given.
+        """
+        previous = self.layers[-1] if self.layers else None
+        if gantry_y is None:
+            gantry_y = previous.gantry_y if previous else 0.0
+        if gantry_z is None:
+            gantry_z = previous.gantry_z if previous else 0.0
+        layer = Layer(z, gantry_y, gantry_z)
+        self.layers.append(layer)
+        return layer
+
+
+class Command(NamedTuple):
+    """
+    One robot or PLC action of a compiled Program.
+    """
+    op: str
+    value: object
+    duration: float = 0.0   # estimated seconds
+    layer: int = 0          # index of the layer that emitted the command
+
+
+class Program:
+    """
+    Validated command stream produced by compile_toolpath().
+    """
+
+    def __init__(self, commands):
+        self.commands = tuple(commands)
+
+    def __len__(self):
+        return len(self.commands)
+
+    def __iter__(self):
+        return iter(self.commands)
+
+    def estimate(self):
+        """
+        Estimated run time in seconds.
+        """
+        return sum(command.duration for command in self.commands)
+
+    def counts(self):
+        """
+        :return: dict {op: number of commands}
+        """
+        counts = {}
+        for command in self.commands:
+            counts[command.op] = counts.get(command.op, 0) + 1
+        return counts
+
+    def run(self, robot, plc, stream=False, cnt=0):
+        """
+        Execute the commands in order, see run_commands().
+        """
+        run_commands(self.commands, robot, plc, stream, cnt)
+
+
+def run_commands(commands, robot, plc, stream=False, cnt=0, batch=STREAM_BATCH):
+    """
+    Execute Commands in order as they come from the iterable.
+
+    :param robot: robot_controller.robot
+    :param plc: PyPLCConnection
+    :param stream: send runs of consecutive moves through robot.stream_cartesian_path()
+                   (requires the ros2_eip_stream_pt TP program) instead of one by one
+    :param cnt: CNT termination of streamed moves, 0 keeps exact corners
+    :param batch: most moves held back for one streamed run
+
+    If a command fails or the iterable raises, e.g. a ToolpathError from a later chunk of
+    compile_stream(), the moves held back are dropped and the extruder and the Z correction
+    are switched off before the exception propagates.
+    """
+    moves = []
+
+    def flush():
+        if moves:
+            robot.stream_cartesian_path(moves, cnt=cnt)
+            moves.clear()
+
+    try:
+        for command in commands:
+            if command.op == MOVE:
+                if stream:
+                    moves.append(list(command.value))
+                    if len(moves) >= batch:
+                        flush()
+                else:
+                    robot.write_cartesian_position(list(command.value))
+                continue
+            flush()
+            if command.op == SPEED:
+                robot.set_speed(int(round(command.value)))
+            elif command.op == EXTRUDER:
+                plc.md_extruder_switch(command.value)
+            elif command.op == Z_CORRECTION:
+                plc.z_correction(command.value)
+            elif command.op == GANTRY:
+                plc.travel(*command.value)
+            elif command.op == FRAME:
+                uframe, utool = command.value
+                robot.set_robot_uframe(uframe)
+                robot.set_robot_utool(utool)
+        flush()
+    except BaseException:
+        moves.clear()
+        _stop_outputs(plc)
+        raise
+
+
+def _stop_outputs(plc):
+    # switch the extruder and the Z correction off after a failed run, without hiding the failure
+    for switch in (plc.md_extruder_switch, plc.z_correction):
+        try:
+            switch("off")
+        except Exception as e:
+            print(f"[Toolpath] Could not switch off after the failure: {e}")
+
+
+def _collinear(a, b, c):
+    # True if b lies on the straight segment a -> c
+    ab = [b[i] - a[i] for i in range(3)]
+    ac = [c[i] - a[i] for i in range(3)]
+    length = math.dist(a[:3], c[:3])
+    if length == 0:
+        return False
+    cross = (ab[1] * ac[2] - ab[2] * ac[1], ab[2] * ac[0] - ab[0] * ac[2], ab[0] * ac[1] - ab[1] * ac[0])
+    forward = sum(ab[i] * ac[i] for i in range(3))
+    return math.hypot(*cross) / length <= COLLINEAR_TOLERANCE and 0 <= forward <= length ** 2
+
+
+class ToolpathCompiler:
+    """
+    Incremental compiler behind compile_toolpath(). It keeps the robot, extruder and gantry
+    state between layers, so layers can be compiled one at a time as they are produced
+    (see compile_stream()).
+    """
+
+    def __init__(self, toolpath, start=None, limits=Limits(), pulse_rates=None, lift=LIFT_HEIGHT, gantry=None,
+                 bed_map=None, bed_reference=None, bed_step=None):
+        """
+        :param toolpath: Toolpath supplying the speeds and the orientation
+        :param start: robot pose [X, Y, Z, ...] before the first command, used for the first
+                      move's time estimate
+        :param limits: Limits the poses, speeds and gantry positions must stay within
+        :param pulse_rates: {"y": pps, "z": pps} of the gantry axes for the time estimate
+        :param lift: mm the nozzle is lifted while the gantry moves between layers
+        :param gantry: (y, z) gantry position before the first layer, None: where the first layer prints
+        :param bed_map: bed_map.HeightMap (or any object with height(x, y)), every pose Z is raised by
+                        bed_map.height(x, y + gantry Y) - bed_reference
+        :param bed_reference: bed surface Z the toolpath's Z values are measured from, e.g. the map
+                              height where calibrate_height() ran, None: the mean of the map
+        :param bed_step: split printed segments into pieces of at most this many mm so their Z
+                         follows the map, None: only the segment ends are compensated
+        """
+        self.toolpath = toolpath
+        self.limits = limits
+        self.lift = lift
+        pulse_rates = dict(DEFAULT_PULSE_RATES, **(pulse_rates or {}))
+        self.gantry_speed = {axis: pulse_rates[axis] / pulses_per_mm(axis) for axis in ("y", "z")}
+        self.problems = []
+        # speed of the lift and lower moves around gantry travel, whole mm/s like the segments
+        self.travel_speed = round(toolpath.travel_speed)
+        self._check(self.travel_speed, limits.speed, "travel speed")
+
+        self.state = {SPEED: None, EXTRUDER: "off", Z_CORRECTION: "off"}
+        self.position = tuple(start[:3]) if start is not None else None
+        self.gantry = {"y": gantry[0], "z": gantry[1]} if gantry is not None else None
+        self._commands = []
+
+        self.bed_map = bed_map
+        self.bed_step = bed_step
+        if bed_map is not None and bed_reference is None:
+            bed_reference = bed_map.mean()
+        self.bed_reference = bed_reference
+        self._point = self.position     # last uncompensated point, start of the next segment
+
+    def _check(self, value, bounds, what):
+        if not bounds[0] <= value <= bounds[1]:
+            self.problems.append(f"{what} {value} outside [{bounds[0]}, {bounds[1]}]")
+
+    def resolve(self, index, layer):
+        """
+        Resolve a layer's segments to absolute poses and merge collinear runs. Problems are
+        collected in self.problems.
+
+        :return: [(pose, extrude, speed, z_correct)]
+        """
+        toolpath, limits = self.toolpath, self.limits
+        self._check(layer.gantry_y, limits.gantry_y, f"layer {index}: gantry Y")
+        self._check(layer.gantry_z, limits.gantry_z, f"layer {index}: gantry Z")
+        moves = []
+        for number, segment in enumerate(layer.segments):
+            where = f"layer {index} segment {number}"
+            if segment.z_mode not in (Z_LAYER, Z_ABSOLUTE):
+                self.problems.append(f"{where}: unknown Z mode '{segment.z_mode}'")
+                continue
+            z = segment.z + layer.z if segment.z_mode == Z_LAYER else segment.z
+            # the robot takes whole mm/s, check the speed that is actually sent
+            speed = round(segment.speed if segment.speed is not None else
+                          (toolpath.print_speed if segment.extrude else toolpath.travel_speed))
+            point = (segment.x, segment.y, z)
+            self._check(point[0], limits.x, f"{where}: X")
+            self._check(point[1], limits.y, f"{where}: Y")
+            self._check(speed, limits.speed, f"{where}: speed")
+
+            for point in self._compensate(point, segment.extrude, layer.gantry_y):
+                pose = point + toolpath.orientation
+                self._check(pose[2], limits.z, f"{where}: Z")
+                move = (pose, segment.extrude, speed, segment.z_correct)
+                if moves and moves[-1][0] == pose:
+                    continue    # zero length
+                if len(moves) >= 2 and moves[-1][1:] == move[1:] and _collinear(moves[-2][0], moves[-1][0], pose):
+                    moves[-1] = move
+                    continue
+                moves.append(move)
+        return moves
+
+    def _compensate(self, point, extrude, gantry_y):
+        # points of a segment ending at point with the bed height map applied, printed
+        # segments are split every bed_step mm
+        start, self._point = self._point, point
+        if self.bed_map is None:
+            return [point]
+        points = [point]
+        if self.bed_step and extrude and start is not None:
+            count = max(1, math.ceil(math.dist(start, point) / self.bed_step))
+            points = [tuple(a + (b - a) * i / count for a, b in zip(start, point)) for i in range(1, count + 1)]
+        return [(x, y, z + self.bed_map.height(x, y + gantry_y) - self.bed_reference) for x, y, z in points]
+
+    # === Emit commands, tracking robot and PLC state to skip redundant ones ===
+
+    def _emit(self, op, value, duration=0.0, layer=0):
+        if op in self.state:
+            if self.state[op] == value:
+                return
+            self.state[op] = value
+        self._commands.append(Command(op, value, duration, layer))
+
+    def _move(self, pose, speed, layer):
+        self._emit(SPEED, speed, layer=layer)
+        duration = math.dist(self.position, pose[:3]) / speed if self.position is not None else 0.0
+        self._commands.append(Command(MOVE, pose, duration, layer))
+        self.position = pose[:3]
+
+    def _take(self):
+        commands, self._commands = self._commands, []
+        return commands
+
+    def emit_layer(self, index, layer, moves):
+        """
+        :return: list of Commands printing the resolved moves of a layer
+        """
+        orientation = self.toolpath.orientation
+        targets = {"y": layer.gantry_y, "z": layer.gantry_z}
+        if self.gantry is None:
+            self.gantry = targets
+
+        # gantry moves between layers: stop extruding, lift, travel, lower. If the layer
+        # starts with a travel, the robot goes there lifted and the travel only lowers it
+        if targets != self.gantry:
+            self._emit(EXTRUDER, "off", layer=index)
+            self._emit(Z_CORRECTION, "off", layer=index)
+            lowered = self.position
+            if lowered is not None:
+                self._move((lowered[0], lowered[1], lowered[2] + self.lift) + orientation,
+                           self.travel_speed, index)
+            for axis, positive, negative in (("y", Y_RIGHT_MOTION, Y_LEFT_MOTION), ("z", Z_UP_MOTION, Z_DOWN_MOTION)):
+                distance = targets[axis] - self.gantry[axis]
+                if distance:
+                    self._commands.append(Command(GANTRY, (positive if distance > 0 else negative,
+                                                           abs(distance), "mm", axis),
+                                                  abs(distance) / self.gantry_speed[axis], index))
+            if lowered is not None and moves and not moves[0][1]:
+                resume = moves[0][0]
+                self._move((resume[0], resume[1], max(lowered[2], resume[2]) + self.lift) + orientation,
+                           self.travel_speed, index)
+            elif lowered is not None:
+                self._move(lowered + orientation, self.travel_speed, index)
+            self.gantry = targets
+
+        for pose, extrude, speed, z_correct in moves:
+            # reach the segment's speed before the extruder state changes
+            self._emit(SPEED, speed, layer=index)
+            self._emit(EXTRUDER, "on" if extrude else "off", layer=index)
+            self._emit(Z_CORRECTION, "on" if extrude and z_correct else "off", layer=index)
+            self._move(pose, speed, index)
+        return self._take()
+
+    def finish(self, index=0):
+        """
+        :return: Commands leaving the extruder and the Z correction off
+        """
+        self._emit(EXTRUDER, "off", layer=index)
+        self._emit(Z_CORRECTION, "off", layer=index)
+        return self._take()
+
+
+def compile_toolpath(toolpath, start=None, limits=Limits(), pulse_rates=None, lift=LIFT_HEIGHT,
+                     bed_map=None, bed_reference=None, bed_step=None):
+    """
+    Validate a Toolpath and compile it to a Program, see ToolpathCompiler for the parameters.
+
+    :raise ToolpathError: listing every problem found, before any command is produced
+    """
+    compiler = ToolpathCompiler(toolpath, start, limits, pulse_rates, lift,
+                                bed_map=bed_map, bed_reference=bed_reference, bed_step=bed_step)
+    resolved = [compiler.resolve(index, layer) for index, layer in enumerate(toolpath.layers)]
+    if compiler.problems:
+        raise ToolpathError(compiler.problems)
+
+    commands = []
+    for index, (layer, moves) in enumerate(zip(toolpath.layers, resolved)):
+        commands += compiler.emit_layer(index, layer, moves)
+    commands += compiler.finish(max(len(resolved) - 1, 0))
+    return Program(commands)
+
+
+def compile_stream(toolpath, layers, **kwargs):
+    """
+    Compile layers lazily as they are produced, e.g. by a G-code reader. Each layer is
+    validated before its commands are yielded, so a bad layer stops the stream before it
+    is executed. Keyword arguments are passed to ToolpathCompiler.
+
+    :param toolpath: Toolpath supplying the speeds and the orientation, its layers are ignored
+    :param layers: iterable of Layer
+    :return: generator of Command
+    """
+    compiler = ToolpathCompiler(toolpath, **kwargs)
+    index = 0
+    for index, layer in enumerate(layers):
+        moves = compiler.resolve(index, layer)
+        if compiler.problems:
+            raise ToolpathError(compiler.problems)
+        yield from compiler.emit_layer(index, layer, moves)
+    yield from compiler.finish(index)
+
+
+def rectangular_wall(toolpath, x_min, x_max, y_min, y_max, layers, layer_height, z=0.0,
+                     infill_offset=None, infill_passes=4):
+    """
+    Append the layers of a rectangular wall: a perimeter and, with infill_offset, a zigzag
+    between the inner offset lines, like the lead sequence of the PLA wall scripts.
+
+    :return: the toolpath
+    """
+    for n in range(layers):
+        layer = toolpath.layer(z + n * layer_height)
+        layer.travel(x_min, y_min)
+        layer.print(x_min, y_max).print(x_max, y_max).print(x_max, y_min).print(x_min, y_min)
+        if infill_offset is None:
+            continue
+        inner_min, inner_max = x_min + infill_offset, x_max - infill_offset
+        y_start, y_end = y_min + infill_offset, y_max - infill_offset
+        layer.travel(inner_min, y_start)
+        for k in range(1, infill_passes + 1):
+            x = inner_max if k % 2 else inner_min
+            layer.print(x, y_start + (y_end - y_start) * k / infill_passes)
+    return toolpath
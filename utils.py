@@ -18,6 +18,8 @@ sys.path.append(src_path)
 # === Custom Libraries ===
 from ArucoMarkers.detect_aruco import detect_from_image
 from robot_controller import robot
+from motion_executor import MotionPlan
+from z_control import calibrate_nozzle_height
 from PyPLCConnection import (
     PyPLCConnection,
     LEAD_Y_SCREW, LEAD_Z_SCREW,
@@ -38,11 +40,25 @@ ROBOT_IP = "192.168.1.101"  # Woody
 print("=== Program initialized ===")
 
 # === Initialize PLC and Robot ===
+# Both connect on first use, importing utils does not touch the network.
+# Call connect() to open both connections and reset the coils up front.
 plc = PyPLCConnection(PLC_IP)
 woody = robot(ROBOT_IP)
 
-print("PLC and Robot connections established.")
-plc.reset_coils()
+
+def connect(poll_hz=None):
+    """
+    Open the PLC and robot connections and turn all gantry coils off.
+
+    :param poll_hz: if given, start the PLC state poller at this rate so distance,
+                    pulse rate and safety coil reads are served from memory
+    """
+    plc.connect()
+    woody.connect()
+    print("PLC and Robot connections established.")
+    plc.reset_coils()
+    if poll_hz:
+        plc.start_poller(rate_hz=poll_hz)
 
 
 # === Parameters ===
@@ -55,8 +71,6 @@ x_offset = 13.5        # X-axis offset (mm)
 print_offset = 5       # Vertical offset between passes (mm)
 z_correction = 4       # Fine Z correction for alignment (mm)
 
-current_distance = plc.read_current_distance()
-
 flg = True
 
 
@@ -105,21 +119,27 @@ def move_to_pose(pose, layer_height, tol, extruding=True, z_correct=False):
         return apply_z_correction_brute(pose, layer_height, tol, extruding)
     return pose
 
-def lift_and_travel(pose, travel_distance, direction):
+def lift_and_travel(pose, travel_distance, direction, overlap=True):
     """
     Lift Z by Z_OFFSET and travel in a given direction using PLC motion.
+
+    With overlap the gantry starts traversing while the robot is still lifting,
+    the nozzle is lowered once the gantry has arrived.
     """
     z_offset = 20
-    plc.md_extruder_switch("off")
-    woody.set_speed(200)
+    plan = MotionPlan(woody, plc)
+    off = plan.extruder("off")
+    plan.set_speed(200)
 
-    pose[2] += z_offset
-    woody.write_cartesian_position(pose)
+    lifted = pose.copy()
+    lifted[2] += z_offset
+    lift = plan.move_robot(lifted, after=[off])
 
-    plc.travel(direction, travel_distance, 'mm', 'y')
+    travel = plan.travel(direction, travel_distance, 'mm', 'y', after=[off] if overlap else [lift])
+    plan.move_robot(pose, after=[travel])
 
-    pose[2] -= z_offset
-    woody.write_cartesian_position(pose)
+    report = plan.execute()
+    print(f"[Motion] Lift and travel took {report.makespan:.2f} s ({report.saved:.2f} s overlapped)")
     return pose
 
 def sweep_y_positions(pose, y_positions, extruding=False, z_correct=False):
@@ -151,6 +171,7 @@ def open_all_cameras(max_cameras=5):
 
 # === Functions ===
 def check_height(layer_height: float):
+    current_distance = plc.read_current_distance()
     z = woody.read_current_cartesian_pose()[2]
     print(
         f"[Check] Current distance: {current_distance:.2f} mm | "
@@ -161,35 +182,15 @@ def check_height(layer_height: float):
 def read_current_z_distance():
     return plc.read_current_distance()
 
-def calibrate_height(pose, layer_height: float):
+def calibrate_height(pose, layer_height: float, tolerance: float = 0.0, max_iterations: int = 8):
     """
     Calibrate nozzle height using PLC distance sensor feedback.
+    Moves by the measured error, then bisects, see z_control.calibrate_nozzle_height().
     """
-    while flg:
-        current_distance = plc.read_current_distance()
-
-        if current_distance / 2 > layer_height:
-            pose[2] -= current_distance / 2
-            woody.write_cartesian_position(pose)
-
-        elif current_distance > layer_height:
-            print(f"[Calibration] Distance too high: {current_distance:.2f} mm")
-            pose[2] -= 1
-            woody.write_cartesian_position(pose)
-
-        elif current_distance < layer_height:
-            print(f"[Calibration] Distance too low: {current_distance:.2f} mm")
-            pose[2] += 1
-            woody.write_cartesian_position(pose)
-
-        else:
-            z = woody.read_current_cartesian_pose()[2]
-            print(
-                f"[Calibration] Nozzle height set: {current_distance:.2f} mm | "
-                f"Starting Z: {z:.2f} mm"
-            )
-            break
-    time.sleep(2)
+    result = calibrate_nozzle_height(woody, plc.read_current_distance, pose, layer_height,
+                                     tolerance=tolerance, max_iterations=max_iterations)
+    print(result.format())
+    z = woody.read_current_cartesian_pose()[2]
     print("Height calibration complete.")
     return pose, z
 
@@ -0,0 +1,482 @@
+"""
+Fixed-rate Z height control of the nozzle over the bed.
+
+ZController replaces the ZCorrectionThread/ZLoggingThread loops of the print scripts. Each
+cycle it reads the distance sensor, asks a control law for a Z move and hands that move to
+an actuator that does not block, so the loop keeps its rate while the gantry moves.
+Cycles are scheduled on absolute time.monotonic() deadlines: a cycle that overruns its
+deadline is counted as a miss and the loop skips to the next tick instead of drifting.
+
+    controller = start_z_control(plc, target=layer_height, law=BangBang(tolerance=1))
+    ...
+    controller.set_target(next_layer_height)
+    ...
+    controller.stop()
+    print(controller.metrics())
+    controller.write_csv("z_correction.csv")
+
+The loop period, the sense-to-actuate latency and the start jitter are recorded in
+Histograms, see metrics().
+
+calibrate_nozzle_height() sets the starting height before a print in a couple of robot
+moves: the first move removes the whole measured error, later moves bisect between the
+Z positions known to read too high and too low, as the sensor only reports whole mm.
+"""
+import bisect
+import collections
+import csv
+import math
+import os
+import threading
+import time
+from typing import NamedTuple
+
+from PyPLCConnection import Z_DOWN_MOTION, Z_UP_MOTION
+
+DEFAULT_PERIOD = 0.5    # seconds per control cycle
+HISTORY = 100000        # samples kept by a controller
+CALIBRATION_SETTLE = 0.2    # seconds the sensor settles after a calibration move
+
+# 10 buckets per decade from 10 us to 10 s, for latency and jitter
+LOG_BOUNDS = tuple(1e-5 * 10 ** (i / 10) for i in range(61))
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram, cheap enough to update every control cycle.
+    """
+
+    def __init__(self, bounds=LOG_BOUNDS):
+        """
+        :param bounds: ascending upper bucket edges, larger values go to an overflow bucket
+        """
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def percentile(self, p):
+        """
+        Upper edge of the bucket holding the p-th percentile (0-100), capped at the largest value.
+        """
+        if not self.count:
+            return None
+        rank = math.ceil(self.count * p / 100)
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                edge = self.bounds[index] if index < len(self.bounds) else self.max
+                return min(edge, self.max)
+        return self.max
+
+    def buckets(self):
+        """
+        :return: list of (upper edge, count) of the non-empty buckets, inf for the overflow bucket
+        """
+        edges = self.bounds + (math.inf,)
+        return [(edges[i], count) for i, count in enumerate(self.counts) if count]
+
+    def summary(self):
+        if not self.count:
+            return {"count": 0}
+        return {"count": self.count, "mean": self.mean, "min": self.min, "max": self.max,
+                "p50": self.percentile(50), "p95": self.percentile(95), "p99": self.percentile(99)}
+
+
+# === Control laws ===
+# A law turns the height error (measured - target, mm) into the Z move of this cycle in mm,
+# positive moves the nozzle up.
+
+class BangBang:
+    """
+    Removes the whole error once it exceeds the tolerance, like apply_z_correction_gantry().
+    """
+
+    def __init__(self, tolerance=0.1, max_step=None):
+        """
+        :param tolerance: errors up to this many mm are left alone
+        :param max_step: largest move per cycle in mm, None for no limit
+        """
+        self.tolerance = tolerance
+        self.max_step = max_step
+
+    def update(self, error, dt):
+        if abs(error) <= self.tolerance:
+            return 0.0
+        move = -error
+        if self.max_step is not None:
+            move = max(-self.max_step, min(self.max_step, move))
+        return move
+
+    def reset(self):
+        pass
+
+
+class PID:
+    """
+    PID law on the height error, PI with kd=0.
+
+    The output is a move, so kp=1 removes the whole error in one cycle and the integral
+    term removes the lag behind a sloped bed. The integral is clamped (anti-windup) and
+    holds while the error is within the tolerance.
+    """
+
+    def __init__(self, kp=0.8, ki=0.0, kd=0.0, tolerance=0.0, max_step=None, integral_limit=None):
+        """
+        :param integral_limit: largest magnitude of the integral term's contribution in mm
+        """
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        self.tolerance = tolerance
+        self.max_step = max_step
+        self.integral_limit = integral_limit
+        self.reset()
+
+    def update(self, error, dt):
+        if abs(error) <= self.tolerance:
+            # inside the deadband: no move, the integral holds
+            self._last_error = None
+            return 0.0
+        if dt > 0:
+            self.integral += error * dt
+            if self.ki and self.integral_limit is not None:
+                limit = self.integral_limit / self.ki
+                self.integral = max(-limit, min(limit, self.integral))
+        derivative = (error - self._last_error) / dt if dt > 0 and self._last_error is not None else 0.0
+        self._last_error = error
+        move = -(self.kp * error + self.ki * self.integral + self.kd * derivative)
+        if self.max_step is not None:
+            move = max(-self.max_step, min(self.max_step, move))
+        return move
+
+    def reset(self):
+        self.integral = 0.0
+        self._last_error = None
+
+
+# === Actuators ===
+
+class GantryZActuator:
+    """
+    Moves the gantry Z axis with PyPLCConnection.travel_async(), command() returns as soon
+    as the motion coil is on. A command while a move is still running stops that move
+    first, the newer measurement wins.
+    """
+
+    def __init__(self, plc, min_move=0.0):
+        """
+        :param min_move: moves shorter than this many mm are ignored
+        """
+        self.plc = plc
+        self.min_move = min_move
+        self.commands = 0
+        self.preempted = 0      # moves stopped early by a newer command
+        self._future = None
+
+    def busy(self):
+        return self._future is not None and not self._future.done()
+
+    def command(self, move):
+        """
+        Start a Z move of move mm, positive up.
+
+        :return: True if a move was started
+        """
+        if abs(move) < max(self.min_move, 1e-9):
+            return False
+        if self.busy():
+            self.preempted += 1
+        self.stop()
+        self._future = self.plc.travel_async(Z_UP_MOTION if move > 0 else Z_DOWN_MOTION, abs(move), "mm", "z")
+        self.commands += 1
+        return True
+
+    def stop(self):
+        """
+        Stop a running move and wait until its coil is dropped.
+        """
+        if self._future is not None:
+            self._future.stop()
+            self._future.result()
+            self._future = None
+
+
+class ZSample(NamedTuple):
+    """
+    One control cycle.
+    """
+    timestamp: float    # time.monotonic() at the start of the cycle
+    wall_time: float    # time.time() of the same moment, for logging
+    measured: float     # nozzle to bed distance in mm
+    target: float
+    error: float        # measured - target
+    move: float         # Z move commanded in mm, 0 if none
+    latency: float      # seconds from the start of the cycle to the actuator command
+
+
+class ZController(threading.Thread):
+    """
+    Fixed-period sense -> law -> actuate loop on a background thread.
+    """
+
+    def __init__(self, sensor, actuator, law, target, period=DEFAULT_PERIOD, enabled=True,
+                 on_sample=None, history=HISTORY):
+        """
+        :param sensor: callable returning the nozzle to bed distance in mm, e.g. plc.read_current_distance
+        :param actuator: object with command(move_mm) and stop(), e.g. GantryZActuator
+        :param law: control law with update(error, dt) and reset(), e.g. BangBang or PID
+        :param target: nozzle to bed distance to hold in mm, usually the layer height
+        :param period: seconds per cycle
+        :param enabled: False only measures and logs, see enable()
+        :param on_sample: optional callable(ZSample) run every cycle, e.g. to log the robot pose
+        """
+        super().__init__(name="ZController", daemon=True)
+        if period <= 0:
+            raise ValueError(f"Control period must be positive, got {period}")
+        self.sensor = sensor
+        self.actuator = actuator
+        self.law = law
+        self.period = period
+        self.on_sample = on_sample
+        self.samples = collections.deque(maxlen=history)
+
+        self._target = target
+        self._enabled = enabled
+        self._lock = threading.Lock()
+        self._running = threading.Event()
+        self._running.set()
+
+        # metrics
+        self.cycles = 0
+        self.misses = 0         # cycles that ended after the next deadline
+        self.skipped = 0        # ticks dropped to catch up after a miss
+        self.actuations = 0
+        self.errors = 0
+        self.last_error = None
+        self.period_histogram = Histogram(tuple(period * (0.5 + 0.05 * i) for i in range(31)))
+        self.latency_histogram = Histogram()
+        self.jitter_histogram = Histogram()
+
+    @property
+    def target(self):
+        return self._target
+
+    def set_target(self, target):
+        """
+        Hold a new distance from the next cycle on, e.g. at a layer change. Resets the law.
+        """
+        with self._lock:
+            self._target = target
+            self.law.reset()
+
+    def enable(self, enabled=True):
+        """
+        Switch actuation on or off, the loop keeps measuring and logging either way.
+        """
+        with self._lock:
+            self._enabled = enabled
+            self.law.reset()
+
+    def run(self):
+        deadline = time.monotonic()
+        last_start = None
+        while self._running.is_set():
+            start = time.monotonic()
+            self.jitter_histogram.add(max(start - deadline, 0.0))
+            if last_start is not None:
+                self.period_histogram.add(start - last_start)
+            dt = start - last_start if last_start is not None else 0.0
+            last_start = start
+            try:
+                self._cycle(start, dt)
+            except Exception as e:
+                self.errors += 1
+                self.last_error = e
+                print(f"[ZController] Error: {e}")
+            self.cycles += 1
+
+            deadline += self.period
+            delay = deadline - time.monotonic()
+            if delay <= 0:
+                # keep the phase of the schedule, drop the ticks that are already past
+                self.misses += 1
+                missed = math.floor(-delay / self.period) + 1
+                self.skipped += missed - 1
+                deadline += missed * self.period
+                delay = deadline - time.monotonic()
+            time.sleep(max(delay, 0.0))
+
+    def _cycle(self, start, dt):
+        measured = self.sensor()
+        with self._lock:
+            target, enabled = self._target, self._enabled
+            error = measured - target
+            move = self.law.update(error, dt) if enabled else 0.0
+        if move and self.actuator.command(move):
+            self.actuations += 1
+        else:
+            move = 0.0
+        latency = time.monotonic() - start
+        self.latency_histogram.add(latency)
+        sample = ZSample(start, time.time(), measured, target, error, move, latency)
+        self.samples.append(sample)
+        if self.on_sample is not None:
+            self.on_sample(sample)
+
+    def stop(self):
+        """
+        Stop the loop, wait for the thread and stop a running actuator move.
+        """
+        self._running.clear()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join()
+        self.actuator.stop()
+
+    def metrics(self):
+        """
+        Cycle counts and the period, latency and jitter histogram summaries in seconds.
+        """
+        return {
+            "cycles": self.cycles,
+            "misses": self.misses,
+            "skipped": self.skipped,
+            "actuations": self.actuations,
+            "errors": self.errors,
+            "period": self.period_histogram.summary(),
+            "latency": self.latency_histogram.summary(),
+            "jitter": self.jitter_histogram.summary(),
+        }
+
+    def write_csv(self, path):
+        """
+        Append the samples to a CSV file, with a header if the file is new.
+        """
+        file_exists = os.path.isfile(path)
+        with open(path, "a", newline="") as f:
+            writer = csv.writer(f)
+            if not file_exists:
+                writer.writerow(ZSample._fields)
+            writer.writerows(self.samples)
+        print(f"[ZController] Appended {len(self.samples)} samples to {path}")
+
+
+def start_z_control(plc, target, law=None, period=DEFAULT_PERIOD, enabled=True, on_sample=None):
+    """
+    Start a ZController on the PLC distance sensor and the gantry Z axis.
+
+    :param plc: PyPLCConnection
+    :param target: nozzle to bed distance to hold in mm
+    :param law: control law, default BangBang(tolerance=0.1)
+    :return: the running ZController
+    """
+    controller = ZController(plc.read_current_distance, GantryZActuator(plc), law or BangBang(),
+                             target, period, enabled, on_sample)
+    controller.start()
+    return controller
+
+
+# === One-shot height calibration ===
+
+class CalibrationResult(NamedTuple):
+    """
+    Outcome of calibrate_nozzle_height().
+    """
+    z: float            # robot Z the nozzle was left at
+    reading: float      # sensor reading at z
+    error: float        # reading - target
+    converged: bool     # the error is within the tolerance
+    moves: int          # robot moves made
+    elapsed: float      # seconds spent
+    history: tuple      # (z, reading) of every sensor read
+
+    def format(self):
+        state = "set" if self.converged else "NOT converged"
+        return (f"[Calibration] Nozzle height {state}: {self.reading:.2f} mm (error {self.error:+.2f}) "
+                f"at Z {self.z:.2f} mm after {self.moves} moves in {self.elapsed:.1f} s")
+
+
+def calibrate_nozzle_height(robot, sensor, pose, target, tolerance=0.0, max_iterations=8,
+                            increment=1.0, resolution=0.1, max_step=None, settle=CALIBRATION_SETTLE):
+    """
+    Move the robot in Z until the sensor reads the target distance.
+
+    Each step first assumes the reading follows Z one to one and moves by the whole error
+    (a Newton step with unit slope). Once Z positions reading above and below the target are
+    known, a step leaving that bracket is replaced by its midpoint, so the integer readings
+    of read_current_distance() cannot make the search oscillate.
+
+    :param robot: robot_controller.robot, moved with write_cartesian_position(pose)
+    :param sensor: callable returning the nozzle to bed distance in mm, e.g. plc.read_current_distance
+    :param pose: [X, Y, Z, W, P, R] to calibrate at, its Z is the starting guess and is updated in place
+    :param target: distance to reach in mm, usually the layer height
+    :param tolerance: largest accepted |reading - target| in mm
+    :param max_iterations: largest number of robot moves, the move back to the closest reading included
+    :param increment: mm between two sensor readings, 1 for read_current_distance(), 0 for a
+                      continuous sensor. Once the readings at both ends of the bracket are one
+                      increment apart no Z in between reads closer to the target.
+    :param resolution: mm at which the bracket is too narrow to split further
+    :param max_step: largest Z move per iteration in mm, None for no limit
+    :param settle: seconds to wait after a move before reading the sensor
+    :return: CalibrationResult, the robot is left at the best Z found, or where the last move
+             allowed by max_iterations ended if that move made the reading worse
+    """
+    started = time.monotonic()
+    below = above = None    # (Z, reading) of the highest Z reading too close, lowest Z reading too far
+    history = []
+    moves = 0
+    z = pose[2]
+    best = None
+
+    while True:
+        reading = sensor()
+        error = reading - target
+        history.append((z, reading))
+        if best is None or abs(error) < abs(best[1] - target):
+            best = (z, reading)
+        if abs(error) <= tolerance or moves >= max_iterations:
+            break
+        if moves == max_iterations - 1 and best[0] != z:
+            break   # the last move goes back to the closest reading
+        if error > 0:
+            above = (z, reading) if above is None or z < above[0] else above
+        else:
+            below = (z, reading) if below is None or z > below[0] else below
+        bracketed = below is not None and above is not None
+        if bracketed and (above[0] - below[0] <= resolution or above[1] - below[1] <= increment):
+            break
+
+        step = z - error
+        if bracketed and not below[0] < step < above[0]:
+            step = (below[0] + above[0]) / 2
+        if max_step is not None:
+            step = z + max(-max_step, min(max_step, step - z))
+        z = step
+        pose[2] = z
+        robot.write_cartesian_position(pose)
+        moves += 1
+        time.sleep(settle)
+
+    if best[0] != z and moves < max_iterations:
+        # ran out of moves or bracket, return to the closest reading seen
+        z, reading = best
+        pose[2] = z
+        robot.write_cartesian_position(pose)
+        moves += 1
+    error = reading - target
+    return CalibrationResult(z, reading, error, abs(error) <= tolerance, moves,
+                             time.monotonic() - started, tuple(history))